@@ -11,7 +11,7 @@ https://docs.djangoproject.com/en/5.2/ref/settings/
 """
 
 from pathlib import Path
-from decouple import config 
+from decouple import config, Csv
 from datetime import timedelta
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
@@ -53,6 +53,8 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'utility.routers.ReplicaRoutingMiddleware',
+    'utility.middleware.RequestTimingMiddleware',
 ]
 
 ROOT_URLCONF = config('ROOT_URLCONF')
@@ -90,6 +92,43 @@ DATABASES = {
     }
 }
 
+# read replicas of the primary, given as the hosts they run on with the same credentials as the primary. The searches and the other read only views
+# read from one of them (see utility.routers), a user who has just written reads from the primary for REPLICA_STICKY_SECONDS
+for index, host in enumerate(config('DB_REPLICA_HOSTS', default='', cast=Csv()), start=1):
+    DATABASES[f'replica{index}'] = {**DATABASES['default'], 'HOST': host, 'TEST': {'MIRROR': 'default'}}
+
+DATABASE_REPLICAS = [alias for alias in DATABASES if alias != 'default']
+DATABASE_ROUTERS = ['utility.routers.ReplicaRouter']
+REPLICA_STICKY_SECONDS = config('REPLICA_STICKY_SECONDS', default=10, cast=int)
+
+
+# Cache
+# https://docs.djangoproject.com/en/5.2/topics/cache/
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'bus_search': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'bus-search',
+        'TIMEOUT': config('BUS_SEARCH_CACHE_TTL', default=300, cast=int),
+        'OPTIONS': {
+            'MAX_ENTRIES': config('BUS_SEARCH_CACHE_SIZE', default=1000, cast=int),
+            'CULL_FREQUENCY': 10,
+        },
+    },
+    'users': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'users',
+        'TIMEOUT': config('USER_CACHE_TTL', default=60, cast=int),
+        'OPTIONS': {
+            'MAX_ENTRIES': config('USER_CACHE_SIZE', default=10000, cast=int),
+            'CULL_FREQUENCY': 10,
+        },
+    },
+}
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
@@ -135,6 +174,9 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 SIMPLE_JWT = {
     'ACCESS_TOKEN_LIFETIME': timedelta(hours = 2),
     'REFRESH_TOKEN_LIFETIME': timedelta(days=1),
+    # the refresh and verify endpoints check the blacklist through the in memory index of the process (see user_acc.blacklist)
+    'TOKEN_REFRESH_SERIALIZER': 'user_acc.serializers.IndexedTokenRefreshSerializer',
+    'TOKEN_VERIFY_SERIALIZER': 'user_acc.serializers.IndexedTokenVerifySerializer',
 }
 
 REST_FRAMEWORK = {
@@ -142,4 +184,62 @@ REST_FRAMEWORK = {
     'PAGE_SIZE': 10
 }
 
-AUTH_USER_MODEL = 'user_acc.user'
\ No newline at end of file
+AUTH_USER_MODEL = 'user_acc.user'
+
+# width of the price buckets returned by the search facets
+BUS_FACET_PRICE_BUCKET = config('BUS_FACET_PRICE_BUCKET', default=100, cast=int)
+
+# seconds a seat hold keeps its seats before the sweeper gives them back
+SEAT_HOLD_TTL = config('SEAT_HOLD_TTL', default=600, cast=int)
+
+# seconds for which a booking can be replayed with the same Idempotency-Key
+IDEMPOTENCY_KEY_TTL = config('IDEMPOTENCY_KEY_TTL', default=86400, cast=int)
+
+# serve the search and booking views with their async variants, only worth it when running under ASGI (asgi.py)
+ASYNC_VIEWS = config('ASYNC_VIEWS', default=False, cast=bool)
+
+# seconds for which a client may reuse a bus search response (Cache-Control: private, max-age)
+BUS_SEARCH_MAX_AGE = config('BUS_SEARCH_MAX_AGE', default=30, cast=int)
+
+# seconds between two syncs of the in memory refresh token blacklist with the database (a logout also triggers one through the cache)
+BLACKLIST_SYNC_INTERVAL = config('BLACKLIST_SYNC_INTERVAL', default=5, cast=int)
+
+# pool hashing the passwords of logins, signups and password changes: 'thread' or 'process', number of workers and hashes allowed to wait for one
+PASSWORD_HASHING_EXECUTOR = config('PASSWORD_HASHING_EXECUTOR', default='thread')
+PASSWORD_HASHING_WORKERS = config('PASSWORD_HASHING_WORKERS', default=2, cast=int)
+PASSWORD_HASHING_QUEUE = config('PASSWORD_HASHING_QUEUE', default=32, cast=int)
+
+# failed logins allowed per username within the window (seconds) before its logins are refused without checking the password
+PASSWORD_ATTEMPT_LIMIT = config('PASSWORD_ATTEMPT_LIMIT', default=5, cast=int)
+PASSWORD_ATTEMPT_WINDOW = config('PASSWORD_ATTEMPT_WINDOW', default=300, cast=int)
+
+# seconds a process keeps the timetable version it read from the database, a change made by another process (a worker, the admin, the import command)
+# reaches the caches built from the timetable (route catalog, connection search, places) within this delay
+TIMETABLE_VERSION_TTL = config('TIMETABLE_VERSION_TTL', default=5, cast=int)
+
+# per request query count and db/serializer/view timings in a Server-Timing header, requests slower than SLOW_REQUEST_MS (or running more than SLOW_REQUEST_QUERIES queries) are logged with their SQL
+REQUEST_TIMING = config('REQUEST_TIMING', default=False, cast=bool)
+SLOW_REQUEST_MS = config('SLOW_REQUEST_MS', default=500, cast=int)
+SLOW_REQUEST_QUERIES = config('SLOW_REQUEST_QUERIES', default=50, cast=int)
+
+# connection search: minutes between the arrival of a bus and the departure of the next one, and seconds after which the in memory route graph is rebuilt anyway
+CONNECTION_MIN_LAYOVER = config('CONNECTION_MIN_LAYOVER', default=30, cast=int)
+CONNECTION_MAX_LAYOVER = config('CONNECTION_MAX_LAYOVER', default=360, cast=int)
+CONNECTION_INDEX_MAX_AGE = config('CONNECTION_INDEX_MAX_AGE', default=300, cast=int)
+
+# seconds after which the places autocomplete index is rebuilt to follow the bookings, it is rebuilt at once when the timetable changes
+PLACES_POPULARITY_MAX_AGE = config('PLACES_POPULARITY_MAX_AGE', default=600, cast=int)
+
+# rows read with each query of a bookings or manifest export, the memory used by an export depends on it and not on the number of rows exported
+EXPORT_CHUNK_SIZE = config('EXPORT_CHUNK_SIZE', default=2000, cast=int)
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {'class': 'logging.StreamHandler'},
+    },
+    'loggers': {
+        'utility.middleware': {'handlers': ['console'], 'level': 'WARNING', 'propagate': False},
+    },
+}
@@ -4,3 +4,6 @@ from django.apps import AppConfig
 class BusesConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'Buses'
+
+    def ready(self):
+        from Buses import signals, connections, rollups  # noqa: F401
@@ -0,0 +1,130 @@
+from Buses import views
+from Buses.serializers import BusRowSerializer
+from Buses.models import Buses
+from Buses.inventory import parseTravelDate, aseatsOnDate
+from Buses.timetable import aRouteCatalog
+from Buses.facets import asearchFacets
+from Buses.history import userBookings
+from Buses.exports import aexportLines
+
+from asgiref.sync import sync_to_async
+
+from utility.asyncviews import AsyncAPIView
+from utility.functions import searchOrdering
+from utility.pagination import KeysetPagination
+from utility.middleware import timed
+
+from rest_framework.response import Response
+from rest_framework import status
+from rest_framework.pagination import PageNumberPagination
+from rest_framework import exceptions
+
+from django.conf import settings
+from django.utils.cache import patch_cache_control
+from django.utils.http import parse_etags
+
+# Async variants of the read heavy views, they answer exactly like the views in Buses.views but wait on the database
+# with the async ORM so that under ASGI a worker keeps serving other requests meanwhile. They are routed instead of
+# the synchronous ones when ASYNC_VIEWS is set, see Buses.urls
+
+class SourceDestOptions(AsyncAPIView, views.SourceDestOptions):
+
+    async def get(self, request):
+        """async version of Buses.views.SourceDestOptions.get"""
+        catalog = await aRouteCatalog()
+        if catalog['etag'] in parse_etags(request.headers.get('If-None-Match', '')):
+            response = Response(status=status.HTTP_304_NOT_MODIFIED)
+        else:
+            response = Response({"status":"Success", 'data' : catalog['data']}, status=status.HTTP_200_OK)
+
+        response['ETag'] = catalog['etag']
+        patch_cache_control(response, private=True, no_cache=True)
+        return response
+
+class BusesData(AsyncAPIView, views.BusesData):
+
+    async def get(self, request):
+        """async version of Buses.views.BusesData.get"""
+        try:
+            source = request.query_params.get('source')
+            destination = request.query_params.get('destination')
+            date = request.query_params.get('date')
+
+            if source and destination:
+                cacheKey, response = self.cachedSearch(request)
+                if response is not None:
+                    return response
+
+                busdata = self.searchQuery(request)
+                ordering = searchOrdering(request.query_params.get('sorting'))
+
+                if request.query_params.get('pagination') == 'page':
+                    # Paginator has no async api, the count and the page are fetched in a thread
+                    paginator = PageNumberPagination()
+                    pageqs = await sync_to_async(paginator.paginate_queryset)(busdata.order_by(*ordering).values(), request) if await busdata.aexists() else None
+                else:
+                    paginator = KeysetPagination()
+                    pageqs = await paginator.apaginate_queryset(busdata.values(), request, ordering)
+
+                if pageqs or (pageqs is not None and request.query_params.get('cursor')):
+                    seatsLeft = await aseatsOnDate([row['bus_id'] for row in pageqs], parseTravelDate(date))
+                    facets = await asearchFacets(busdata) if request.query_params.get('facets') == 'true' else None
+                    response = self.searchResponse(paginator, pageqs, seatsLeft, facets)
+                else:
+                    response = Response({'status':"Failure", "message":"No Buses in desired duration"}, status = status.HTTP_204_NO_CONTENT)
+
+                return self.cacheSearch(cacheKey, response)
+
+            else:
+                return Response({'status':"Failure", "message":"source and destination can't be empty"}, status=status.HTTP_400_BAD_REQUEST)
+
+        except exceptions.APIException:
+            raise
+        except Exception as e:
+            return Response({'status':"Failure", 'error':str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+class BusInfo(AsyncAPIView, views.BusInfo):
+
+    async def get(self, request, **kwargs):
+        """async version of Buses.views.BusInfo.get"""
+        try:
+            date = request.query_params.get('date')
+            travelDate = parseTravelDate(date)
+            busData = await Buses.objects.filter(bus_id = kwargs['id']).values().aget()
+            seatsLeft = await aseatsOnDate([busData['bus_id']], travelDate)
+            busData['available_seats'] = seatsLeft.get(busData['bus_id'], busData['available_seats'])
+            with timed('serializer'):
+                data = BusRowSerializer(busData, context = {'isdate':travelDate is not None, 'date':date}).data
+
+        except Buses.DoesNotExist:
+            return Response({'status':"Failure", 'message':"Bus no longer exists"}, status=status.HTTP_404_NOT_FOUND)
+
+        else:
+            return Response({"status":"Success!", 'data':data}, status=status.HTTP_200_OK)
+
+    async def post(self, request, **kwargs):
+        """the booking has to run in a transaction which the async ORM can't do, so the synchronous booking is run in a thread"""
+        return await sync_to_async(super().post)(request, **kwargs)
+
+class BookInfo(AsyncAPIView, views.BookInfo):
+
+    async def get(self, request):
+        """async version of Buses.views.BookInfo.get"""
+        try:
+            booking_entry = await userBookings(request.user).alast()
+            booking_data = self.bookingData(booking_entry)
+
+        except Exception as e:
+            return Response({'status':"Failure", 'message':str(e)}, status=status.HTTP_404_NOT_FOUND)
+
+        else:
+            return Response({'status':"Success", 'data':booking_data}, status=status.HTTP_200_OK)
+
+class BookingExport(AsyncAPIView, views.BookingExport):
+
+    async def get(self, request, **kwargs):
+        """async version of Buses.views.BookingExport.get, the response is streamed from an async iterator since ASGI servers read a synchronous one whole before sending it"""
+        return super().get(request, **kwargs)
+
+    def streamedLines(self, rows, lines):
+        return aexportLines(rows, lines, settings.EXPORT_CHUNK_SIZE)
@@ -0,0 +1,101 @@
+from hashlib import sha1
+from json import dumps
+from time import time_ns
+
+from utility.functions import searchOrdering
+from utility.routers import primaryAfterChange
+
+from django.core.cache import caches
+
+SEARCH_CACHE_ALIAS = 'bus_search'
+
+# query parameters that change the result of a bus search, anything else the client sends is ignored for the cache key
+SEARCH_PARAMS = [
+    'source', 'destination', 'date', 'sorting',
+    'depttimerange', 'arrivaltimerange',
+    'minprice', 'maxprice', 'minduration', 'maxduration',
+    'page', 'cursor', 'pagination', 'facets',
+]
+
+def searchCache():
+    """returns the cache backend configured for the search results (local memory by default, which evicts the least recently used entries once it is full)"""
+    return caches[SEARCH_CACHE_ALIAS]
+
+def routeVersion(source, destination):
+    """returns the current version of a route, every cached search of the route embeds it in its key so bumping it invalidates all of them at once
+
+    Args:
+        source (str): source of the route
+        destination (str): destination of the route
+
+    Returns:
+        int: version of the route
+    """
+    cache = searchCache()
+    key = f"route:{source}:{destination}"
+    version = cache.get(key)
+    if version is None:
+        # a fresh value rather than 1, so that an evicted version can never bring back the entries stored under an older one
+        cache.add(key, time_ns(), None)
+        version = cache.get(key)
+    return version
+
+def invalidateRoute(source, destination):
+    """invalidates every cached search result of the given route
+
+    Args:
+        source (str): source of the route
+        destination (str): destination of the route
+    """
+    searchCache().set(f"route:{source}:{destination}", time_ns(), None)
+
+def searchCacheKey(request, scope='search'):
+    """builds the cache key for a search request out of its normalized query parameters and the current version of the searched route
+
+    Args:
+        request (rest_framework.request object): search request
+        scope (str): kind of result cached under the key, so that different endpoints taking the same parameters don't share entries
+
+    Returns:
+        str: cache key for the request
+    """
+    params = {}
+    for name in SEARCH_PARAMS:
+        value = request.query_params.get(name, '').strip()
+        if value:
+            params[name] = value
+    if 'sorting' in params:
+        params['sorting'] = ",".join(searchOrdering(params['sorting']))
+    if params.get('pagination') == 'page':
+        params.setdefault('page', '1')
+    else:
+        params.pop('page', None)
+
+    version = routeVersion(params.get('source'), params.get('destination'))
+    # whatever is read next gets cached under this version
+    primaryAfterChange(version)
+    # the paginated response carries absolute next/previous links so the host is part of the key as well
+    digest = sha1(dumps([request.get_host(), version, params], sort_keys=True).encode()).hexdigest()
+    return f"{scope}:{digest}"
+
+def countSearch(hit):
+    """updates the hit or miss counter of the search cache
+
+    Args:
+        hit (bool): True if the search was answered from the cache
+    """
+    cache = searchCache()
+    key = "stats:hits" if hit else "stats:misses"
+    try:
+        cache.incr(key)
+    except ValueError:
+        cache.set(key, 1, None)
+
+def searchCacheStats():
+    """returns the hit and miss counters of the search cache
+
+    Returns:
+        dict: number of hits and misses since the counters were created
+    """
+    counters = searchCache().get_many(["stats:hits", "stats:misses"])
+    return {'hits': counters.get("stats:hits", 0), 'misses': counters.get("stats:misses", 0)}
@@ -0,0 +1,266 @@
+from bisect import bisect_left
+from collections import namedtuple
+from datetime import timedelta
+from functools import lru_cache
+from heapq import heappush, heappushpop
+from threading import Lock
+from time import monotonic
+
+from Buses.models import Buses, TripInventory
+from Buses.signals import timetable_changed
+from Buses.timetable import timetableVersion
+
+from utility.routers import primaryAfterChange
+
+from django.conf import settings
+from django.dispatch import receiver
+
+DAY = 24 * 60
+
+# a bus as an edge of the route graph, times are in minutes since midnight and the bus runs every day
+Edge = namedtuple('Edge', ['bus_id', 'busnumber', 'operator', 'source', 'destination', 'departure', 'duration', 'price', 'type', 'seats'])
+EDGE_FIELDS = ['bus_id', 'busnumber', 'operator', 'source', 'destination', 'departuretime', 'duration', 'price', 'type', 'available_seats']
+
+def edgeFromRow(row):
+    busId, busnumber, operator, source, destination, departure, duration, price, busType, seats = row
+    return Edge(busId, busnumber, operator, source, destination, departure.hour * 60 + departure.minute, duration.hour * 60 + duration.minute, price, busType, seats)
+
+class ConnectionIndex:
+    """in memory index of the timetable as a graph whose nodes are the cities and whose edges are the buses, the departures of every route are kept sorted
+    so that the buses leaving within a layover window are found with a binary search instead of a query.
+    A change made by this process updates only the routes of the changed bus, a change made by another process (seen through the timetable version)
+    or by a bulk update rebuilds the whole index on the next search, as does an index older than CONNECTION_INDEX_MAX_AGE
+    """
+
+    def __init__(self):
+        self.lock = Lock()
+        self.routes = None
+        self.version = None
+        self.builtAt = 0
+
+    def build(self):
+        """reads the whole timetable into the index"""
+        version = timetableVersion()
+        primaryAfterChange(version)
+        edges = {}
+        for row in Buses.objects.values_list(*EDGE_FIELDS).iterator():
+            edge = edgeFromRow(row)
+            edges.setdefault((edge.source, edge.destination), []).append(edge)
+        routes = {route: self.sortedRoute(routeEdges) for route, routeEdges in edges.items()}
+
+        self.successors = self.cityMap(routes, reverse=False)
+        self.predecessors = self.cityMap(routes, reverse=True)
+        self.busRoutes = {edge.bus_id: route for route, (_, routeEdges) in routes.items() for edge in routeEdges}
+        self.routes = routes
+        self.version = version
+        self.builtAt = monotonic()
+
+    def sortedRoute(self, routeEdges):
+        routeEdges = sorted(routeEdges, key=lambda edge: (edge.departure, edge.bus_id))
+        return [edge.departure for edge in routeEdges], routeEdges
+
+    def cityMap(self, routes, reverse):
+        cities = {}
+        for source, destination in routes:
+            if reverse:
+                cities.setdefault(destination, set()).add(source)
+            else:
+                cities.setdefault(source, set()).add(destination)
+        return cities
+
+    def current(self):
+        """makes sure the index reflects the current timetable version, rebuilding it if needed"""
+        if self.routes is not None and self.version == timetableVersion() and monotonic() - self.builtAt < settings.CONNECTION_INDEX_MAX_AGE:
+            return
+        with self.lock:
+            if self.routes is None or self.version != timetableVersion() or monotonic() - self.builtAt >= settings.CONNECTION_INDEX_MAX_AGE:
+                self.build()
+
+    def busChanged(self, busId, previousVersion, version):
+        """moves a single bus in the index after it was added, edited or removed by this process, the routes are replaced and not edited in place so running searches are unaffected.
+        Only an index built from the version the change replaced is patched, one built from an older version misses the changes of another process and is rebuilt by the next search
+
+        Args:
+            busId (int): id of the bus
+            previousVersion (int): timetable version just before the change
+            version (int): timetable version including the change
+        """
+        row = Buses.objects.filter(bus_id=busId).values_list(*EDGE_FIELDS).first()
+        with self.lock:
+            if self.routes is None:
+                return
+            if self.version != previousVersion:
+                self.routes = None
+                return
+            routes = dict(self.routes)
+            oldRoute = self.busRoutes.pop(busId, None)
+            if oldRoute is not None:
+                remaining = [edge for edge in routes[oldRoute][1] if edge.bus_id != busId]
+                if remaining:
+                    routes[oldRoute] = self.sortedRoute(remaining)
+                else:
+                    del routes[oldRoute]
+            if row is not None:
+                edge = edgeFromRow(row)
+                route = (edge.source, edge.destination)
+                routes[route] = self.sortedRoute([*routes.get(route, ((), []))[1], edge])
+                self.busRoutes[busId] = route
+            if set(routes) != set(self.routes):
+                self.successors = self.cityMap(routes, reverse=False)
+                self.predecessors = self.cityMap(routes, reverse=True)
+            self.routes = routes
+            self.version = version
+
+    def departures(self, source, destination, earliest, latest):
+        """lists the buses of a route leaving between two instants
+
+        Args:
+            source (str): city the buses leave from
+            destination (str): city the buses go to
+            earliest (int): minutes since midnight of the travel date, may be past the first day
+            latest (int): same, inclusive
+
+        Returns:
+            list: (departure instant, Edge) in order of departure
+        """
+        route = self.routes.get((source, destination))
+        if route is None or latest < earliest:
+            return []
+        minutes, edges = route
+        found = []
+        for day in range(earliest // DAY, latest // DAY + 1):
+            start = max(earliest - day * DAY, 0)
+            end = min(latest - day * DAY, DAY - 1)
+            for index in range(bisect_left(minutes, start), len(minutes)):
+                if minutes[index] > end:
+                    break
+                found.append((day * DAY + minutes[index], edges[index]))
+        return found
+
+    def search(self, source, destination, transfers=2, minLayover=30, maxLayover=360, sorting='duration', limit=20):
+        """finds the itineraries from source to destination leaving on the travel date with at most the given number of transfers,
+        every transfer leaves at least minLayover and at most maxLayover minutes after the previous bus arrives
+
+        Args:
+            source (str): city of departure
+            destination (str): city of arrival
+            transfers (int): 0, 1 or 2
+            minLayover (int): minutes
+            maxLayover (int): minutes
+            sorting (str): 'duration' ranks by the time from the first departure to the last arrival, 'price' by the total fare
+            limit (int): number of itineraries returned
+
+        Returns:
+            list: itineraries as lists of (departure instant, Edge), best first
+        """
+        self.current()
+        if source == destination:
+            return []
+        successors, predecessors = self.successors, self.predecessors
+        finalLegs = predecessors.get(destination, set())
+        # the best itineraries so far in a heap whose top is the worst of them (ranks are negated), a partial itinerary already ranking below it is dropped
+        best = []
+        found = 0
+
+        def rank(start, arrival, price):
+            return (price, arrival - start) if sorting == 'price' else (arrival - start, price)
+
+        def keep(legs, arrival, price):
+            nonlocal found
+            found += 1
+            entry = (tuple(-value for value in rank(legs[0][0], arrival, price)), -found, legs)
+            if len(best) < limit:
+                heappush(best, entry)
+            elif entry > best[0]:
+                heappushpop(best, entry)
+
+        def hopeless(start, arrival, price):
+            return len(best) == limit and tuple(-value for value in rank(start, arrival, price)) <= best[0][0]
+
+        def reachable(city, left):
+            # with one transfer left the next bus has to go to the destination, with none left the city has to be the destination
+            return city == destination or left >= 2 or left == 1 and city in finalLegs
+
+        def extend(legs, arrival, price, city, left, visited):
+            start = legs[0][0]
+            for nextCity in successors.get(city, ()):
+                if nextCity in visited or not reachable(nextCity, left):
+                    continue
+                for departure in self.departures(city, nextCity, arrival + minLayover, arrival + maxLayover):
+                    edge = departure[1]
+                    nextArrival, nextPrice = departure[0] + edge.duration, price + edge.price
+                    if hopeless(start, nextArrival, nextPrice):
+                        continue
+                    if nextCity == destination:
+                        keep([*legs, departure], nextArrival, nextPrice)
+                    else:
+                        extend([*legs, departure], nextArrival, nextPrice, nextCity, left - 1, visited | {nextCity})
+
+        for nextCity in successors.get(source, ()):
+            if not reachable(nextCity, transfers):
+                continue
+            for departure in self.departures(source, nextCity, 0, DAY - 1):
+                edge = departure[1]
+                arrival = departure[0] + edge.duration
+                if hopeless(departure[0], arrival, edge.price):
+                    continue
+                if nextCity == destination:
+                    keep([departure], arrival, edge.price)
+                else:
+                    extend([departure], arrival, edge.price, nextCity, transfers - 1, {source, nextCity})
+
+        return [legs for _, _, legs in sorted(best, reverse=True)]
+
+@lru_cache(maxsize=None)
+def connectionIndex():
+    """returns the connection index of this process"""
+    return ConnectionIndex()
+
+@receiver(timetable_changed)
+def timetableChanged(sender, bus_id=None, previous_version=None, version=None, **kwargs):
+    """updates the index of this process for the changed bus, after a bulk change the next search rebuilds it from the new timetable version"""
+    if bus_id is not None:
+        connectionIndex().busChanged(bus_id, previous_version, version)
+
+def itinerariesData(itineraries, travelDate):
+    """lays out the itineraries with the date and time of every leg, the seats left on each trip and the totals, the seats of all the legs are read with a single query
+
+    Args:
+        itineraries (list): lists of (departure instant, Edge) as returned by ConnectionIndex.search
+        travelDate (date): day the first bus leaves
+
+    Returns:
+        list: for every itinerary its legs, number of transfers, departure, arrival, duration in minutes and total price
+    """
+    def day(minutes):
+        return travelDate + timedelta(days=minutes // DAY)
+
+    def stamp(minutes):
+        return f"{day(minutes).strftime('%d-%m-%Y')} {minutes % DAY // 60:02d}:{minutes % 60:02d}"
+
+    trips = {(edge.bus_id, day(departure)) for legs in itineraries for departure, edge in legs}
+    seatsLeft = {
+        (busId, date): seats for busId, date, seats in TripInventory.objects.filter(
+            bus_id__in={busId for busId, _ in trips}, travel_date__in={date for _, date in trips}
+        ).values_list('bus_id', 'travel_date', 'available_seats')
+    } if trips else {}
+
+    return [
+        {
+            'legs': [
+                {
+                    'bus_id': edge.bus_id, 'busnumber': edge.busnumber, 'operator': edge.operator, 'type': edge.type,
+                    'source': edge.source, 'destination': edge.destination, 'price': str(edge.price),
+                    'departure': stamp(departure), 'arrival': stamp(departure + edge.duration),
+                    'available_seats': seatsLeft.get((edge.bus_id, day(departure)), edge.seats),
+                }
+                for departure, edge in legs
+            ],
+            'transfers': len(legs) - 1,
+            'departure': stamp(legs[0][0]),
+            'arrival': stamp(legs[-1][0] + legs[-1][1].duration),
+            'duration': legs[-1][0] + legs[-1][1].duration - legs[0][0],
+            'price': str(sum(edge.price for _, edge in legs)),
+        }
+        for legs in itineraries
+    ]
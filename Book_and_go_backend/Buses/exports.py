@@ -0,0 +1,167 @@
+from csv import writer
+from json import dumps
+
+from Buses.models import Bookings, SeatsDetail
+from Buses.inventory import parseTravelDate
+
+from rest_framework.exceptions import ValidationError
+
+from django.core.serializers.json import DjangoJSONEncoder
+
+# the columns of every export and the lookups they are read from, the bus (and for the manifest the booking) is joined in the same query
+EXPORTS = {
+    'bookings': {
+        'model': Bookings,
+        'bus': 'bus',
+        'travel_date': 'travel_date',
+        'columns': [
+            ('booking', 'id'), ('booked_at', 'Date_TOB'), ('travel_date', 'travel_date'),
+            ('bus_id', 'bus_id'), ('busnumber', 'bus__busnumber'), ('operator', 'bus__operator'),
+            ('source', 'bus__source'), ('destination', 'bus__destination'), ('departuretime', 'bus__departuretime'),
+            ('seats', 'no_of_seats'), ('price', 'bus__price'), ('username', 'user__username'),
+            ('email', 'email'), ('contact', 'contact'), ('city', 'city'), ('state', 'state'), ('pincode', 'pincode'),
+        ],
+    },
+    'manifest': {
+        'model': SeatsDetail,
+        'bus': 'booking__bus',
+        'travel_date': 'booking__travel_date',
+        'columns': [
+            ('travel_date', 'booking__travel_date'), ('bus_id', 'booking__bus_id'), ('busnumber', 'booking__bus__busnumber'),
+            ('operator', 'booking__bus__operator'), ('source', 'booking__bus__source'), ('destination', 'booking__bus__destination'),
+            ('departuretime', 'booking__bus__departuretime'), ('seat', 'seat'), ('first_name', 'first_name'),
+            ('middle_name', 'middle_name'), ('last_name', 'last_name'), ('age', 'age'),
+            ('booking', 'booking_id'), ('contact', 'booking__contact'),
+        ],
+    },
+}
+EXPORT_FORMATS = {'csv': "text/csv; charset=utf-8", 'ndjson': "application/x-ndjson"}
+
+def exportFilters(params):
+    """reads the filters of an export from query parameters or command options
+
+    Args:
+        params (dict): operator, bus (id of the bus), from and to (travel dates in DD-MM-YYYY format, both included), every filter is optional
+
+    Raises:
+        ValidationError: if the bus isn't a number or a date isn't in DD-MM-YYYY format
+
+    Returns:
+        dict: the filters given, as accepted by exportQuery
+    """
+    filters = {}
+    if params.get('operator'):
+        filters['operator'] = params['operator']
+    if params.get('bus'):
+        try:
+            filters['bus'] = int(params['bus'])
+        except (TypeError, ValueError):
+            raise ValidationError({'bus': "Bus must be the id of a bus"})
+    for name in ('from', 'to'):
+        try:
+            travelDate = parseTravelDate(params.get(name))
+        except ValidationError:
+            raise ValidationError({name: "Date must be in DD-MM-YYYY format"})
+        if travelDate is not None:
+            filters[name] = travelDate
+    return filters
+
+def exportQuery(kind, operator=None, bus=None, **dates):
+    """builds the query of an export, its rows are tuples in the order of the columns of the export
+
+    Args:
+        kind (str): 'bookings' for a row per booking, 'manifest' for a row per passenger
+        operator (str, optional): only the bookings on the buses of this operator
+        bus (int, optional): only the bookings on this bus
+        dates: 'from' and 'to' travel dates, a booking without a travel date is on no trip and only exported when no date is given
+
+    Returns:
+        queryset: rows of the export
+    """
+    export = EXPORTS[kind]
+    rows = export['model'].objects.all()
+    if operator:
+        rows = rows.filter(**{f"{export['bus']}__operator": operator})
+    if bus:
+        rows = rows.filter(**{f"{export['bus']}_id": bus})
+    if dates.get('from'):
+        rows = rows.filter(**{f"{export['travel_date']}__gte": dates['from']})
+    if dates.get('to'):
+        rows = rows.filter(**{f"{export['travel_date']}__lte": dates['to']})
+    return rows.values_list('pk', *(lookup for _, lookup in export['columns']))
+
+def chunkQueries(rows, chunkSize, last):
+    # each chunk seeks past the last key of the previous one on the primary key index, so every chunk costs the same and only one chunk is ever in memory.
+    # A plain iterator() would leave the whole result in the memory of the MySQL client, which doesn't stream results without a server side cursor
+    query = rows.order_by('pk')
+    return query.filter(pk__gt=last)[:chunkSize] if last is not None else query[:chunkSize]
+
+class ExportLines:
+    """formats the rows of an export as CSV with a header line or as one JSON object per line, the rows are turned into text a chunk at a time
+
+    Args:
+        kind (str): one of EXPORTS
+        outputFormat (str): one of EXPORT_FORMATS
+    """
+
+    def __init__(self, kind, outputFormat):
+        self.columns = [name for name, _ in EXPORTS[kind]['columns']]
+        self.outputFormat = outputFormat
+
+    def header(self):
+        return self.csvText([self.columns]) if self.outputFormat == 'csv' else ""
+
+    def text(self, rows):
+        """returns the lines of a chunk of rows, the key the rows were read with is left out"""
+        if self.outputFormat == 'csv':
+            return self.csvText(row[1:] for row in rows)
+        return "".join(dumps(dict(zip(self.columns, row[1:])), cls=DjangoJSONEncoder) + "\n" for row in rows)
+
+    def csvText(self, rows):
+        lines = []
+        # the csv writer writes to anything with a write method, here it only collects the lines of the chunk
+        writer(ChunkBuffer(lines)).writerows(rows)
+        return "".join(lines)
+
+class ChunkBuffer:
+    def __init__(self, lines):
+        self.write = lines.append
+
+def exportLines(rows, lines, chunkSize=2000):
+    """streams an export
+
+    Args:
+        rows (queryset): rows of the export, see exportQuery
+        lines (ExportLines): formatting of the rows
+        chunkSize (int): rows read with each query
+
+    Yields:
+        str: the header and then the lines of one chunk of rows at a time
+    """
+    header = lines.header()
+    if header:
+        yield header
+    last = None
+    while True:
+        chunk = list(chunkQueries(rows, chunkSize, last))
+        if not chunk:
+            return
+        yield lines.text(chunk)
+        if len(chunk) < chunkSize:
+            return
+        last = chunk[-1][0]
+
+async def aexportLines(rows, lines, chunkSize=2000):
+    """same as exportLines but reads the chunks with the async ORM, an async iterator is what lets an ASGI server stream the response instead of reading it whole first"""
+    header = lines.header()
+    if header:
+        yield header
+    last = None
+    while True:
+        chunk = [row async for row in chunkQueries(rows, chunkSize, last)]
+        if not chunk:
+            return
+        yield lines.text(chunk)
+        if len(chunk) < chunkSize:
+            return
+        last = chunk[-1][0]
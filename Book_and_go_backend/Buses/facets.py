@@ -0,0 +1,92 @@
+from Buses.models import Buses
+
+from django.conf import settings
+from django.db.models import Count, Min, Max, Q
+
+def priceBuckets():
+    """returns the (start, end) bounds of the price buckets, the price column can't go beyond 10^(max_digits - decimal_places) so a fixed set of buckets covers every possible value
+
+    Returns:
+        list: bounds of each price bucket
+    """
+    width = getattr(settings, 'BUS_FACET_PRICE_BUCKET', 100)
+    priceField = Buses._meta.get_field('price')
+    ceiling = 10 ** (priceField.max_digits - priceField.decimal_places)
+    return [(start, start + width) for start in range(0, ceiling, width)]
+
+def hourBuckets(counts, low, high):
+    """turns the per hour counts into a list of buckets going from hour low to hour high"""
+    return [{'hour': hour, 'count': counts[hour]} for hour in range(low, high + 1)]
+
+def facetAggregates():
+    """returns the aggregates computing every facet, each bucket is a conditional count so that all of them come out of a single aggregate query
+
+    Returns:
+        dict: aggregate expressions by name
+    """
+    aggregates = {
+        'count': Count('pk'),
+        'minprice': Min('price'),
+        'maxprice': Max('price'),
+        'minduration': Min('duration'),
+        'maxduration': Max('duration'),
+    }
+    for index, (start, end) in enumerate(priceBuckets()):
+        aggregates[f'price{index}'] = Count('pk', filter=Q(price__gte=start, price__lt=end))
+    for hour in range(24):
+        aggregates[f'duration{hour}'] = Count('pk', filter=Q(duration__hour=hour))
+        aggregates[f'departure{hour}'] = Count('pk', filter=Q(departuretime__hour=hour))
+    return aggregates
+
+def searchFacets(busdata):
+    """computes the ranges and histograms used by the filter sliders for the given (already filtered) queryset with a single aggregate query instead of pulling the rows into python
+
+    Args:
+        busdata (queryset): queryset of the buses matching the search
+
+    Returns:
+        dict: number of buses, min/max and buckets for the price and the duration and buckets for the departure hour
+    """
+    return facetsFromAggregates(busdata.order_by().aggregate(**facetAggregates()))
+
+async def asearchFacets(busdata):
+    """same as searchFacets but runs the aggregate query with the async ORM"""
+    return facetsFromAggregates(await busdata.order_by().aaggregate(**facetAggregates()))
+
+def facetsFromAggregates(result):
+    """turns the result of the facet aggregates into the facets sent to the client
+
+    Args:
+        result (dict): result of the aggregate query built from facetAggregates
+
+    Returns:
+        dict: number of buses, min/max and buckets for the price and the duration and buckets for the departure hour
+    """
+    buckets = priceBuckets()
+    facets = {
+        'count': result['count'],
+        'price': {'min': None, 'max': None, 'buckets': []},
+        'duration': {'min': None, 'max': None, 'buckets': []},
+        'departureHour': {'buckets': hourBuckets([result[f'departure{hour}'] for hour in range(24)], 0, 23)},
+    }
+    if not result['count']:
+        return facets
+
+    minPrice, maxPrice = result['minprice'], result['maxprice']
+    decimalPlaces = Buses._meta.get_field('price').decimal_places
+    facets['price'] = {
+        'min': f"{minPrice:.{decimalPlaces}f}",
+        'max': f"{maxPrice:.{decimalPlaces}f}",
+        'buckets': [
+            {'from': start, 'to': end, 'count': result[f'price{index}']}
+            for index, (start, end) in enumerate(buckets) if end > minPrice and start <= maxPrice
+        ],
+    }
+
+    minDuration, maxDuration = result['minduration'], result['maxduration']
+    facets['duration'] = {
+        'min': minDuration.isoformat(),
+        'max': maxDuration.isoformat(),
+        'buckets': hourBuckets([result[f'duration{hour}'] for hour in range(24)], minDuration.hour, maxDuration.hour),
+    }
+    return facets
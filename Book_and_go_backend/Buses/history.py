@@ -0,0 +1,15 @@
+from Buses.models import Bookings
+
+# newest bookings first, the primary key breaks the ties between bookings made at the same instant
+HISTORY_ORDERING = ['-Date_TOB', '-id']
+
+def userBookings(usr):
+    """returns the bookings of a user along with their bus and passengers, the bus is joined in and the passengers of all the bookings are fetched with one more query, so any number of bookings costs two queries
+
+    Args:
+        usr (user): user whose bookings are loaded
+
+    Returns:
+        queryset: bookings of the user
+    """
+    return Bookings.objects.filter(user = usr).select_related('bus').prefetch_related('seatDetail')
@@ -0,0 +1,92 @@
+from datetime import timedelta
+from secrets import token_hex
+
+from Buses.models import SeatHold
+from Buses.inventory import reserveSeats, releaseSeats
+from Buses.cache import invalidateRoute
+
+from django.conf import settings
+from django.db import transaction
+from django.utils.timezone import now
+
+def holdSeats(usr, bus, travelDate, seats=None, count=None):
+    """takes seats on a trip for a short time so that the user can fill the booking form without losing them, the seats come back to the trip once the hold expires and is swept
+
+    Args:
+        usr (user): user holding the seats
+        bus (Buses): bus of the trip
+        travelDate (date): day of the trip
+        seats (list, optional): seat numbers to hold
+        count (int, optional): number of seats to hold when no seat numbers are given, the first free ones are picked
+
+    Raises:
+        SeatsUnavailable: if the seats can't be taken
+
+    Returns:
+        SeatHold: the hold, its token has to be sent along with the booking
+    """
+    with transaction.atomic():
+        held = reserveSeats(bus, travelDate, seats=seats, count=count)
+        hold = SeatHold.objects.create(
+            token=token_hex(16), user=usr, bus=bus, travel_date=travelDate, seats=held,
+            expires_at=now() + timedelta(seconds=settings.SEAT_HOLD_TTL),
+        )
+        transaction.on_commit(lambda: invalidateRoute(bus.source, bus.destination))
+    return hold
+
+def activeHold(usr, token):
+    """returns the hold of the user with the given token if it hasn't expired yet
+
+    Args:
+        usr (user): user who took the hold
+        token (str): token of the hold
+
+    Returns:
+        SeatHold: the hold, None if it doesn't exist, belongs to someone else or has expired
+    """
+    return SeatHold.objects.filter(token=token, user=usr, expires_at__gt=now()).first()
+
+def consumeHold(hold):
+    """turns the hold into a booking by deleting it, its seats stay taken. Must run in the booking transaction so that the hold comes back if the booking fails
+
+    Args:
+        hold (SeatHold): hold used by the booking
+
+    Returns:
+        bool: False if the hold expired or was swept in the meantime
+    """
+    return SeatHold.objects.filter(pk=hold.pk, expires_at__gt=now()).delete()[0] > 0
+
+def sweepExpiredHolds(batchSize=500):
+    """gives the seats of the expired holds back to their trips and deletes the holds. The holds are handled in batches, the seats of a batch are released
+    with one update per trip and the holds with one delete, the rows being consumed by a booking at the same moment are skipped
+
+    Args:
+        batchSize (int): number of holds handled per transaction
+
+    Returns:
+        int: number of holds swept
+    """
+    swept = 0
+    while True:
+        with transaction.atomic():
+            expired = list(
+                SeatHold.objects.select_for_update(skip_locked=True)
+                .filter(expires_at__lte=now())
+                .select_related('bus')
+                .order_by('expires_at')[:batchSize]
+            )
+            if not expired:
+                return swept
+
+            trips = {}
+            for hold in expired:
+                trips.setdefault((hold.bus, hold.travel_date), []).extend(hold.seats)
+            for (bus, travelDate), seats in trips.items():
+                releaseSeats(bus.bus_id, travelDate, seats)
+                transaction.on_commit(lambda bus=bus: invalidateRoute(bus.source, bus.destination))
+
+            SeatHold.objects.filter(pk__in=[hold.pk for hold in expired]).delete()
+        swept += len(expired)
+        if len(expired) < batchSize:
+            return swept
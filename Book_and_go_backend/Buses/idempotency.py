@@ -0,0 +1,85 @@
+from datetime import timedelta
+from hashlib import sha256
+from json import dumps
+
+from Buses.models import IdempotencyKey
+
+from django.conf import settings
+from django.db import transaction, IntegrityError
+from django.utils.timezone import now
+
+from rest_framework.response import Response
+from rest_framework import status
+
+IDEMPOTENCY_HEADER = 'Idempotency-Key'
+
+def requestFingerprint(data):
+    """returns a compact fingerprint of the request body, the keys are sorted so that the same body always gives the same fingerprint
+
+    Args:
+        data (dict): body of the request
+
+    Returns:
+        bytes: sha256 digest of the body
+    """
+    return sha256(dumps(data, sort_keys=True, separators=(',', ':'), default=str).encode()).digest()
+
+def idempotent(request, handler):
+    """runs the handler only once per Idempotency-Key of the user. The key is inserted in the same transaction as the work done by the handler, 
+    so a retry sent while the first request is still running waits for it on the unique index and then replays its response, 
+    and a request failing with a server error leaves no key behind so that it can be retried
+
+    Args:
+        request (rest_framework.request object): request carrying the Idempotency-Key header
+        handler (function): takes the request and returns the response
+
+    Returns:
+        Response: the response of the handler, or the stored one if the key was already used
+    """
+    key = request.headers.get(IDEMPOTENCY_HEADER)
+    if not key:
+        return handler(request)
+    if len(key) > IdempotencyKey._meta.get_field('key').max_length:
+        return Response({'status':'Failure', 'message':f"{IDEMPOTENCY_HEADER} is too long"}, status=status.HTTP_400_BAD_REQUEST)
+
+    fingerprint = requestFingerprint(request.data)
+    with transaction.atomic():
+        try:
+            with transaction.atomic():
+                # removes the key if it expired but hasn't been swept yet, so that it can be used again
+                IdempotencyKey.objects.filter(user=request.user, key=key, expires_at__lte=now()).delete()
+                record = IdempotencyKey.objects.create(
+                    user=request.user, key=key, fingerprint=fingerprint, status_code=0, response={},
+                    expires_at=now() + timedelta(seconds=settings.IDEMPOTENCY_KEY_TTL),
+                )
+        except IntegrityError:
+            stored = IdempotencyKey.objects.get(user=request.user, key=key)
+            if bytes(stored.fingerprint) != fingerprint:
+                return Response({'status':'Failure', 'message':f"{IDEMPOTENCY_HEADER} was already used for another request"}, status=status.HTTP_422_UNPROCESSABLE_ENTITY)
+            response = Response(stored.response, status=stored.status_code)
+            response['Idempotent-Replayed'] = 'true'
+            return response
+
+        response = handler(request)
+        if response.status_code >= 500:
+            transaction.set_rollback(True)
+        else:
+            IdempotencyKey.objects.filter(pk=record.pk).update(status_code=response.status_code, response=response.data)
+        return response
+
+def sweepExpiredKeys(batchSize=1000):
+    """deletes the expired idempotency keys in batches
+
+    Args:
+        batchSize (int): number of keys deleted per query
+
+    Returns:
+        int: number of keys deleted
+    """
+    swept = 0
+    while True:
+        expired = list(IdempotencyKey.objects.filter(expires_at__lte=now()).values_list('pk', flat=True)[:batchSize])
+        if expired:
+            swept += IdempotencyKey.objects.filter(pk__in=expired).delete()[0]
+        if len(expired) < batchSize:
+            return swept
@@ -0,0 +1,155 @@
+from csv import DictReader
+from itertools import islice
+from json import loads, JSONDecodeError
+from time import perf_counter
+
+from Buses.models import Buses
+from Buses.serializers import BusImportSerializer
+from Buses.signals import invalidateOnCommit, timetableChanged
+from Buses.rollups import ROLLUP_BUS_FIELDS, busesMoved
+
+from rest_framework.exceptions import ValidationError
+
+from django.db import connection, transaction
+
+# every column of a bus except its key, an import sets all of them
+IMPORT_FIELDS = [field.name for field in Buses._meta.concrete_fields if field.name not in ('bus_id', 'busnumber')]
+
+def csvRows(file):
+    """reads a CSV timetable with a header line one row at a time
+
+    Args:
+        file (file): text file
+
+    Yields:
+        tuple: line number and the row as a dict
+    """
+    reader = DictReader(file)
+    for row in reader:
+        yield reader.line_num, row
+
+def ndjsonRows(file):
+    """reads a timetable with one JSON object per line one row at a time, a line which isn't an object is yielded as its error message so that it is reported like an invalid row
+
+    Args:
+        file (file): text file
+
+    Yields:
+        tuple: line number and the row as a dict
+    """
+    for line, text in enumerate(file, start=1):
+        if not text.strip():
+            continue
+        try:
+            row = loads(text)
+        except JSONDecodeError as e:
+            row = f"Invalid JSON: {e}"
+        yield line, row if isinstance(row, (dict, str)) else "Expected a JSON object"
+
+class TimetableImport:
+    """upserts buses from a stream of rows, the rows are validated and written a chunk at a time so the memory used doesn't depend on the size of the timetable.
+    Each chunk is written with one bulk insert updating the buses whose bus number already exists, in its own transaction
+
+    Args:
+        chunkSize (int): rows validated and written at once
+        dryRun (bool): only compare the rows with the timetable, nothing is written
+        report (callable, optional): called as report(kind, line, busnumber, detail) for every row which is 'created', 'updated' or 'invalid',
+            detail is the changed fields as {field: (old, new)} for an update and the errors for an invalid row
+    """
+
+    def __init__(self, chunkSize=1000, dryRun=False, report=None):
+        self.chunkSize = chunkSize
+        self.dryRun = dryRun
+        self.report = report or (lambda kind, line, busnumber, detail: None)
+        self.serializer = BusImportSerializer()
+        self.counts = {'rows': 0, 'created': 0, 'updated': 0, 'unchanged': 0, 'invalid': 0}
+        self.elapsed = 0
+
+    def run(self, rows):
+        """imports the rows
+
+        Args:
+            rows (iterable): (line number, row) tuples, see csvRows and ndjsonRows
+
+        Returns:
+            dict: number of rows read, created, updated, unchanged and invalid
+        """
+        start = perf_counter()
+        written = False
+        rows = iter(rows)
+        try:
+            while chunk := list(islice(rows, self.chunkSize)):
+                written = self.importChunk(chunk) or written
+        finally:
+            self.elapsed = perf_counter() - start
+            # bulk inserts send no signals, the listeners are told once about the whole import
+            if written:
+                timetableChanged()
+        return self.counts
+
+    def rowsPerSecond(self):
+        return round(self.counts['rows'] / self.elapsed, 1) if self.elapsed else None
+
+    def validRows(self, chunk):
+        """validates the rows of a chunk, a bus number given twice keeps its last row
+
+        Returns:
+            dict: validated rows keyed by bus number, with their line number
+        """
+        valid = {}
+        for line, row in chunk:
+            self.counts['rows'] += 1
+            try:
+                if isinstance(row, str):
+                    raise ValidationError(row)
+                data = self.serializer.run_validation(row)
+            except ValidationError as e:
+                self.counts['invalid'] += 1
+                self.report('invalid', line, row.get('busnumber') if isinstance(row, dict) else None, e.detail)
+                continue
+            valid[data['busnumber']] = (line, data)
+        return valid
+
+    def importChunk(self, chunk):
+        """validates a chunk of rows, compares it with the buses having the same numbers and writes the new and changed ones
+
+        Returns:
+            bool: True if anything was written
+        """
+        valid = self.validRows(chunk)
+        with transaction.atomic():
+            buses = Buses.objects if self.dryRun else Buses.objects.select_for_update()
+            existing = buses.in_bulk(valid.keys(), field_name='busnumber')
+            changed = []
+            routes = set()
+            moved = {}
+            for busnumber, (line, data) in valid.items():
+                bus = existing.get(busnumber)
+                if bus is None:
+                    self.counts['created'] += 1
+                    self.report('created', line, busnumber, data)
+                else:
+                    diff = {name: (getattr(bus, name), data[name]) for name in IMPORT_FIELDS if getattr(bus, name) != data[name]}
+                    if not diff:
+                        self.counts['unchanged'] += 1
+                        continue
+                    self.counts['updated'] += 1
+                    self.report('updated', line, busnumber, diff)
+                    # a bus moving to another route takes its searches off the old route
+                    routes.add((bus.source, bus.destination))
+                    if ROLLUP_BUS_FIELDS & diff.keys():
+                        moved[bus.bus_id] = (data['source'], data['destination'], data['available_seats'])
+                routes.add((data['source'], data['destination']))
+                changed.append(Buses(**data))
+
+            if self.dryRun or not changed:
+                return False
+
+            # MySQL upserts on whichever unique key conflicts and doesn't take the conflict target
+            unique = {'unique_fields': ['busnumber']} if connection.features.supports_update_conflicts_with_target else {}
+            Buses.objects.bulk_create(changed, update_conflicts=True, update_fields=IMPORT_FIELDS, **unique)
+            # the upsert sends no post_save, the totals of the moved buses are moved in the same transaction
+            busesMoved(moved)
+            for source, destination in routes:
+                invalidateOnCommit(source, destination)
+        return True
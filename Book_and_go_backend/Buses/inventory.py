@@ -0,0 +1,319 @@
+from datetime import datetime
+
+from Buses.models import Buses, SeatsDetail, SeatHold, TripInventory
+
+from django.db import transaction
+from django.db.models import F
+
+from rest_framework.exceptions import ValidationError
+
+# how many times a booking retries when another booking of the same trip changed the seat map in the meantime
+RESERVE_ATTEMPTS = 5
+
+class SeatsUnavailable(Exception):
+    """raised when the seats asked for can't be taken on the trip"""
+
+def parseTravelDate(value):
+    """parses the travel date sent by the client
+
+    Args:
+        value (str): date in DD-MM-YYYY format
+
+    Raises:
+        ValidationError: if the date is not in DD-MM-YYYY format
+
+    Returns:
+        date: the travel date, None if no date was given
+    """
+    if not value:
+        return None
+    try:
+        return datetime.strptime(value, "%d-%m-%Y").date()
+    except (TypeError, ValueError):
+        raise ValidationError({'date': "Date must be in DD-MM-YYYY format"})
+
+def seatTaken(seatMap, seat):
+    """tells if a seat is marked as taken in the seat map
+
+    Args:
+        seatMap (bytes): seat map of the trip
+        seat (int): seat number, starting from 1
+
+    Returns:
+        bool: True if the seat is taken
+    """
+    index = seat - 1
+    return index // 8 < len(seatMap) and bool(seatMap[index // 8] >> (index % 8) & 1)
+
+def markSeats(seatMap, seats, taken=True):
+    """returns a copy of the seat map with the given seats marked as taken (or as free when taken is False)
+
+    Args:
+        seatMap (bytes): seat map of the trip
+        seats (list): seat numbers, starting from 1
+        taken (bool): whether to mark the seats as taken or free
+
+    Returns:
+        bytes: the updated seat map
+    """
+    updated = bytearray(seatMap)
+    for seat in seats:
+        index = seat - 1
+        if index // 8 >= len(updated):
+            updated.extend(bytes(index // 8 + 1 - len(updated)))
+        if taken:
+            updated[index // 8] |= 1 << (index % 8)
+        else:
+            updated[index // 8] &= ~(1 << (index % 8)) & 0xFF
+    return bytes(updated)
+
+def occupiedSeats(seatMap):
+    """lists the seats marked as taken in the seat map
+
+    Args:
+        seatMap (bytes): seat map of the trip
+
+    Returns:
+        list: taken seat numbers in increasing order
+    """
+    return [
+        index * 8 + bit + 1
+        for index, byte in enumerate(seatMap) if byte
+        for bit in range(8) if byte >> bit & 1
+    ]
+
+def takenSeats(busIds, dateFrom=None, dateTo=None):
+    """reads the seats taken on the trips of the given buses from the passengers of their bookings and from the seat holds which haven't been swept yet
+    (an expired hold keeps its seats until the sweep gives them back)
+
+    Args:
+        busIds (list): ids of the buses
+        dateFrom (date, optional): only the trips on or after this day
+        dateTo (date, optional): only the trips on or before this day
+
+    Returns:
+        dict: taken seat numbers per (bus id, travel date)
+    """
+    dates = {}
+    if dateFrom is not None:
+        dates['travel_date__gte'] = dateFrom
+    if dateTo is not None:
+        dates['travel_date__lte'] = dateTo
+
+    taken = {}
+    passengers = SeatsDetail.objects.filter(
+        booking__bus_id__in=busIds, **{f"booking__{name}": value for name, value in dates.items()}
+    ).exclude(booking__travel_date=None).values_list('booking__bus_id', 'booking__travel_date', 'seat')
+    for busId, travelDate, seat in passengers:
+        taken.setdefault((busId, travelDate), set()).add(seat)
+    for busId, travelDate, seats in SeatHold.objects.filter(bus_id__in=busIds, **dates).values_list('bus_id', 'travel_date', 'seats'):
+        taken.setdefault((busId, travelDate), set()).update(seats)
+    return taken
+
+def inventoryState(capacity, seats):
+    """returns the seat map and the seats left of a trip whose given seats are taken"""
+    return markSeats(bytes((capacity + 7) // 8), seats), max(capacity - len(seats), 0)
+
+def tripInventory(bus, travelDate):
+    """returns the inventory of a trip, the row is created the first time the trip is booked or held with the seats already booked on it taken,
+    so the bookings made before the trip had an inventory can't be sold again
+
+    Args:
+        bus (Buses): bus of the trip
+        travelDate (date): day of the trip
+
+    Returns:
+        TripInventory: inventory row of the trip
+    """
+    inventory = TripInventory.objects.filter(bus=bus, travel_date=travelDate).first()
+    if inventory is None:
+        seatMap, available = inventoryState(bus.available_seats, takenSeats([bus.bus_id], travelDate, travelDate).get((bus.bus_id, travelDate), set()))
+        inventory, created = TripInventory.objects.get_or_create(
+            bus=bus, travel_date=travelDate, defaults={'available_seats': available, 'seat_map': seatMap},
+        )
+    return inventory
+
+def rebuildInventory(busIds=None, dateFrom=None, dateTo=None, chunkSize=500):
+    """rebuilds the seat map and the seats left of the trips from the passengers of their bookings and the seat holds, and creates the inventory of the booked trips which have none.
+    For the trips which had their inventory created empty before the seats booked earlier were taken into account. The buses are handled a chunk at a time,
+    each in its own transaction with their inventory rows locked, so a booking of the same trip waits for the rebuild and then retries against the rebuilt map
+
+    Args:
+        busIds (list, optional): only the trips of these buses
+        dateFrom (date, optional): only the trips on or after this day
+        dateTo (date, optional): only the trips on or before this day
+        chunkSize (int): buses handled per transaction
+
+    Returns:
+        dict: number of inventory rows 'fixed' (whose map or seats left changed) and 'created'
+    """
+    buses = Buses.objects.order_by('bus_id')
+    if busIds is not None:
+        buses = buses.filter(bus_id__in=busIds)
+    dates = {}
+    if dateFrom is not None:
+        dates['travel_date__gte'] = dateFrom
+    if dateTo is not None:
+        dates['travel_date__lte'] = dateTo
+
+    counts = {'fixed': 0, 'created': 0}
+    last = 0
+    while chunk := dict(buses.filter(bus_id__gt=last).values_list('bus_id', 'available_seats')[:chunkSize]):
+        last = max(chunk)
+        with transaction.atomic():
+            existing = {(row.bus_id, row.travel_date): row for row in TripInventory.objects.select_for_update().filter(bus_id__in=chunk, **dates)}
+            taken = takenSeats(list(chunk), dateFrom, dateTo)
+            fixed, created = [], []
+            for trip in existing.keys() | taken.keys():
+                seatMap, available = inventoryState(chunk[trip[0]], taken.get(trip, set()))
+                inventory = existing.get(trip)
+                if inventory is None:
+                    created.append(TripInventory(bus_id=trip[0], travel_date=trip[1], available_seats=available, seat_map=seatMap))
+                elif bytes(inventory.seat_map) != seatMap or inventory.available_seats != available:
+                    inventory.seat_map, inventory.available_seats = seatMap, available
+                    fixed.append(inventory)
+            TripInventory.objects.bulk_update(fixed, ['seat_map', 'available_seats'])
+            TripInventory.objects.bulk_create(created)
+        counts['fixed'] += len(fixed)
+        counts['created'] += len(created)
+    return counts
+
+def freeSeats(seatMap, capacity, count):
+    """picks the lowest numbered free seats of the trip
+
+    Args:
+        seatMap (bytes): seat map of the trip
+        capacity (int): number of seats on the bus
+        count (int): number of seats to pick
+
+    Returns:
+        list: picked seat numbers, shorter than count if not enough seats are free
+    """
+    picked = []
+    for seat in range(1, capacity + 1):
+        if len(picked) == count:
+            break
+        if not seatTaken(seatMap, seat):
+            picked.append(seat)
+    return picked
+
+def reserveSeats(bus, travelDate, seats=None, count=None):
+    """takes the given seats (or the first free ones when only a count is given) on a trip. The seat map is checked in python and written back with a conditional UPDATE 
+    that only matches if neither the map nor the seat count changed since they were read, so two bookings running at the same time can never take the same seat and no row lock is held while checking
+
+    Args:
+        bus (Buses): bus of the trip
+        travelDate (date): day of the trip
+        seats (list, optional): seat numbers to take, starting from 1
+        count (int, optional): number of seats to take when no seat numbers are given
+
+    Raises:
+        SeatsUnavailable: if a seat doesn't exist on the bus, is already taken or not enough seats are left
+
+    Returns:
+        list: the seats taken
+    """
+    for seat in seats or []:
+        if not 1 <= seat <= bus.available_seats:
+            raise SeatsUnavailable(f"Seat {seat} doesn't exist on this bus")
+
+    inventory = tripInventory(bus, travelDate)
+    for attempt in range(RESERVE_ATTEMPTS):
+        seatMap = bytes(inventory.seat_map)
+        if seats is None:
+            picked = freeSeats(seatMap, bus.available_seats, count)
+        else:
+            picked = seats
+            taken = [seat for seat in seats if seatTaken(seatMap, seat)]
+            if taken:
+                raise SeatsUnavailable(f"Seats {', '.join(map(str, taken))} are already booked")
+        if inventory.available_seats < len(picked) or (seats is None and len(picked) < count):
+            raise SeatsUnavailable("Number of Seats selected is greater than available seats")
+
+        updated = TripInventory.objects.filter(
+            pk=inventory.pk, seat_map=seatMap, available_seats=inventory.available_seats
+        ).update(
+            seat_map=markSeats(seatMap, picked), available_seats=F('available_seats') - len(picked)
+        )
+        if updated:
+            return picked
+        inventory.refresh_from_db(fields=['seat_map', 'available_seats'])
+
+    raise SeatsUnavailable("The seats are being booked by someone else, please try again")
+
+def releaseSeats(busId, travelDate, seats):
+    """gives seats of a trip back, with the same conditional UPDATE as reserveSeats so it can run next to the bookings
+
+    Args:
+        busId (int): id of the bus of the trip
+        travelDate (date): day of the trip
+        seats (list): seat numbers to give back
+    """
+    inventory = TripInventory.objects.filter(bus_id=busId, travel_date=travelDate).first()
+    while inventory is not None:
+        seatMap = bytes(inventory.seat_map)
+        released = [seat for seat in seats if seatTaken(seatMap, seat)]
+        if not released:
+            return
+        updated = TripInventory.objects.filter(
+            pk=inventory.pk, seat_map=seatMap, available_seats=inventory.available_seats
+        ).update(
+            seat_map=markSeats(seatMap, released, taken=False), available_seats=F('available_seats') + len(released)
+        )
+        if updated:
+            return
+        inventory.refresh_from_db(fields=['seat_map', 'available_seats'])
+
+def seatsOnDate(busIds, travelDate):
+    """returns the seats left on the given day for the buses whose trip has already been booked, the others still have all of their seats
+
+    Args:
+        busIds (list): ids of the buses
+        travelDate (date): day of the trips
+
+    Returns:
+        dict: seats left per bus id
+    """
+    if travelDate is None:
+        return {}
+    return dict(
+        TripInventory.objects.filter(bus_id__in=busIds, travel_date=travelDate).values_list('bus_id', 'available_seats')
+    )
+
+async def aseatsOnDate(busIds, travelDate):
+    """same as seatsOnDate but reads the inventory with the async ORM"""
+    if travelDate is None:
+        return {}
+    rows = TripInventory.objects.filter(bus_id__in=busIds, travel_date=travelDate).values_list('bus_id', 'available_seats')
+    return {busId: seats async for busId, seats in rows}
+
+def availableSeats(bus, travelDate):
+    """returns the seats left on a trip without creating its inventory row
+
+    Args:
+        bus (Buses): bus of the trip
+        travelDate (date): day of the trip
+
+    Returns:
+        int: seats left on the trip
+    """
+    return seatsOnDate([bus.bus_id], travelDate).get(bus.bus_id, bus.available_seats)
+
+def seatMap(bus, travelDate):
+    """returns the occupancy of a trip read from its seat map alone, without looking at the passengers
+
+    Args:
+        bus (Buses): bus of the trip
+        travelDate (date): day of the trip
+
+    Returns:
+        dict: capacity of the bus, seats left and the taken seat numbers
+    """
+    inventory = TripInventory.objects.filter(bus=bus, travel_date=travelDate).values('available_seats', 'seat_map').first()
+    if inventory is None:
+        return {'capacity': bus.available_seats, 'available': bus.available_seats, 'occupied': []}
+    return {
+        'capacity': bus.available_seats,
+        'available': inventory['available_seats'],
+        'occupied': occupiedSeats(bytes(inventory['seat_map'])),
+    }
@@ -0,0 +1,211 @@
+from datetime import date, datetime, time, timedelta
+from decimal import Decimal
+from itertools import permutations
+from random import Random
+from types import ModuleType
+
+from Buses.models import Buses, Bookings, SeatsDetail, TripInventory
+from Buses.inventory import markSeats, seatTaken
+from Buses.rollups import rebuildRollups
+from Buses.cache import searchCache
+from Buses.signals import timetableChanged
+from Buses.urls import busUrlPatterns
+from user_acc.models import user
+from user_acc import urls as userurls
+
+from utility.benchmark import LoadRequest
+
+from rest_framework_simplejwt.tokens import AccessToken
+
+from django.conf import settings
+from django.contrib.auth.hashers import make_password
+from django.db import transaction
+from django.db.models import Max
+from django.test.utils import override_settings
+from django.urls import include, path
+
+# everything seeded is recognisable, so that it can be cleared without touching the real data
+LOAD_USER_PREFIX = "loaduser"
+LOAD_PASSWORD = "load@1234"
+FIRST_BUSNUMBER = 900000
+LOAD_OPERATORS = ["Zing", "Orbit", "RoadLink", "Kalpana", "Intercity"]
+LOAD_CITIES = [
+    "Delhi", "Jaipur", "Agra", "Chandigarh", "Lucknow", "Dehradun", "Amritsar", "Shimla", "Manali", "Udaipur",
+    "Jodhpur", "Ajmer", "Kanpur", "Varanasi", "Haridwar", "Rishikesh", "Ludhiana", "Patiala", "Gwalior", "Indore",
+]
+SCENARIOS = ['search', 'businfo', 'booking', 'login', 'history']
+
+def seedTimetable(routes, busesPerRoute, bookings, users=10, seed=0, startDate=date(2030, 1, 1), days=7, batchSize=1000):
+    """seeds a synthetic timetable with its users and bookings, the same arguments always give the same dataset.
+    The bookings are spread over the days starting at startDate and their seats are taken in the inventory of their trips, so the booking flow sees a consistent state
+
+    Args:
+        routes (int): number of routes
+        busesPerRoute (int): number of buses on each route
+        bookings (int): number of bookings
+        users (int): number of users making the bookings, they all have the password LOAD_PASSWORD
+        seed (int): seed of the random generator
+        startDate (date): first day of the booked trips
+        days (int): number of days the bookings are spread over
+        batchSize (int): rows per insert
+
+    Returns:
+        dict: number of routes, buses, users, bookings and passengers seeded
+    """
+    random = Random(seed)
+    pairs = list(permutations(LOAD_CITIES, 2))
+    random.shuffle(pairs)
+    if routes > len(pairs):
+        raise ValueError(f"At most {len(pairs)} routes can be seeded")
+
+    with transaction.atomic():
+        # explicit keys, not every backend gives back the keys of a bulk insert
+        nextBusId = (Buses.objects.aggregate(last = Max('bus_id'))['last'] or 0) + 1
+        buses = []
+        for source, destination in pairs[:routes]:
+            for _ in range(busesPerRoute):
+                departure = time(random.randrange(24), random.choice([0, 15, 30, 45]))
+                duration = time(random.randrange(1, 13), random.choice([0, 15, 30, 45]))
+                arrival = (datetime.combine(startDate, departure) + timedelta(hours = duration.hour, minutes = duration.minute)).time()
+                buses.append(Buses(
+                    bus_id = nextBusId + len(buses), operator = random.choice(LOAD_OPERATORS), busnumber = FIRST_BUSNUMBER + len(buses),
+                    source = source, destination = destination, departure = f"{source} ISBT", arrival = f"{destination} ISBT",
+                    departuretime = departure, arrivaltime = arrival, duration = duration,
+                    price = Decimal(random.randrange(15000, 99900)) / 100, available_seats = random.randrange(30, 51),
+                    type = random.choice(['AC', 'NONAC']),
+                ))
+        Buses.objects.bulk_create(buses, batch_size = batchSize)
+
+        passwordHash = make_password(LOAD_PASSWORD)
+        nextUserId = (user.objects.aggregate(last = Max('id'))['last'] or 0) + 1
+        loadUsers = [
+            user(id = nextUserId + index, username = f"{LOAD_USER_PREFIX}{index}", password = passwordHash, DOB = date(1990, 1, 1), email = f"{LOAD_USER_PREFIX}{index}@example.com")
+            for index in range(users)
+        ]
+        user.objects.bulk_create(loadUsers, batch_size = batchSize)
+
+        trips = {}
+        nextBookingId = (Bookings.objects.aggregate(last = Max('id'))['last'] or 0) + 1
+        seededBookings, passengers = [], []
+        for _ in range(bookings):
+            bus = random.choice(buses)
+            travelDate = startDate + timedelta(days = random.randrange(days))
+            trip = trips.setdefault((bus.bus_id, travelDate), {'bus': bus, 'taken': 0})
+            count = min(random.randrange(1, 5), bus.available_seats - trip['taken'])
+            if count <= 0:
+                continue
+            booking = Bookings(
+                id = nextBookingId + len(seededBookings), user = random.choice(loadUsers), bus = bus, travel_date = travelDate,
+                no_of_seats = count, fare = bus.price, contact = 9000000000 + len(seededBookings), email = "load@example.com",
+                pincode = 110001, city = bus.source, state = "Delhi", address = "Load test",
+            )
+            seededBookings.append(booking)
+            for seat in range(trip['taken'] + 1, trip['taken'] + count + 1):
+                passengers.append(SeatsDetail(booking = booking, first_name = f"Passenger{seat}", age = random.randrange(5, 80), seat = seat))
+            trip['taken'] += count
+        Bookings.objects.bulk_create(seededBookings, batch_size = batchSize)
+        SeatsDetail.objects.bulk_create(passengers, batch_size = batchSize)
+
+        TripInventory.objects.bulk_create([
+            TripInventory(
+                bus = trip['bus'], travel_date = travelDate, available_seats = trip['bus'].available_seats - trip['taken'],
+                seat_map = markSeats(bytes((trip['bus'].available_seats + 7) // 8), range(1, trip['taken'] + 1)),
+            )
+            for (busId, travelDate), trip in trips.items()
+        ], batch_size = batchSize)
+
+        # bulk inserts don't send the signals which keep the caches and the rollups in line with the timetable and the bookings
+        rebuildRollups(busIds = [bus.bus_id for bus in buses])
+        timetableChanged()
+        transaction.on_commit(searchCache().clear)
+
+    return {'routes': routes, 'buses': len(buses), 'users': users, 'bookings': len(seededBookings), 'passengers': len(passengers)}
+
+def clearSeeded():
+    """deletes everything seedTimetable created, along with whatever was booked on the seeded buses
+
+    Returns:
+        int: number of rows deleted
+    """
+    with transaction.atomic():
+        deleted, _ = Buses.objects.filter(busnumber__gte = FIRST_BUSNUMBER).delete()
+        usersDeleted, _ = user.objects.filter(username__startswith = LOAD_USER_PREFIX).delete()
+        timetableChanged()
+        transaction.on_commit(searchCache().clear)
+    return deleted + usersDeleted
+
+def loadUrlconf(asyncViews):
+    """returns a url configuration of the API with the buses app served by its sync or its async views, whatever ASYNC_VIEWS says"""
+    urlconf = ModuleType(f"load_{'async' if asyncViews else 'sync'}_urls")
+    urlconf.urlpatterns = [
+        path("user/", include(userurls)),
+        path("buses/", include(busUrlPatterns(asyncViews = asyncViews))),
+    ]
+    return urlconf
+
+def loadSettings(asyncViews, keepSearchCache = False):
+    """returns the settings to run a load test with, the search cache is bypassed unless asked so that every search reaches the database"""
+    overrides = {'ROOT_URLCONF': loadUrlconf(asyncViews), 'ALLOWED_HOSTS': [*settings.ALLOWED_HOSTS, 'testserver']}
+    if not keepSearchCache:
+        overrides['CACHES'] = {**settings.CACHES, 'bus_search': {'BACKEND': 'django.core.cache.backends.dummy.DummyCache'}}
+    return override_settings(**overrides)
+
+def scenarioRequests(scenario, count, seed=0, startDate=date(2030, 1, 1), days=7):
+    """builds the requests of a load test scenario on the seeded data, the same arguments always give the same requests
+
+    Args:
+        scenario (str): one of SCENARIOS
+        count (int): number of requests
+        seed (int): seed of the random generator
+        startDate (date): first day of the seeded trips
+        days (int): number of days of seeded trips, the bookings are made on the day after them on seats which are still free
+
+    Returns:
+        list: LoadRequest to send
+    """
+    random = Random(f"{scenario}:{seed}")
+    loadUsers = list(user.objects.filter(username__startswith = LOAD_USER_PREFIX).order_by('id'))
+    buses = list(Buses.objects.filter(busnumber__gte = FIRST_BUSNUMBER).order_by('bus_id').values('bus_id', 'source', 'destination', 'available_seats'))
+    if not loadUsers or not buses:
+        raise ValueError("No seeded data, run seed_timetable first")
+    tokens = [{'Authorization': f"Bearer {AccessToken.for_user(usr)}"} for usr in loadUsers]
+
+    def travelDate():
+        return (startDate + timedelta(days = random.randrange(days))).strftime("%d-%m-%Y")
+
+    requests = []
+    bookingDay = startDate + timedelta(days = days)
+    bookingDate = bookingDay.strftime("%d-%m-%Y")
+    # earlier runs have booked seats on that day too, every request books a seat nobody has
+    seatMaps = dict(TripInventory.objects.filter(bus__busnumber__gte = FIRST_BUSNUMBER, travel_date = bookingDay).values_list('bus_id', 'seat_map'))
+    lastSeat = {}
+    for _ in range(count):
+        usr = random.randrange(len(loadUsers))
+        bus = random.choice(buses)
+        if scenario == 'search':
+            request = LoadRequest('GET', f"/buses/?source={bus['source']}&destination={bus['destination']}&date={travelDate()}", None, tokens[usr])
+        elif scenario == 'businfo':
+            request = LoadRequest('GET', f"/buses/{bus['bus_id']}/?date={travelDate()}", None, tokens[usr])
+        elif scenario == 'booking':
+            seatMap = bytes(seatMaps.get(bus['bus_id'], b""))
+            seat = lastSeat.get(bus['bus_id'], 0) + 1
+            while seat <= bus['available_seats'] and seatTaken(seatMap, seat):
+                seat += 1
+            if seat > bus['available_seats']:
+                continue
+            lastSeat[bus['bus_id']] = seat
+            data = {
+                'user': loadUsers[usr].id, 'bus': bus['bus_id'], 'date': bookingDate, 'no_of_seats': 1,
+                'contact': 9000000000, 'email': "load@example.com", 'pincode': 110001,
+                'city': bus['source'], 'state': "Delhi", 'address': "Load test",
+                'passengers': [{'first_name': "Passenger", 'age': 30, 'seat': seat}],
+            }
+            request = LoadRequest('POST', f"/buses/{bus['bus_id']}/", data, tokens[usr])
+        elif scenario == 'login':
+            request = LoadRequest('POST', "/user/login/", {'username': loadUsers[usr].username, 'password': LOAD_PASSWORD}, {})
+        elif scenario == 'history':
+            request = LoadRequest('GET', "/buses/bookings/", None, tokens[usr])
+        else:
+            raise ValueError(f"Unknown scenario {scenario}")
+        requests.append(request)
+    return requests
@@ -0,0 +1,60 @@
+from datetime import date, timedelta
+
+from Buses.models import Buses, Bookings
+from Buses.loadtest import loadSettings
+
+from utility.benchmark import LoadRequest, splitShares, runRequests
+
+from rest_framework_simplejwt.tokens import AccessToken
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+
+class Command(BaseCommand):
+    help = ("Compares requests/second and p50/p99 latency of the search and booking views served by the WSGI handler with the synchronous views "
+            "against the ASGI handler with the async views, both in process and through the whole middleware stack, on the configured database")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=1000, help="number of requests sent in each mode")
+        parser.add_argument('--concurrency', type=int, default=50, help="number of requests in flight at once")
+        parser.add_argument('--username', help="user the requests are authenticated as, defaults to the first user")
+        parser.add_argument('--path', action='append', dest='paths', help="path to request (repeatable), defaults to a search, a bus, the route options and the booking details")
+        parser.add_argument('--modes', default="wsgi,asgi", help="comma separated modes to run")
+        parser.add_argument('--search-cache', action='store_true', help="keep the search cache on, by default it is bypassed so every search reaches the database")
+
+    def handle(self, *args, **options):
+        userModel = get_user_model()
+        user = userModel.objects.filter(username = options['username']).first() if options['username'] else userModel.objects.order_by('pk').first()
+        if user is None:
+            raise CommandError("No user to authenticate the requests with")
+        headers = {'Authorization': f"Bearer {AccessToken.for_user(user)}"}
+
+        paths = options['paths'] or self.defaultPaths(user)
+        if not paths:
+            raise CommandError("No buses to request, pass --path or load a timetable first")
+        # every worker goes through the paths in turn with its own client
+        requests = [LoadRequest('GET', paths[index % len(paths)], None, headers) for index in range(options['requests'])]
+        shares = splitShares(requests, options['concurrency'])
+
+        self.stdout.write(f"{'mode':<6}{'requests':>10}{'errors':>8}{'req/s':>10}{'p50 ms':>10}{'p99 ms':>10}")
+        for mode in options['modes'].split(","):
+            if mode not in ('wsgi', 'asgi'):
+                raise CommandError(f"Unknown mode {mode}")
+            with loadSettings(asyncViews = mode == 'asgi', keepSearchCache = options['search_cache']):
+                summary = runRequests(mode, shares)
+            self.stdout.write(f"{mode:<6}{summary['requests']:>10}{summary['errors']:>8}{summary['rps']:>10}{summary['p50']:>10}{summary['p99']:>10}")
+
+    def defaultPaths(self, user):
+        """picks a search, a bus and (when the user has one) the booking details to request"""
+        bus = Buses.objects.order_by('bus_id').first()
+        if bus is None:
+            return []
+        travelDate = (date.today() + timedelta(days = 30)).strftime("%d-%m-%Y")
+        paths = [
+            f"/buses/?source={bus.source}&destination={bus.destination}&date={travelDate}",
+            f"/buses/{bus.bus_id}/?date={travelDate}",
+            "/buses/source_dest_options/",
+        ]
+        if Bookings.objects.filter(user = user).exists():
+            paths.append("/buses/booking_details/")
+        return paths
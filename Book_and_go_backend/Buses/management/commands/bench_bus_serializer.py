@@ -0,0 +1,56 @@
+from datetime import time
+from decimal import Decimal
+from random import Random
+from timeit import repeat
+
+from Buses.models import Buses
+from Buses.serializers import BusSerializer, BusRowSerializer
+
+from rest_framework.renderers import JSONRenderer
+
+from django.core.management.base import BaseCommand
+from django.forms.models import model_to_dict
+
+class Command(BaseCommand):
+    help = "Compares the time taken by BusSerializer and BusRowSerializer to serialize a page of buses (no database needed)"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=10, help="number of buses in the page")
+        parser.add_argument('--repeat', type=int, default=5, help="number of timed runs, the best one is reported")
+        parser.add_argument('--number', type=int, default=200, help="serializations per timed run")
+        parser.add_argument('--date', default="10-10-2030", help="departure date passed in the context, empty to leave the dates out")
+
+    def handle(self, *args, **options):
+        random = Random(0)
+        buses = [
+            Buses(
+                bus_id=number, operator="Zing", busnumber=1000 + number, source="Delhi", destination="Jaipur",
+                departure="ISBT", arrival="Sindhi Camp",
+                departuretime=time(random.randrange(24), random.randrange(60)),
+                arrivaltime=time(random.randrange(24), random.randrange(60)),
+                price=Decimal(random.randrange(10000, 99999)) / 100,
+                duration=time(random.randrange(1, 20), random.randrange(60)),
+                available_seats=random.randrange(50), type="AC",
+            )
+            for number in range(options['rows'])
+        ]
+        # what values() gives back for the same buses
+        rows = [model_to_dict(bus) for bus in buses]
+        context = {'isdate':True, 'date':options['date']} if options['date'] else {'isdate':False}
+
+        renderer = JSONRenderer()
+        expected = renderer.render(BusSerializer(buses, many=True, context=context).data)
+        if renderer.render(BusRowSerializer(rows, many=True, context=context).data) != expected:
+            self.stderr.write("BusRowSerializer output differs from BusSerializer")
+            return
+
+        timings = {}
+        for name, serialize in [
+            ("BusSerializer", lambda: BusSerializer(buses, many=True, context=context).data),
+            ("BusRowSerializer", lambda: BusRowSerializer(rows, many=True, context=context).data),
+        ]:
+            best = min(repeat(serialize, repeat=options['repeat'], number=options['number']))
+            timings[name] = best / options['number']
+            self.stdout.write(f"{name:<18} {timings[name] * 1e6:10.1f} us per page of {options['rows']}")
+
+        self.stdout.write(f"speedup {timings['BusSerializer'] / timings['BusRowSerializer']:.1f}x")
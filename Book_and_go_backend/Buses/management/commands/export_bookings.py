@@ -0,0 +1,42 @@
+from Buses.exports import EXPORTS, EXPORT_FORMATS, ExportLines, exportFilters, exportQuery, exportLines
+
+from rest_framework.exceptions import ValidationError
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+class Command(BaseCommand):
+    help = ("Exports the bookings (a row per booking) or the passenger manifest (a row per passenger) as CSV or NDJSON, "
+            "the rows are read and written a chunk at a time so any number of them can be exported")
+
+    def add_arguments(self, parser):
+        parser.add_argument('kind', choices=list(EXPORTS), help="what to export")
+        parser.add_argument('--format', choices=list(EXPORT_FORMATS), default='csv', help="format of the export")
+        parser.add_argument('--output', default='-', help="file to write, - writes to stdout")
+        parser.add_argument('--operator', help="only the bookings on the buses of this operator")
+        parser.add_argument('--bus', help="only the bookings on the bus with this id")
+        parser.add_argument('--from', dest='from', help="first travel date exported, DD-MM-YYYY")
+        parser.add_argument('--to', help="last travel date exported, DD-MM-YYYY")
+        parser.add_argument('--chunk-size', type=int, default=settings.EXPORT_CHUNK_SIZE, help="rows read with each query")
+
+    def handle(self, *args, **options):
+        try:
+            filters = exportFilters(options)
+        except ValidationError as e:
+            raise CommandError("; ".join(f"{name}: {error}" for name, error in e.detail.items()))
+
+        lines = exportLines(exportQuery(options['kind'], **filters), ExportLines(options['kind'], options['format']), options['chunk_size'])
+        if options['output'] == "-":
+            # the lines carry their own line endings
+            self.stdout.ending = ""
+            self.write(lines, self.stdout)
+        else:
+            try:
+                with open(options['output'], 'w', newline='', encoding='utf-8') as file:
+                    self.write(lines, file)
+            except OSError as e:
+                raise CommandError(str(e))
+
+    def write(self, lines, out):
+        for text in lines:
+            out.write(text)
@@ -0,0 +1,60 @@
+import sys
+
+from Buses.importer import TimetableImport, csvRows, ndjsonRows
+
+from django.core.management.base import BaseCommand, CommandError
+
+READERS = {'csv': csvRows, 'ndjson': ndjsonRows}
+
+class Command(BaseCommand):
+    help = ("Creates or updates buses from a CSV (with a header line) or NDJSON timetable of any size, matching them on their bus number. "
+            "The rows are validated and upserted in chunks, invalid rows are reported and skipped")
+
+    def add_arguments(self, parser):
+        parser.add_argument('file', help="timetable to import, - reads it from stdin")
+        parser.add_argument('--format', choices=list(READERS), help="format of the file, guessed from its extension by default")
+        parser.add_argument('--chunk-size', type=int, default=1000, help="rows validated and written at once")
+        parser.add_argument('--dry-run', action='store_true', help="print the buses which would be created or changed without writing anything")
+
+    def handle(self, *args, **options):
+        fileFormat = options['format'] or self.guessFormat(options['file'])
+        importer = TimetableImport(chunkSize=options['chunk_size'], dryRun=options['dry_run'], report=self.report(options))
+
+        if options['file'] == "-":
+            importer.run(READERS[fileFormat](sys.stdin))
+        else:
+            try:
+                with open(options['file'], newline='', encoding='utf-8') as file:
+                    importer.run(READERS[fileFormat](file))
+            except OSError as e:
+                raise CommandError(str(e))
+
+        counts = importer.counts
+        self.stdout.write(
+            f"{'Would import' if options['dry_run'] else 'Imported'} {counts['rows']} rows in {importer.elapsed:.2f}s ({importer.rowsPerSecond()} rows/s): "
+            f"{counts['created']} created, {counts['updated']} updated, {counts['unchanged']} unchanged, {counts['invalid']} invalid"
+        )
+
+    def guessFormat(self, path):
+        for fileFormat, extensions in [('csv', ('.csv',)), ('ndjson', ('.ndjson', '.jsonl'))]:
+            if path.lower().endswith(extensions):
+                return fileFormat
+        raise CommandError("Can't tell the format of the file, pass --format")
+
+    def report(self, options):
+        """prints the invalid rows, and in a dry run the diff of every bus which would change"""
+        def report(kind, line, busnumber, detail):
+            if kind == 'invalid':
+                self.stderr.write(f"line {line}: {self.errorText(detail)}")
+            elif options['dry_run'] and kind == 'created':
+                self.stdout.write(f"+ {busnumber} {detail['source']} -> {detail['destination']}")
+            elif options['dry_run']:
+                self.stdout.write(f"~ {busnumber} " + ", ".join(f"{name}: {old} -> {new}" for name, (old, new) in detail.items()))
+        return report
+
+    def errorText(self, detail):
+        if isinstance(detail, dict):
+            return "; ".join(f"{name}: {self.errorText(errors)}" for name, errors in detail.items())
+        if isinstance(detail, list):
+            return " ".join(str(error) for error in detail)
+        return str(detail)
@@ -0,0 +1,60 @@
+from json import dumps
+from time import perf_counter
+
+from Buses.models import Buses, Bookings
+from Buses.loadtest import SCENARIOS, FIRST_BUSNUMBER, LOAD_USER_PREFIX, loadSettings, scenarioRequests
+from user_acc.models import user
+
+from utility.benchmark import splitShares, runRequests
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+
+class Command(BaseCommand):
+    help = ("Runs the load test scenarios (search, bus info, booking, login and booking history) on the data seeded by seed_timetable, "
+            "through the WSGI or the ASGI handler at the given concurrency, and reports the throughput and p50/p95/p99 latency of each scenario as JSON")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--scenarios', default=",".join(SCENARIOS), help=f"comma separated scenarios to run, out of {','.join(SCENARIOS)}")
+        parser.add_argument('--requests', type=int, default=500, help="number of requests sent in each scenario")
+        parser.add_argument('--concurrency', type=int, default=20, help="number of requests in flight at once")
+        parser.add_argument('--mode', choices=['wsgi', 'asgi'], default='wsgi', help="wsgi runs the synchronous views from threads, asgi the async views on an event loop")
+        parser.add_argument('--seed', type=int, default=0, help="seed of the requests, the same seed sends the same requests")
+        parser.add_argument('--output', help="file the JSON report is written to, defaults to stdout")
+        parser.add_argument('--search-cache', action='store_true', help="keep the search cache on, by default it is bypassed so every search reaches the database")
+
+    def handle(self, *args, **options):
+        scenarios = options['scenarios'].split(",")
+        unknown = set(scenarios) - set(SCENARIOS)
+        if unknown:
+            raise CommandError(f"Unknown scenarios {', '.join(sorted(unknown))}")
+
+        report = {
+            'config': {name: options[name] for name in ['scenarios', 'requests', 'concurrency', 'mode', 'seed', 'search_cache']},
+            'database': connection.vendor,
+            'hasher': settings.PASSWORD_HASHERS[0],
+            'dataset': {
+                'buses': Buses.objects.filter(busnumber__gte = FIRST_BUSNUMBER).count(),
+                'users': user.objects.filter(username__startswith = LOAD_USER_PREFIX).count(),
+                'bookings': Bookings.objects.filter(bus__busnumber__gte = FIRST_BUSNUMBER).count(),
+            },
+            'scenarios': {},
+        }
+
+        with loadSettings(asyncViews = options['mode'] == 'asgi', keepSearchCache = options['search_cache']):
+            for scenario in scenarios:
+                try:
+                    requests = scenarioRequests(scenario, options['requests'], seed = options['seed'])
+                except ValueError as e:
+                    raise CommandError(str(e))
+                start = perf_counter()
+                report['scenarios'][scenario] = runRequests(options['mode'], splitShares(requests, options['concurrency']))
+                self.stderr.write(f"{scenario} done in {perf_counter() - start:.1f}s")
+
+        output = dumps(report, indent=2)
+        if options['output']:
+            with open(options['output'], 'w') as file:
+                file.write(output + "\n")
+        else:
+            self.stdout.write(output)
@@ -0,0 +1,28 @@
+from time import perf_counter
+
+from Buses.exports import exportFilters
+from Buses.rollups import rebuildRollups
+
+from rest_framework.exceptions import ValidationError
+
+from django.core.management.base import BaseCommand, CommandError
+
+class Command(BaseCommand):
+    help = ("Recomputes the per trip totals behind the analytics (bookings, seats sold, revenue) from the bookings, "
+            "to backfill them or to bring them back in line after bulk inserts. The buses are handled in chunks, each in its own transaction")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--bus', type=int, action='append', help="only the trips of this bus id, can be repeated")
+        parser.add_argument('--from', dest='from', help="first travel date rebuilt, DD-MM-YYYY")
+        parser.add_argument('--to', help="last travel date rebuilt, DD-MM-YYYY")
+        parser.add_argument('--chunk-size', type=int, default=500, help="buses handled per transaction")
+
+    def handle(self, *args, **options):
+        try:
+            dates = exportFilters({'from': options['from'], 'to': options['to']})
+        except ValidationError as e:
+            raise CommandError("; ".join(f"{name}: {error}" for name, error in e.detail.items()))
+
+        start = perf_counter()
+        trips = rebuildRollups(busIds=options['bus'], dateFrom=dates.get('from'), dateTo=dates.get('to'), chunkSize=options['chunk_size'])
+        self.stdout.write(f"Rebuilt the totals of {trips} trips in {perf_counter() - start:.2f}s")
@@ -0,0 +1,31 @@
+from Buses.models import Buses
+from Buses.loadtest import seedTimetable, clearSeeded, FIRST_BUSNUMBER
+
+from django.core.management.base import BaseCommand, CommandError
+
+class Command(BaseCommand):
+    help = ("Seeds a synthetic timetable for load testing: routes between a fixed list of cities, buses on each route, users and bookings on the following days. "
+            "The same options always seed the same data, and everything seeded can be removed again with --clear")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--routes', type=int, default=50, help="number of routes")
+        parser.add_argument('--buses-per-route', type=int, default=10, help="number of buses on each route")
+        parser.add_argument('--bookings', type=int, default=5000, help="number of bookings")
+        parser.add_argument('--users', type=int, default=50, help="number of users making the bookings")
+        parser.add_argument('--seed', type=int, default=0, help="seed of the random generator")
+        parser.add_argument('--clear', action='store_true', help="remove the previously seeded data first, alone it only removes it")
+        parser.add_argument('--replace', action='store_true', help="remove the previously seeded data and seed again")
+
+    def handle(self, *args, **options):
+        if options['clear'] or options['replace']:
+            self.stdout.write(f"{clearSeeded()} seeded rows deleted")
+            if not options['replace']:
+                return
+
+        if Buses.objects.filter(busnumber__gte = FIRST_BUSNUMBER).exists():
+            raise CommandError("The timetable is already seeded, pass --replace to seed it again")
+        try:
+            counts = seedTimetable(options['routes'], options['buses_per_route'], options['bookings'], users = options['users'], seed = options['seed'])
+        except ValueError as e:
+            raise CommandError(str(e))
+        self.stdout.write(", ".join(f"{count} {name}" for name, count in counts.items()) + " seeded")
@@ -0,0 +1,16 @@
+from Buses.holds import sweepExpiredHolds
+from Buses.idempotency import sweepExpiredKeys
+
+from django.core.management.base import BaseCommand
+
+class Command(BaseCommand):
+    help = "Releases the seats of the expired seat holds and deletes the expired idempotency keys, meant to be run every minute or so from cron"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500, help="rows handled per transaction")
+
+    def handle(self, *args, **options):
+        holds = sweepExpiredHolds(batchSize=options['batch_size'])
+        self.stdout.write(f"{holds} expired seat holds released")
+        keys = sweepExpiredKeys(batchSize=options['batch_size'])
+        self.stdout.write(f"{keys} expired idempotency keys deleted")
@@ -17,16 +17,29 @@ class Buses(models.Model):
     arrivaltime = models.TimeField()
     price = models.DecimalField(max_digits=5, decimal_places=2)
     duration = models.TimeField()
+    # seats on every trip of the bus, the seats left on a given day are kept in TripInventory
     available_seats = models.IntegerField()
     type = models.CharField(max_length=5, choices=Bus_type_choice)
     
+    class Meta:
+        # every search filters on the route first and then narrows or sorts on one of these columns
+        indexes = [
+            models.Index(fields=['source', 'destination', 'departuretime'], name='bus_route_depttime_idx'),
+            models.Index(fields=['source', 'destination', 'arrivaltime'], name='bus_route_arrtime_idx'),
+            models.Index(fields=['source', 'destination', 'price'], name='bus_route_price_idx'),
+            models.Index(fields=['source', 'destination', 'duration'], name='bus_route_duration_idx'),
+        ]
+    
 class Bookings(models.Model):
     
     id = models.AutoField(primary_key=True)
     user = models.ForeignKey(user, on_delete = models.CASCADE, related_name="booking")
     bus = models.ForeignKey(Buses, on_delete= models.CASCADE, related_name="booking")
     Date_TOB = models.DateTimeField(auto_now_add=True)
+    travel_date = models.DateField(null=True, blank=True)
     no_of_seats = models.IntegerField()
+    # price of a seat when the booking was made, before tax, None for the bookings made before it was kept
+    fare = models.DecimalField(max_digits=5, decimal_places=2, null=True, blank=True)
     contact = models.BigIntegerField()
     email = models.EmailField()
     pincode = models.IntegerField()
@@ -34,6 +47,12 @@ class Bookings(models.Model):
     state = models.CharField(max_length = 50)
     address = models.CharField(max_length=200)
     
+    class Meta:
+        # the booking history of a user is read newest first
+        indexes = [
+            models.Index(fields=['user', 'Date_TOB'], name='booking_user_tob_idx'),
+        ]
+    
 class SeatsDetail(models.Model):
     
     booking = models.ForeignKey(Bookings, on_delete=models.CASCADE, related_name='seatDetail')
@@ -41,4 +60,69 @@ class SeatsDetail(models.Model):
     middle_name = models.CharField(max_length=20, blank= True)
     last_name = models.CharField(max_length=20, blank=True)
     age = models.IntegerField()
-    seat = models.IntegerField()
\ No newline at end of file
+    seat = models.IntegerField()
+
+class TimetableVersion(models.Model):
+    
+    # a single row holding the time_ns() of the last change to the timetable, kept in the database so that every process sees the changes made by the others (see Buses.timetable)
+    version = models.BigIntegerField()
+
+class TripInventory(models.Model):
+    
+    bus = models.ForeignKey(Buses, on_delete=models.CASCADE, related_name='inventory')
+    travel_date = models.DateField()
+    available_seats = models.IntegerField()
+    # one bit per seat, the bit (seat - 1) % 8 of the byte (seat - 1) // 8 is set when the seat is taken
+    # rows are created by Buses.inventory.tripInventory with the seats already booked taken, rows created empty before that are fixed by the rebuild_inventory command
+    seat_map = models.BinaryField(default=bytes)
+    
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['bus', 'travel_date'], name='trip_inventory_bus_date_uniq'),
+        ]
+
+class TripRollup(models.Model):
+    
+    # the route and the capacity are copied from the bus (see Buses.rollups) so that the totals of a route are read without a join
+    bus = models.ForeignKey(Buses, on_delete=models.CASCADE, related_name='rollups')
+    source = models.CharField(max_length=20)
+    destination = models.CharField(max_length=20)
+    travel_date = models.DateField()
+    capacity = models.IntegerField()
+    bookings = models.IntegerField(default=0)
+    seats_sold = models.IntegerField(default=0)
+    # fares of the seats sold, before tax
+    revenue = models.DecimalField(max_digits=12, decimal_places=2, default=0)
+    
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['bus', 'travel_date'], name='trip_rollup_bus_date_uniq'),
+        ]
+        indexes = [
+            models.Index(fields=['source', 'destination', 'travel_date'], name='trip_rollup_route_date_idx'),
+            models.Index(fields=['travel_date'], name='trip_rollup_date_idx'),
+        ]
+
+class SeatHold(models.Model):
+    
+    token = models.CharField(max_length=32, unique=True)
+    user = models.ForeignKey(user, on_delete=models.CASCADE, related_name='seat_holds')
+    bus = models.ForeignKey(Buses, on_delete=models.CASCADE, related_name='holds')
+    travel_date = models.DateField()
+    seats = models.JSONField()
+    expires_at = models.DateTimeField(db_index=True)
+
+class IdempotencyKey(models.Model):
+    
+    user = models.ForeignKey(user, on_delete=models.CASCADE, related_name='idempotency_keys')
+    key = models.CharField(max_length=64)
+    # sha256 digest of the request body, a retry has to send the same body as the first request
+    fingerprint = models.BinaryField(max_length=32)
+    status_code = models.PositiveSmallIntegerField()
+    response = models.JSONField()
+    expires_at = models.DateTimeField(db_index=True)
+    
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'key'], name='idempotency_user_key_uniq'),
+        ]
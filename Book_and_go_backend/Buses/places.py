@@ -0,0 +1,111 @@
+from bisect import bisect_left
+from functools import lru_cache
+from threading import Lock
+from time import monotonic
+from unicodedata import category, normalize
+
+from Buses.models import Buses, Bookings
+from Buses.timetable import timetableVersion
+
+from utility.routers import primaryAfterChange
+
+from django.conf import settings
+from django.db.models import Count
+
+def placeKey(text):
+    """folds a place name or a typed prefix for matching, the case and the accents are dropped so that "Sao" and "são" both match "São Paulo"
+
+    Args:
+        text (str): place name or prefix
+
+    Returns:
+        str: folded text
+    """
+    return "".join(char for char in normalize('NFKD', text) if category(char) != 'Mn').casefold().strip()
+
+class PlacesIndex:
+    """in memory autocomplete index of the places served by the buses, a sorted array of the folded names and of every word inside them so that a lookup is a binary search
+    followed by a scan of the matches. The places are ranked by the number of bookings from or to them and then by the number of buses serving them.
+    The index is rebuilt when the timetable version changes, and every PLACES_POPULARITY_MAX_AGE seconds so that the ranking follows the bookings
+    """
+
+    def __init__(self):
+        self.lock = Lock()
+        self.state = None
+
+    def build(self):
+        """reads the places along with their bus and booking counts, two grouped queries whatever the size of the timetable"""
+        version = timetableVersion()
+        primaryAfterChange(version)
+        places = {}
+        for role in ('source', 'destination'):
+            for name, buses in Buses.objects.order_by().values_list(role).annotate(buses=Count('bus_id')):
+                place = places.setdefault(name, {'name': name, 'source': False, 'destination': False, 'buses': 0, 'bookings': 0})
+                place[role] = True
+                place['buses'] += buses
+            for name, bookings in Bookings.objects.order_by().values_list(f"bus__{role}").annotate(bookings=Count('id')):
+                if name in places:
+                    places[name]['bookings'] += bookings
+
+        ranked = sorted(places.values(), key=lambda place: (-place['bookings'], -place['buses'], place['name']))
+        entries = sorted(
+            (key, rank)
+            for rank, place in enumerate(ranked)
+            for key in {placeKey(place['name']), *(placeKey(word) for word in place['name'].split()[1:])}
+        )
+        # replaced in one assignment so that a lookup never sees half of an index
+        self.state = {
+            'version': version,
+            'builtAt': monotonic(),
+            'keys': [key for key, _ in entries],
+            'ranks': [rank for _, rank in entries],
+            'places': [{'name': place['name'], 'source': place['source'], 'destination': place['destination']} for place in ranked],
+        }
+
+    def current(self):
+        """returns the index for the current timetable version, rebuilding it if needed"""
+        state = self.state
+        if state is None or state['version'] != timetableVersion() or monotonic() - state['builtAt'] >= settings.PLACES_POPULARITY_MAX_AGE:
+            with self.lock:
+                state = self.state
+                if state is None or state['version'] != timetableVersion() or monotonic() - state['builtAt'] >= settings.PLACES_POPULARITY_MAX_AGE:
+                    self.build()
+                    state = self.state
+        return state
+
+    def lookup(self, prefix, role=None, limit=10):
+        """returns the places whose name, or a word of it, starts with the prefix
+
+        Args:
+            prefix (str): typed text, matched without case or accents, an empty prefix gives the most popular places
+            role (str, optional): 'source' or 'destination' to only get the places buses leave from or go to
+            limit (int): number of places returned
+
+        Returns:
+            list: places as {'name', 'source', 'destination'}, most popular first
+        """
+        state = self.current()
+        key = placeKey(prefix)
+        keys, ranks, places = state['keys'], state['ranks'], state['places']
+        if key:
+            matched = set()
+            for index in range(bisect_left(keys, key), len(keys)):
+                if not keys[index].startswith(key):
+                    break
+                matched.add(ranks[index])
+            candidates = (places[rank] for rank in sorted(matched))
+        else:
+            candidates = iter(places)
+
+        found = []
+        for place in candidates:
+            if role is None or place[role]:
+                found.append(place)
+                if len(found) == limit:
+                    break
+        return found
+
+@lru_cache(maxsize=None)
+def placesIndex():
+    """returns the places index of this process"""
+    return PlacesIndex()
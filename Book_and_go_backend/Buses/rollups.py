@@ -0,0 +1,147 @@
+from decimal import Decimal
+
+from Buses.models import Buses, Bookings, TripRollup
+
+from django.db import IntegrityError, transaction
+from django.db.models import Count, DecimalField, ExpressionWrapper, F, Sum
+from django.db.models.functions import Coalesce
+from django.db.models.signals import post_save
+from django.dispatch import receiver
+
+# longest period the totals of a route are read for at once
+MAX_PERIOD_DAYS = 366
+
+def addToRollup(bus, travelDate, bookings, seats, revenue):
+    """adds bookings to the totals of a trip, in the transaction of the bookings so that the totals never disagree with them.
+    The row is updated with a single UPDATE adding to the columns so that bookings of the same trip running at the same time can't overwrite each other
+
+    Args:
+        bus (Buses): bus of the trip
+        travelDate (date): day of the trip
+        bookings (int): number of bookings added
+        seats (int): number of seats sold
+        revenue (Decimal): fares of the seats sold
+    """
+    changes = {'bookings': F('bookings') + bookings, 'seats_sold': F('seats_sold') + seats, 'revenue': F('revenue') + revenue}
+    if TripRollup.objects.filter(bus=bus, travel_date=travelDate).update(**changes):
+        return
+    try:
+        with transaction.atomic():
+            TripRollup.objects.create(
+                bus=bus, source=bus.source, destination=bus.destination, travel_date=travelDate, capacity=bus.available_seats,
+                bookings=bookings, seats_sold=seats, revenue=revenue,
+            )
+    except IntegrityError:
+        # created by another booking of the trip in the meantime
+        TripRollup.objects.filter(bus=bus, travel_date=travelDate).update(**changes)
+
+def bookingRevenue(booking):
+    # an instance keeps the value it was created with, which isn't always a Decimal yet
+    fare = booking.fare if booking.fare is not None else booking.bus.price
+    return Decimal(fare) * booking.no_of_seats
+
+@receiver(post_save, sender=Bookings)
+def bookingSaved(sender, instance, created, raw=False, **kwargs):
+    """adds a new booking to the totals of its trip, the bookings without a travel date are on no trip and left out.
+    Bookings are only ever deleted along with their bus, whose totals go with it, or with their user, whose seats stay sold until the totals are rebuilt.
+    No delete receiver is connected since it would keep django from deleting the bookings of a bus or a user in bulk
+    """
+    if created and not raw and instance.travel_date is not None:
+        addToRollup(instance.bus, instance.travel_date, 1, instance.no_of_seats, bookingRevenue(instance))
+
+# columns of a bus copied into the totals of its trips
+ROLLUP_BUS_FIELDS = {'source', 'destination', 'available_seats'}
+
+def busesMoved(buses):
+    """moves the totals of the buses to their new route or capacity, with one UPDATE per distinct route and capacity
+
+    Args:
+        buses (dict): (source, destination, seats on the bus) per bus id
+    """
+    moves = {}
+    for busId, bus in buses.items():
+        moves.setdefault(bus, []).append(busId)
+    for (source, destination, capacity), busIds in moves.items():
+        TripRollup.objects.filter(bus_id__in=busIds).update(source=source, destination=destination, capacity=capacity)
+
+@receiver(post_save, sender=Buses)
+def busSaved(sender, instance, created, update_fields=None, raw=False, **kwargs):
+    """the totals of a bus follow it to its new route or capacity, the bulk updates of an import move them themselves (see Buses.importer)"""
+    if not created and not raw and (update_fields is None or ROLLUP_BUS_FIELDS & set(update_fields)):
+        busesMoved({instance.pk: (instance.source, instance.destination, instance.available_seats)})
+
+def rebuildRollups(busIds=None, dateFrom=None, dateTo=None, chunkSize=500):
+    """recomputes the totals of the trips from the bookings, to fill them for the bookings made before they were kept or after bulk inserts which send no signals.
+    The buses are handled a chunk at a time, each in its own transaction, with one grouped query over their bookings
+
+    Args:
+        busIds (list, optional): only the trips of these buses
+        dateFrom (date, optional): only the trips on or after this day
+        dateTo (date, optional): only the trips on or before this day
+        chunkSize (int): buses handled per transaction
+
+    Returns:
+        int: number of trips with bookings
+    """
+    buses = Buses.objects.order_by('bus_id')
+    if busIds is not None:
+        buses = buses.filter(bus_id__in=busIds)
+    dates = {}
+    if dateFrom is not None:
+        dates['travel_date__gte'] = dateFrom
+    if dateTo is not None:
+        dates['travel_date__lte'] = dateTo
+
+    trips = 0
+    last = 0
+    while chunk := list(buses.filter(bus_id__gt=last).only('bus_id', 'source', 'destination', 'available_seats')[:chunkSize]):
+        last = chunk[-1].bus_id
+        chunkBuses = {bus.bus_id: bus for bus in chunk}
+        with transaction.atomic():
+            TripRollup.objects.filter(bus_id__in=chunkBuses, **dates).delete()
+            totals = Bookings.objects.filter(bus_id__in=chunkBuses, travel_date__isnull=False, **dates).order_by().values('bus_id', 'travel_date').annotate(
+                bookings=Count('id'), seats_sold=Sum('no_of_seats'),
+                revenue=Sum(ExpressionWrapper(Coalesce('fare', 'bus__price') * F('no_of_seats'), output_field=DecimalField(max_digits=12, decimal_places=2))),
+            )
+            rollups = [
+                TripRollup(
+                    bus_id=row['bus_id'], source=chunkBuses[row['bus_id']].source, destination=chunkBuses[row['bus_id']].destination,
+                    travel_date=row['travel_date'], capacity=chunkBuses[row['bus_id']].available_seats,
+                    bookings=row['bookings'], seats_sold=row['seats_sold'], revenue=row['revenue'],
+                )
+                for row in totals
+            ]
+            TripRollup.objects.bulk_create(rollups)
+        trips += len(rollups)
+    return trips
+
+def routeTotals(source, destination, dateFrom, dateTo):
+    """reads the totals of a route for every day of a period from the rollups, the rows read depend on the number of buses and days and not on the number of bookings
+
+    Args:
+        source (str): source of the route
+        destination (str): destination of the route
+        dateFrom (date): first day
+        dateTo (date): last day
+
+    Returns:
+        dict: the days with bookings, each with its bookings, seats sold, seats offered, occupancy (seats sold per seat offered) and revenue, and the same totals over the period
+    """
+    rows = TripRollup.objects.filter(source=source, destination=destination, travel_date__range=(dateFrom, dateTo))
+    sums = {'bookings': Sum('bookings'), 'seats_sold': Sum('seats_sold'), 'capacity': Sum('capacity'), 'revenue': Sum('revenue')}
+
+    def layout(totals):
+        return {
+            'bookings': totals['bookings'] or 0,
+            'seats_sold': totals['seats_sold'] or 0,
+            'capacity': totals['capacity'] or 0,
+            'occupancy': round(totals['seats_sold'] / totals['capacity'], 4) if totals['capacity'] else 0,
+            # sums of decimals don't keep their scale on every backend
+            'revenue': f"{totals['revenue'] or Decimal(0):.2f}",
+        }
+
+    days = [
+        {'date': day.pop('travel_date').strftime("%d-%m-%Y"), **layout(day)}
+        for day in rows.order_by('travel_date').values('travel_date').annotate(**sums)
+    ]
+    return {'days': days, 'total': layout(rows.aggregate(**sums))}
@@ -1,13 +1,14 @@
-from Buses.models import Buses, SeatsDetail, Bookings
+from Buses.models import Buses, SeatsDetail, Bookings, SeatHold
+from Buses.inventory import availableSeats
 
-from datetime import timedelta, datetime
+from datetime import timedelta, datetime, time
+from decimal import Decimal, getcontext
+from functools import lru_cache
 
-from rest_framework.serializers import ModelSerializer, SerializerMethodField, ListField
+from rest_framework.serializers import ModelSerializer, SerializerMethodField, IntegerField, CharField, ChoiceField, DecimalField, TimeField
+from rest_framework.settings import api_settings
+from rest_framework import ISO_8601
 from rest_framework.validators import ValidationError
-from rest_framework.response import Response
-from rest_framework import status
-
-from django.core.exceptions import ObjectDoesNotExist
 
 class BusSerializer(ModelSerializer):
     """Serializer class for Buses models, used for validating,creating the data, it has 4 additional properties tax, total, departureDate, arrivalDate which are computed using class methods 
@@ -91,6 +92,100 @@ class BusSerializer(ModelSerializer):
         price = float(obj.price)
         return round(price + tax, 2)
 
+def fieldRepresentation(field):
+    """returns a function giving the same representation of a column value as the serializer field, the common decimal and ISO 8601 time cases skip the checks the field repeats on every call
+
+    Args:
+        field (rest_framework field): serializer field of the column
+
+    Returns:
+        function: takes the column value and returns its representation, None if the value is already in its final form
+    """
+    if isinstance(field, (IntegerField, CharField, ChoiceField)):
+        return None
+    
+    if isinstance(field, TimeField) and getattr(field, 'format', api_settings.TIME_FORMAT).lower() == ISO_8601:
+        return time.isoformat
+    
+    if isinstance(field, DecimalField) and getattr(field, 'coerce_to_string', api_settings.COERCE_DECIMAL_TO_STRING) and not field.localize and field.decimal_places is not None:
+        context = getcontext().copy()
+        if field.max_digits is not None:
+            context.prec = field.max_digits
+        if field.rounding is not None:
+            context.rounding = field.rounding
+        exponent = Decimal('.1') ** field.decimal_places
+        return lambda value: '{:f}'.format(value.quantize(exponent, context=context))
+    
+    return field.to_representation
+
+@lru_cache(maxsize=None)
+def busRowLayout(isdate):
+    """returns the output fields of BusSerializer in their order along with the function turning a column value into its representation, None is used for the computed fields
+
+    Args:
+        isdate (bool): whether the departure and arrival dates are part of the output
+
+    Returns:
+        tuple: (field name, converter) pairs
+    """
+    layout = []
+    for name, field in BusSerializer(context = {'isdate':isdate}).fields.items():
+        if isinstance(field, SerializerMethodField):
+            layout.append((name, None))
+        else:
+            layout.append((name, fieldRepresentation(field)))
+    return tuple(layout)
+
+class BusRowSerializer:
+    """Read only serializer giving exactly the same output as BusSerializer but working on the dictionaries returned by values(). 
+    It skips the model instances and the per field machinery of the rest framework, the context date is parsed only once and the computed fields (tax, total, departureDate, arrivalDate) are filled in a single pass over the rows
+
+    Args:
+        rows (dict or list): a row from values() or a list of them when many is True
+        many (bool): whether rows is a list of rows
+        context (dict): same context as BusSerializer, isdate tells if the dates are added and date is the departure date in DD-MM-YYYY format
+    """
+    def __init__(self, rows, many = False, context = None):
+        self.rows = rows
+        self.many = many
+        self.context = context or {}
+    
+    @property
+    def data(self):
+        isdate = bool(self.context.get('isdate'))
+        layout = busRowLayout(isdate)
+        
+        departureDate = None
+        if isdate:
+            departureDate = datetime.strptime(self.context.get('date'), "%d-%m-%Y").date()
+        
+        if self.many:
+            return [self.represent(row, layout, departureDate) for row in self.rows]
+        return self.represent(self.rows, layout, departureDate)
+    
+    def represent(self, row, layout, departureDate):
+        """builds the representation of a single row following the field order of BusSerializer"""
+        price = float(row['price'])
+        tax = round(price*0.18, 2)
+        computed = {'tax': tax, 'total': round(price + tax, 2)}
+        
+        if departureDate is not None:
+            duration = row['duration']
+            duration = timedelta(hours=duration.hour, minutes = duration.minute, seconds=duration.second)
+            arrival = datetime.combine(departureDate, row['departuretime']) + duration
+            computed['departureDate'] = self.context.get('date')
+            computed['arrivalDate'] = arrival.date().strftime("%d-%m-%Y")
+        
+        data = {}
+        for name, convert in layout:
+            if name in computed:
+                data[name] = computed[name]
+            elif convert is None:
+                data[name] = row[name]
+            else:
+                data[name] = convert(row[name])
+        return data
+
 class SeatsSerializer(ModelSerializer):
     """built-in serializer class for model SeatsDetail used for validating and creating the data for the specific model and validates the age field from the data input by the user
 
@@ -103,7 +198,8 @@ class SeatsSerializer(ModelSerializer):
     class Meta:
         model = SeatsDetail
         fields = "__all__"
-        
+        # the passengers are validated along with their booking, before the booking row exists
+        extra_kwargs = {'booking': {'read_only': True}}
         
     def validate_age(self, age):
         """validates the age field 
@@ -124,8 +220,8 @@ class SeatsSerializer(ModelSerializer):
         
 class BookingSerializer(ModelSerializer):
     """Serializer class for the model Bookings. It validates the data for both Bookings class and SeatsDetail class and also helps to create the data for both of the models.
-    price is an extra field which is computed using class method. It overrides the create method where it creates and saves the data for the booking model,
-    and pops the passenger data from the validated data and uses the SeatsSerializer class to creat the data for SeatsDetail model
+    price is an extra field which is computed using class method. The passengers are validated together as a list of SeatsSerializer when the booking is validated, 
+    and the create method saves the booking and then inserts all of its passengers with a single bulk insert
 
     Args:
         ModelSerializer (class): built-in serializer class for models in rest_framework.serializers
@@ -133,50 +229,55 @@ class BookingSerializer(ModelSerializer):
     Raises:
         ValidationError: if the no. of seats entered by the user is greater than the available seats then the error is raised 
     """
-    passengers = ListField()
+    passengers = SeatsSerializer(many = True, write_only = True)
     price = SerializerMethodField()
     
     class Meta:
         model = Bookings 
         fields = "__all__"
+        # the date of travel is sent as date (dd-mm-yyyy) like everywhere else in the API and set by the view, as is the user who is always the authenticated one
+        extra_kwargs = {'travel_date': {'read_only': True}, 'fare': {'read_only': True}, 'user': {'read_only': True}}
     
     def create(self, validated_data):
         passengerDetails = validated_data.pop('passengers')
-        booking = Bookings.objects.create(**validated_data)
+        booking = Bookings.objects.create(fare = validated_data['bus'].price, **validated_data)
         
-        for passenger in passengerDetails:
-            passenger.update({'booking':booking.id})
-            data = SeatsSerializer(data = passenger)
-            if data.is_valid(raise_exception=True):
-                data.save()
-            else:
-                print(data.errors)
+        SeatsDetail.objects.bulk_create([SeatsDetail(booking = booking, **passenger) for passenger in passengerDetails])
                 
         return booking
             
-    def validate_no_of_seats(self, value):
-        """ validates the no. of seats field 
+    def validate(self, attrs):
+        """ validates the no. of seats against the seats left on the trip of the bus, the travel date is taken from the context of the serializer. 
+        When the booking uses a seat hold (hold in the context) the passengers must have exactly the held seats instead
         Args:
-            value (int): no. of seats entered by the user 
+            attrs (dict): booking data after the fields have been validated 
 
         Raises:
             ValidationError: if the no. of seats entered by the user is greater than the available seats then the error is raised
+            ValidationError: if the passengers don't match the no. of seats or two of them have the same seat
 
         Returns:
-            int: returns the no. of seats if its greater than available seats 
+            dict: returns the booking data if the no. of seats is not greater than available seats 
         """
-        id = self.initial_data.get('bus')
-        try:
-            bus_instance = Buses.objects.get(bus_id = id)
-        except ObjectDoesNotExist:
-            return Response({'status':'Failure', 'message':"Bus no longer exists"}, status=status.HTTP_404_NOT_FOUND)
-        else:
-            available_seats = bus_instance.available_seats
+        seats = [passenger['seat'] for passenger in attrs['passengers']]
+        if len(seats) != attrs['no_of_seats']:
+            raise ValidationError({'passengers': "Number of passengers must be equal to the number of seats"})
+        if len(set(seats)) != len(seats):
+            raise ValidationError({'passengers': "Two passengers can't have the same seat"})
+        
+        hold = self.context.get('hold')
+        if hold is not None:
+            # the seats of a hold have already been taken from the trip
+            if hold.bus_id != attrs['bus'].bus_id or sorted(hold.seats) != sorted(seats):
+                raise ValidationError({'passengers': "The seats of the passengers must be the seats that were held"})
+            return attrs
+        
+        available_seats = availableSeats(attrs['bus'], self.context.get('travel_date'))
             
-        if value <= available_seats:
-            return value
+        if attrs['no_of_seats'] <= available_seats:
+            return attrs
         else:
-            raise ValidationError("Number of Seats selected is greater than available seats")
+            raise ValidationError({'no_of_seats': "Number of Seats selected is greater than available seats"})
     
     def get_price(self, obj):
         """computes the value for price field
@@ -187,9 +288,74 @@ class BookingSerializer(ModelSerializer):
         Returns:
             float: it gives the total price value against the no. of seats booked by the user
         """
-        seats = obj.no_of_seats
-        serialized_data = BusSerializer(obj.bus).data
-        
-        price = serialized_data.get('total')
-        return price*seats
+        # the fare the seats were booked at, the total with tax is computed like BusSerializer.get_total without serializing the whole bus
+        price = float(obj.fare if obj.fare is not None else obj.bus.price)
+        total = round(price + round(price*0.18, 2), 2)
+        return total*obj.no_of_seats
+
+class BookingHistorySerializer(ModelSerializer):
+    """read only serializer for the booking history, it nests the bus and the passengers of each booking which are expected to be loaded along with the bookings (see Buses.history.userBookings)
+
+    Args:
+        ModelSerializer (class): built-in class in rest_framework.serializers
+    """
+    bus = BusSerializer(read_only = True)
+    passengers = SeatsSerializer(source = 'seatDetail', many = True, read_only = True)
+    
+    class Meta:
+        model = Bookings
+        exclude = ['user']
+
+class SeatHoldSerializer(ModelSerializer):
+    """Serializer class for the model SeatHold. It validates the seats asked for by the user, either as a list of seat numbers or as a number of seats (no_of_seats) 
+    in which case the first free seats are picked, and gives back the token and expiry of the hold
+
+    Args:
+        ModelSerializer (class): built-in serializer class for models in rest_framework.serializers
+
+    Raises:
+        ValidationError: if neither the seats nor the no. of seats are given or the seats are not distinct positive numbers
+    """
+    no_of_seats = IntegerField(min_value = 1, required = False, write_only = True)
+    
+    class Meta:
+        model = SeatHold
+        fields = ['token', 'bus', 'travel_date', 'seats', 'no_of_seats', 'expires_at']
+        read_only_fields = ['token', 'bus', 'travel_date', 'expires_at']
+        extra_kwargs = {'seats': {'required': False}}
     
+    def validate_seats(self, value):
+        """validates the seat numbers
+
+        Args:
+            value (list): seat numbers asked for by the user
+
+        Raises:
+            ValidationError: if the seats are not distinct positive numbers
+
+        Returns:
+            list: the seat numbers
+        """
+        # a JSON true or false is a python bool, which is an int as well
+        if not isinstance(value, list) or not value or not all(isinstance(seat, int) and not isinstance(seat, bool) and seat > 0 for seat in value):
+            raise ValidationError("Seats must be a list of seat numbers")
+        if len(set(value)) != len(value):
+            raise ValidationError("Seats can't be repeated")
+        return value
+    
+    def validate(self, attrs):
+        if not attrs.get('seats') and not attrs.get('no_of_seats'):
+            raise ValidationError("Either the seats or the number of seats must be given")
+        return attrs
+
+class BusImportSerializer(ModelSerializer):
+    """validates one row of a timetable import (see Buses.importer), the bus number identifies the bus so an existing number is an update and not a validation error
+
+    Args:
+        ModelSerializer (class): built-in serializer class for models in rest_framework.serializers
+    """
+    
+    class Meta:
+        model = Buses
+        exclude = ['bus_id']
+        extra_kwargs = {'busnumber': {'validators': []}}
@@ -0,0 +1,48 @@
+from Buses.models import Buses
+from Buses.cache import invalidateRoute
+from Buses.timetable import bumpTimetableVersion
+
+from django.db import transaction
+from django.db.models.signals import pre_save, post_save, post_delete
+from django.dispatch import receiver, Signal
+
+# sent once a change to the timetable is committed, the changed bus is passed as `instance` and its id as `bus_id` (both None when many buses changed at once),
+# the id is captured when the change is made since a deleted instance has lost its primary key by then.
+# `previous_version` is the timetable version the change replaced and `version` the one it made (see Buses.timetable.bumpTimetableVersion)
+timetable_changed = Signal()
+
+ROUTE_FIELDS = {'source', 'destination'}
+# saving only the seat capacity leaves the routes and times as they are
+INVENTORY_FIELDS = {'available_seats'}
+
+def invalidateOnCommit(source, destination):
+    """drops the cached searches of a route once the current transaction is committed, so that a concurrent search can't cache the old rows again"""
+    transaction.on_commit(lambda: invalidateRoute(source, destination))
+
+def timetableChanged(instance=None):
+    """bumps the timetable version and notifies the listeners of timetable_changed once the current transaction is committed
+
+    Args:
+        instance (Buses, optional): the bus that changed, None if many of them did
+    """
+    busId = instance.pk if instance is not None else None
+    def notify():
+        previousVersion, version = bumpTimetableVersion()
+        timetable_changed.send(sender=Buses, instance=instance, bus_id=busId, previous_version=previousVersion, version=version)
+    transaction.on_commit(notify)
+
+@receiver(pre_save, sender=Buses)
+def busMoving(sender, instance, update_fields=None, **kwargs):
+    """when a bus is moved to another route the searches of the route it is leaving have to be dropped as well"""
+    if instance.pk is None or (update_fields is not None and not ROUTE_FIELDS & set(update_fields)):
+        return
+    oldRoute = Buses.objects.filter(pk=instance.pk).values_list('source', 'destination').first()
+    if oldRoute and oldRoute != (instance.source, instance.destination):
+        invalidateOnCommit(*oldRoute)
+
+@receiver([post_save, post_delete], sender=Buses)
+def busChanged(sender, instance, update_fields=None, **kwargs):
+    """drops the cached searches of the bus's route and bumps the timetable version unless only the seat capacity was saved"""
+    invalidateOnCommit(instance.source, instance.destination)
+    if update_fields is None or not set(update_fields) <= INVENTORY_FIELDS:
+        timetableChanged(instance)
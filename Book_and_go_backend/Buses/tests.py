@@ -1,3 +1,1340 @@
-from django.test import TestCase
+from datetime import date, time, timedelta
+from decimal import Decimal
+from csv import reader
+from io import StringIO
+from tempfile import TemporaryDirectory
+from json import loads
+from re import findall
+from types import ModuleType
+from unittest.mock import patch
 
-# Create your tests here.
+from Buses.models import Buses, Bookings, SeatsDetail, TripInventory, TripRollup, SeatHold, IdempotencyKey, TimetableVersion
+from Buses.idempotency import sweepExpiredKeys
+from Buses.holds import sweepExpiredHolds
+from Buses.inventory import reserveSeats, markSeats, occupiedSeats, seatTaken, SeatsUnavailable
+from Buses.cache import searchCache, searchCacheStats, invalidateRoute
+from Buses.facets import searchFacets
+from Buses.serializers import BusSerializer, BusRowSerializer, BookingSerializer
+from Buses.urls import busUrlPatterns
+from Buses.connections import ConnectionIndex, connectionIndex
+from Buses.places import placesIndex, placeKey
+from Buses.importer import TimetableImport, csvRows, ndjsonRows
+from Buses.timetable import timetableVersion
+from Buses.loadtest import SCENARIOS, FIRST_BUSNUMBER, seedTimetable, clearSeeded, loadSettings, scenarioRequests
+from user_acc.models import user
+from user_acc.authentication import userCache
+from utility.functions import timeBasedData, priceBasedData, durationBasedData
+from utility.routers import ReplicaRouter, RoutingState, currentRouting, STICKY_COOKIE
+
+from rest_framework.renderers import JSONRenderer
+from rest_framework.test import APITestCase, APITransactionTestCase, APIClient
+from rest_framework_simplejwt.tokens import AccessToken
+
+from asgiref.sync import sync_to_async, async_to_sync
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.management import call_command, CommandError
+from django.apps import apps
+from django.core.management.color import no_style
+from django.db import DEFAULT_DB_ALIAS, connection, connections, transaction
+from django.db.models import F
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import include, path
+from django.utils.timezone import now
+
+
+def createBus(busnumber, source="Delhi", destination="Jaipur", **kwargs):
+    """creates a bus entry with sensible defaults so that each test only has to mention the fields it cares about"""
+    data = {
+        'operator': "Zing",
+        'busnumber': busnumber,
+        'source': source,
+        'destination': destination,
+        'departure': "ISBT",
+        'arrival': "Sindhi Camp",
+        'departuretime': time(8, 0),
+        'arrivaltime': time(13, 0),
+        'price': "500.00",
+        'duration': time(5, 0),
+        'available_seats': 40,
+        'type': "AC",
+    }
+    data.update(kwargs)
+    return Buses.objects.create(**data)
+
+def createUser(username="traveller"):
+    """creates a user that the API tests can authenticate as"""
+    return user.objects.create_user(username=username, password="pass@123", DOB=date(2000, 1, 1))
+
+def createBooking(usr, bus, seats=2):
+    """saves a booking with its passengers directly, without going through the booking flow"""
+    booking = Bookings.objects.create(
+        user=usr, bus=bus, travel_date=date(2030, 10, 10), no_of_seats=seats, contact=9999999999,
+        email="traveller@example.com", pincode=110001, city="Delhi", state="Delhi", address="Connaught Place",
+    )
+    SeatsDetail.objects.bulk_create(
+        SeatsDetail(booking=booking, first_name=f"Passenger{seat}", age=30, seat=seat) for seat in range(1, seats + 1)
+    )
+    return booking
+
+def bookingData(usr, bus, seats=1, firstSeat=1, travelDate="10-10-2030"):
+    """builds the body of a booking request for the given user and bus, the passengers get consecutive seats starting from firstSeat"""
+    return {
+        'user': usr.id,
+        'bus': bus.bus_id,
+        'date': travelDate,
+        'no_of_seats': seats,
+        'contact': 9876543210,
+        'email': "traveller@example.com",
+        'pincode': 110001,
+        'city': "Delhi",
+        'state': "Delhi",
+        'address': "Connaught Place",
+        'passengers': [
+            {'first_name': f"Passenger{number}", 'age': 30, 'seat': firstSeat + number} for number in range(seats)
+        ],
+    }
+
+
+class BusSearchIndexTest(TestCase):
+    """checks with EXPLAIN that the route searches done by BusesData are served by the composite route indexes instead of a table scan"""
+
+    @classmethod
+    def setUpTestData(cls):
+        for number in range(20):
+            createBus(number, source=f"City{number % 4}", departuretime=time(number, 0), price=f"{100 + number}.00")
+
+    def routeData(self):
+        return Buses.objects.filter(source="City1", destination="Jaipur")
+
+    def chosenIndexes(self, queryset):
+        """returns the indexes the planner chose for the query, the candidates it only considered are left out"""
+        if connection.vendor == 'mysql':
+            # the traditional output lists every candidate route index in possible_keys, the key of each table of the json plan is the one used
+            def keys(node):
+                if isinstance(node, dict):
+                    if 'table_name' in node and 'key' in node:
+                        yield node['key']
+                    for value in node.values():
+                        yield from keys(value)
+                elif isinstance(node, list):
+                    for value in node:
+                        yield from keys(value)
+            return list(keys(loads(queryset.explain(format='json'))))
+        if connection.vendor == 'sqlite':
+            return findall(r"USING (?:COVERING )?INDEX (\w+)", queryset.explain())
+        self.skipTest(f"reading the chosen index isn't supported on {connection.vendor}")
+
+    def assertUsesIndex(self, queryset, index):
+        self.assertIn(index, self.chosenIndexes(queryset))
+
+    def test_departure_time_filter(self):
+        busdata = timeBasedData("06:00-12:00", None, self.routeData())
+        self.assertUsesIndex(busdata, 'bus_route_depttime_idx')
+
+    def test_arrival_time_filter(self):
+        busdata = timeBasedData(None, "10:00-18:00", self.routeData())
+        self.assertUsesIndex(busdata, 'bus_route_arrtime_idx')
+
+    def test_price_filter(self):
+        busdata = priceBasedData("100", "110", self.routeData())
+        self.assertUsesIndex(busdata, 'bus_route_price_idx')
+
+    def test_duration_filter(self):
+        busdata = durationBasedData("2", "6", self.routeData())
+        self.assertUsesIndex(busdata, 'bus_route_duration_idx')
+
+    def test_price_sorting(self):
+        busdata = self.routeData().order_by('price')
+        self.assertUsesIndex(busdata, 'bus_route_price_idx')
+
+
+class SearchCacheTest(APITestCase):
+    """checks that repeated searches are answered from the cache and that a booking invalidates the searches of its route"""
+
+    def setUp(self):
+        searchCache().clear()
+        self.usr = createUser()
+        self.client.force_authenticate(self.usr)
+        self.bus = createBus(1)
+        createBus(2, destination="Agra")
+
+    def search(self, **params):
+        params = {'source': "Delhi", 'destination': "Jaipur", 'date': "10-10-2030", **params}
+        return self.client.get("/buses/", params)
+
+    def test_repeated_search_is_cached(self):
+        first = self.search()
+        with CaptureQueriesContext(connection) as queries:
+            second = self.search()
+
+        self.assertEqual(first['X-Cache'], "MISS")
+        self.assertEqual(second['X-Cache'], "HIT")
+        self.assertEqual(first.data, second.data)
+        self.assertEqual(len(queries), 0)
+        self.assertEqual(searchCacheStats(), {'hits': 1, 'misses': 1})
+
+    def test_search_is_read_only(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.search()
+
+        self.assertFalse([query for query in queries if "django_session" in query['sql'] or not query['sql'].startswith("SELECT")])
+        self.assertNotIn(settings.SESSION_COOKIE_NAME, response.cookies)
+        self.assertIn("private", response['Cache-Control'])
+        self.assertIn(f"max-age={settings.BUS_SEARCH_MAX_AGE}", response['Cache-Control'])
+
+    def test_key_is_normalized(self):
+        self.search(sorting="price", page="1")
+        response = self.search(sorting=" price ", minprice="")
+        self.assertEqual(response['X-Cache'], "HIT")
+
+    def test_booking_invalidates_route(self):
+        self.search(destination="Agra")
+        self.search()
+
+        with self.captureOnCommitCallbacks(execute=True):
+            booking = self.client.post(f"/buses/{self.bus.bus_id}/", bookingData(self.usr, self.bus), format="json")
+        self.assertEqual(booking.status_code, 200)
+
+        response = self.search()
+        self.assertEqual(response['X-Cache'], "MISS")
+        self.assertEqual(response.data['results'][0]['available_seats'], 39)
+
+        other = self.search(destination="Agra")
+        self.assertEqual(other['X-Cache'], "HIT")
+
+
+class KeysetPaginationTest(APITestCase):
+    """checks that walking the search results page by page with the cursors gives every bus exactly once and in the requested order"""
+
+    def setUp(self):
+        searchCache().clear()
+        self.client.force_authenticate(createUser())
+        for number in range(25):
+            createBus(number, price=f"{100 + number % 4}.00", departuretime=time(number % 6, 0))
+
+    def walk(self, url):
+        rows = []
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            self.assertNotIn('count', response.data)
+            rows.extend(row['bus_id'] for row in response.data['results'])
+            url = response.data['next']
+        return rows, response
+
+    def test_pages_follow_sorting(self):
+        rows, last = self.walk("/buses/?source=Delhi&destination=Jaipur&sorting=price,-departuretime")
+        expected = list(Buses.objects.order_by('price', '-departuretime', 'bus_id').values_list('bus_id', flat=True))
+        self.assertEqual(rows, expected)
+
+        previous = self.client.get(last.data['previous'])
+        self.assertEqual([row['bus_id'] for row in previous.data['results']], expected[10:20])
+
+    def test_empty_page_mode_search_with_cursor(self):
+        params = {'source': "Delhi", 'destination': "Goa", 'pagination': "page", 'cursor': "stale"}
+        self.assertEqual(self.client.get("/buses/", params).status_code, 204)
+        with override_settings(ROOT_URLCONF=asyncUrls):
+            response = async_to_sync(self.async_client.get)("/buses/", params, headers={'Authorization': f"Bearer {AccessToken.for_user(user.objects.get())}"})
+        self.assertEqual(response.status_code, 204)
+
+    def test_pages_with_filters(self):
+        rows, last = self.walk("/buses/?source=Delhi&destination=Jaipur&sorting=-price&depttimerange=01:00-04:00&maxprice=102")
+        expected = list(
+            Buses.objects.filter(departuretime__gte=time(1, 0), departuretime__lte=time(4, 0), price__lte=102)
+            .order_by('-price', 'bus_id').values_list('bus_id', flat=True)
+        )
+        self.assertEqual(rows, expected)
+
+    def test_tampered_cursor(self):
+        response = self.client.get("/buses/?source=Delhi&destination=Jaipur&cursor=abc")
+        self.assertEqual(response.status_code, 404)
+
+    def test_page_number_mode(self):
+        response = self.client.get("/buses/?source=Delhi&destination=Jaipur&pagination=page&page=3")
+        self.assertEqual(response.data['count'], 25)
+        self.assertEqual(len(response.data['results']), 5)
+
+
+class RouteCatalogTest(APITestCase):
+    """checks that the source/destination catalog is served from its cached copy with an ETag and rebuilt only when the timetable changes"""
+
+    def setUp(self):
+        cache.clear()
+        self.usr = createUser()
+        self.client.force_authenticate(self.usr)
+        self.bus = createBus(1)
+        createBus(2, destination="Agra")
+        createBus(3, source="Jaipur", destination="Delhi")
+
+    def test_catalog_lists_routes(self):
+        response = self.client.get("/buses/source_dest_options/")
+        self.assertEqual(response.data['data'], {
+            'source': ["Delhi", "Jaipur"],
+            'destination': ["Agra", "Delhi", "Jaipur"],
+            'routes': {'Delhi': ["Agra", "Jaipur"], 'Jaipur': ["Delhi"]},
+        })
+
+    def test_matching_etag_is_not_modified(self):
+        etag = self.client.get("/buses/source_dest_options/")['ETag']
+        with self.assertNumQueries(0):
+            response = self.client.get("/buses/source_dest_options/", HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response['ETag'], etag)
+
+    def test_rebuilt_after_timetable_change(self):
+        etag = self.client.get("/buses/source_dest_options/")['ETag']
+        with self.captureOnCommitCallbacks(execute=True):
+            createBus(4, destination="Chandigarh")
+
+        response = self.client.get("/buses/source_dest_options/", HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertIn("Chandigarh", response.data['data']['routes']['Delhi'])
+
+    def test_change_from_another_process(self):
+        etag = self.client.get("/buses/source_dest_options/")['ETag']
+        # another process adds a bus and bumps the version in the database, the commit callbacks of this process never run
+        createBus(4, destination="Chandigarh")
+        TimetableVersion.objects.update(version=F('version') + 1)
+        with self.assertNumQueries(0):
+            self.assertEqual(self.client.get("/buses/source_dest_options/", HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+        # once the copy of the version kept by this process expires it is read again from the database
+        cache.delete("timetable:version")
+        self.assertEqual(timetableVersion(), TimetableVersion.objects.get().version)
+        response = self.client.get("/buses/source_dest_options/", HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertIn("Chandigarh", response.data['data']['routes']['Delhi'])
+
+    def test_booking_keeps_catalog(self):
+        etag = self.client.get("/buses/source_dest_options/")['ETag']
+        with self.captureOnCommitCallbacks(execute=True):
+            booking = self.client.post(f"/buses/{self.bus.bus_id}/", bookingData(self.usr, self.bus), format="json")
+        self.assertEqual(booking.status_code, 200)
+
+        with self.assertNumQueries(0):
+            response = self.client.get("/buses/source_dest_options/", HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+
+class SearchFacetsTest(APITestCase):
+    """checks the facets of a search and that they are computed with a single aggregate query"""
+
+    def setUp(self):
+        searchCache().clear()
+        self.client.force_authenticate(createUser())
+        createBus(1, price="150.00", duration=time(4, 30), departuretime=time(6, 0))
+        createBus(2, price="320.50", duration=time(6, 0), departuretime=time(6, 45))
+        createBus(3, price="399.00", duration=time(7, 15), departuretime=time(22, 0))
+        createBus(4, destination="Agra", price="900.00")
+
+    def test_single_query(self):
+        with self.assertNumQueries(1):
+            facets = searchFacets(Buses.objects.filter(source="Delhi", destination="Jaipur"))
+
+        self.assertEqual(facets['count'], 3)
+        self.assertEqual(facets['price']['min'], "150.00")
+        self.assertEqual(facets['price']['max'], "399.00")
+        self.assertEqual(facets['price']['buckets'], [
+            {'from': 100, 'to': 200, 'count': 1},
+            {'from': 200, 'to': 300, 'count': 0},
+            {'from': 300, 'to': 400, 'count': 2},
+        ])
+        self.assertEqual(facets['duration']['min'], "04:30:00")
+        self.assertEqual([bucket['hour'] for bucket in facets['duration']['buckets']], [4, 5, 6, 7])
+        self.assertEqual(facets['departureHour']['buckets'][6], {'hour': 6, 'count': 2})
+        self.assertEqual(facets['departureHour']['buckets'][22], {'hour': 22, 'count': 1})
+
+    def test_facets_follow_filters(self):
+        response = self.client.get("/buses/facets/", {'source': "Delhi", 'destination': "Jaipur", 'minprice': "300"})
+        self.assertEqual(response.data['data']['count'], 2)
+        self.assertEqual(response.data['data']['price']['min'], "320.50")
+
+    def test_search_with_facets(self):
+        response = self.client.get("/buses/", {'source': "Delhi", 'destination': "Jaipur", 'facets': "true"})
+        self.assertEqual(len(response.data['results']), 3)
+        self.assertEqual(response.data['facets']['count'], 3)
+
+    def test_empty_search(self):
+        facets = searchFacets(Buses.objects.filter(source="Agra"))
+        self.assertEqual(facets['count'], 0)
+        self.assertEqual(facets['price']['buckets'], [])
+
+
+class BusRowSerializerTest(TestCase):
+    """checks that the values() based serializer renders exactly the same bytes as BusSerializer"""
+
+    @classmethod
+    def setUpTestData(cls):
+        createBus(1, price="99.90", departuretime=time(23, 30), duration=time(9, 45))
+        createBus(2, price="500", departuretime=time(6, 5, 30), duration=time(0, 50))
+
+    def assertSameOutput(self, context):
+        buses = Buses.objects.order_by('bus_id')
+        renderer = JSONRenderer()
+        expected = renderer.render(BusSerializer(buses, many=True, context=context).data)
+        actual = renderer.render(BusRowSerializer(buses.values(), many=True, context=context).data)
+        self.assertEqual(actual, expected)
+
+    def test_without_dates(self):
+        self.assertSameOutput({'isdate':False})
+
+    def test_with_dates(self):
+        self.assertSameOutput({'isdate':True, 'date':"31-12-2030"})
+
+    def test_single_row(self):
+        context = {'isdate':True, 'date':"28-02-2031"}
+        bus = Buses.objects.get(busnumber=1)
+        row = Buses.objects.filter(busnumber=1).values().get()
+        self.assertEqual(BusRowSerializer(row, context=context).data, BusSerializer(bus, context=context).data)
+        self.assertEqual(BusRowSerializer(row, context=context).data['arrivalDate'], "01-03-2031")
+
+
+class TripInventoryTest(APITestCase):
+    """checks that seats are counted per travel date and can't be oversold"""
+
+    def setUp(self):
+        searchCache().clear()
+        self.usr = createUser()
+        self.client.force_authenticate(self.usr)
+        self.bus = createBus(1, available_seats=3)
+
+    def book(self, day, seats):
+        return self.client.post(f"/buses/{self.bus.bus_id}/", bookingData(self.usr, self.bus, seats, travelDate=day), format="json")
+
+    def test_dates_are_independent(self):
+        self.assertEqual(self.book("10-10-2030", 2).status_code, 200)
+        self.assertEqual(self.book("11-10-2030", 3).status_code, 200)
+
+        self.assertEqual(TripInventory.objects.get(travel_date=date(2030, 10, 10)).available_seats, 1)
+        self.assertEqual(TripInventory.objects.get(travel_date=date(2030, 10, 11)).available_seats, 0)
+        self.assertEqual(Buses.objects.get(pk=self.bus.pk).available_seats, 3)
+        self.assertEqual(Bookings.objects.get(no_of_seats=2).travel_date, date(2030, 10, 10))
+
+    def test_seats_shown_for_date(self):
+        self.book("10-10-2030", 2)
+        searchCache().clear()
+        search = self.client.get("/buses/", {'source': "Delhi", 'destination': "Jaipur", 'date': "10-10-2030"})
+        self.assertEqual(search.data['results'][0]['available_seats'], 1)
+        info = self.client.get(f"/buses/{self.bus.bus_id}/", {'date': "10-10-2030"})
+        self.assertEqual(info.data['data']['available_seats'], 1)
+
+        searchCache().clear()
+        other = self.client.get("/buses/", {'source': "Delhi", 'destination': "Jaipur", 'date': "12-10-2030"})
+        self.assertEqual(other.data['results'][0]['available_seats'], 3)
+
+    def test_cannot_oversell(self):
+        self.assertEqual(self.book("10-10-2030", 2).status_code, 200)
+        self.assertEqual(self.book("10-10-2030", 2).status_code, 400)
+        self.assertEqual(Bookings.objects.count(), 1)
+
+    def test_conditional_decrement(self):
+        travelDate = date(2030, 10, 10)
+        reserveSeats(self.bus, travelDate, [1, 2])
+        # a concurrent booking validated against the old count still can't take a seat that is gone
+        with self.assertRaises(SeatsUnavailable):
+            reserveSeats(self.bus, travelDate, [2, 3])
+        reserveSeats(self.bus, travelDate, [3])
+        self.assertEqual(TripInventory.objects.get().available_seats, 0)
+
+    def test_missing_date(self):
+        response = self.client.post(f"/buses/{self.bus.bus_id}/", bookingData(self.usr, self.bus, travelDate=""), format="json")
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.data['message'], "Travel date is missing")
+
+    def test_inventory_takes_earlier_bookings(self):
+        # booked before the trip had an inventory
+        createBooking(self.usr, self.bus, 2)
+        self.assertEqual(self.book("10-10-2030", 1).status_code, 409)
+        inventory = TripInventory.objects.get()
+        self.assertEqual((occupiedSeats(bytes(inventory.seat_map)), inventory.available_seats), ([1, 2], 1))
+
+    def test_rebuild_inventory(self):
+        travelDate = date(2030, 10, 10)
+        createBooking(self.usr, self.bus, 1)
+        SeatHold.objects.create(token="held", user=self.usr, bus=self.bus, travel_date=travelDate, seats=[3], expires_at=now())
+        # an inventory created empty next to the booking, and a booked trip without one
+        TripInventory.objects.create(bus=self.bus, travel_date=travelDate, available_seats=3, seat_map=bytes(1))
+        later = createBooking(self.usr, self.bus, 2)
+        Bookings.objects.filter(pk=later.pk).update(travel_date=date(2030, 10, 11))
+
+        out = StringIO()
+        call_command('rebuild_inventory', stdout=out)
+        self.assertIn("1 trips fixed, 1 created", out.getvalue())
+        self.assertEqual(
+            [(row.travel_date, occupiedSeats(bytes(row.seat_map)), row.available_seats) for row in TripInventory.objects.order_by('travel_date')],
+            [(travelDate, [1, 3], 1), (date(2030, 10, 11), [1, 2], 1)],
+        )
+        self.assertEqual(self.book("10-10-2030", 1).status_code, 409)
+        call_command('rebuild_inventory', stdout=out)
+        self.assertIn("0 trips fixed, 0 created", out.getvalue())
+
+
+class BookingInsertTest(APITestCase):
+    """checks that the passengers of a booking are validated together and inserted with one query whatever the size of the group"""
+
+    def setUp(self):
+        searchCache().clear()
+        self.usr = createUser()
+        self.client.force_authenticate(self.usr)
+        self.bus = createBus(1)
+
+    def book(self, data):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post(f"/buses/{self.bus.bus_id}/", data, format="json")
+        return response, queries
+
+    def test_queries_do_not_grow_with_passengers(self):
+        # the first booking of the trip also creates its inventory row
+        self.book(bookingData(self.usr, self.bus, 1, firstSeat=1))
+        single, singleQueries = self.book(bookingData(self.usr, self.bus, 1, firstSeat=2))
+        group, groupQueries = self.book(bookingData(self.usr, self.bus, 6, firstSeat=3))
+
+        self.assertEqual(single.status_code, 200)
+        self.assertEqual(group.status_code, 200)
+        self.assertEqual(len(groupQueries), len(singleQueries))
+        inserts = [query for query in groupQueries if query['sql'].startswith(f"INSERT INTO {connection.ops.quote_name(SeatsDetail._meta.db_table)}")]
+        self.assertEqual(len(inserts), 1)
+        self.assertEqual(SeatsDetail.objects.filter(booking__no_of_seats=6).count(), 6)
+
+    def test_booking_is_made_for_the_authenticated_user(self):
+        response, _ = self.book(bookingData(createUser("other"), self.bus))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(Bookings.objects.get().user, self.usr)
+
+    def test_underage_passenger_rejects_whole_booking(self):
+        data = bookingData(self.usr, self.bus, 3)
+        data['passengers'][2]['age'] = 4
+        response, queries = self.book(data)
+
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(Bookings.objects.exists())
+        self.assertFalse(SeatsDetail.objects.exists())
+        self.assertFalse(TripInventory.objects.exists())
+
+
+class SeatMapTest(APITestCase):
+    """checks the seat bitmap of a trip, the seat conflicts it catches and the seat map endpoint"""
+
+    def setUp(self):
+        searchCache().clear()
+        self.usr = createUser()
+        self.client.force_authenticate(self.usr)
+        self.bus = createBus(1, available_seats=12)
+
+    def book(self, seats, firstSeat):
+        return self.client.post(f"/buses/{self.bus.bus_id}/", bookingData(self.usr, self.bus, seats, firstSeat), format="json")
+
+    def test_bitmap_helpers(self):
+        seatMap = markSeats(bytes(2), [1, 8, 9, 12])
+        self.assertEqual(seatMap, bytes([0b10000001, 0b00001001]))
+        self.assertTrue(seatTaken(seatMap, 9))
+        self.assertFalse(seatTaken(seatMap, 10))
+        self.assertFalse(seatTaken(seatMap, 40))
+        self.assertEqual(occupiedSeats(seatMap), [1, 8, 9, 12])
+        self.assertEqual(occupiedSeats(markSeats(seatMap, [8, 12], taken=False)), [1, 9])
+        self.assertEqual(markSeats(b"", [17]), bytes([0, 0, 1]))
+
+    def test_same_seat_cannot_be_booked_twice(self):
+        self.assertEqual(self.book(2, firstSeat=4).status_code, 200)
+        response = self.book(2, firstSeat=5)
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(response.data['message'], "Seats 5 are already booked")
+        self.assertEqual(Bookings.objects.count(), 1)
+        self.assertEqual(TripInventory.objects.get().available_seats, 10)
+
+    def test_seat_outside_bus(self):
+        self.assertEqual(self.book(1, firstSeat=13).status_code, 409)
+
+    def test_duplicate_seat_in_booking(self):
+        data = bookingData(self.usr, self.bus, 2)
+        data['passengers'][1]['seat'] = 1
+        self.assertEqual(self.client.post(f"/buses/{self.bus.bus_id}/", data, format="json").status_code, 400)
+
+    def test_seatmap_endpoint(self):
+        self.book(2, firstSeat=4)
+        self.book(1, firstSeat=12)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(f"/buses/{self.bus.bus_id}/seatmap/", {'date': "10-10-2030"})
+
+        self.assertEqual(response.data['data'], {'capacity': 12, 'available': 9, 'occupied': [4, 5, 12]})
+        self.assertFalse([query for query in queries if "Buses_seatsdetail" in query['sql']])
+
+        empty = self.client.get(f"/buses/{self.bus.bus_id}/seatmap/", {'date': "11-10-2030"})
+        self.assertEqual(empty.data['data'], {'capacity': 12, 'available': 12, 'occupied': []})
+
+
+class SeatHoldTest(APITestCase):
+    """checks that held seats are taken from the trip, consumed by the booking and given back by the sweeper once expired"""
+
+    def setUp(self):
+        searchCache().clear()
+        self.usr = createUser()
+        self.client.force_authenticate(self.usr)
+        self.bus = createBus(1, available_seats=6)
+
+    def hold(self, **data):
+        return self.client.post(f"/buses/{self.bus.bus_id}/hold/", {'date': "10-10-2030", **data}, format="json")
+
+    def inventory(self):
+        return TripInventory.objects.get(bus=self.bus, travel_date=date(2030, 10, 10))
+
+    def test_hold_picks_free_seats(self):
+        self.assertEqual(self.hold(seats=[1, 3]).status_code, 201)
+        response = self.hold(no_of_seats=3)
+        self.assertEqual(response.data['data']['seats'], [2, 4, 5])
+        self.assertEqual(self.inventory().available_seats, 1)
+        self.assertEqual(self.hold(seats=[3]).status_code, 409)
+        self.assertEqual(self.hold().status_code, 400)
+
+    def test_seats_must_be_numbers(self):
+        for seats in ([True], [1, False], ["2"], [0]):
+            self.assertEqual(self.hold(seats=seats).status_code, 400)
+        self.assertFalse(SeatHold.objects.exists())
+
+    def test_booking_consumes_hold(self):
+        token = self.hold(seats=[2, 3]).data['data']['token']
+        data = bookingData(self.usr, self.bus, 2, firstSeat=2)
+        data['hold'] = token
+        response = self.client.post(f"/buses/{self.bus.bus_id}/", data, format="json")
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(Bookings.objects.get().travel_date, date(2030, 10, 10))
+        self.assertEqual(self.inventory().available_seats, 4)
+        self.assertFalse(SeatHold.objects.exists())
+
+        again = self.client.post(f"/buses/{self.bus.bus_id}/", data, format="json")
+        self.assertEqual(again.status_code, 409)
+
+    def test_hold_books_for_its_owner(self):
+        token = self.hold(seats=[2]).data['data']['token']
+        data = bookingData(createUser("other"), self.bus, 1, firstSeat=2)
+        data['hold'] = token
+        self.assertEqual(self.client.post(f"/buses/{self.bus.bus_id}/", data, format="json").status_code, 200)
+        self.assertEqual(Bookings.objects.get().user, self.usr)
+
+    def test_booking_must_use_held_seats(self):
+        token = self.hold(seats=[2, 3]).data['data']['token']
+        data = bookingData(self.usr, self.bus, 2, firstSeat=4)
+        data['hold'] = token
+        self.assertEqual(self.client.post(f"/buses/{self.bus.bus_id}/", data, format="json").status_code, 400)
+        self.assertTrue(SeatHold.objects.exists())
+
+    def test_sweeper_releases_expired_holds(self):
+        self.hold(seats=[1, 2])
+        self.hold(seats=[5])
+        live = self.hold(seats=[6])
+        SeatHold.objects.exclude(token=live.data['data']['token']).update(expires_at=now() - timedelta(seconds=1))
+
+        with self.assertNumQueries(6):
+            self.assertEqual(sweepExpiredHolds(), 2)
+
+        inventory = self.inventory()
+        self.assertEqual(inventory.available_seats, 5)
+        self.assertEqual(occupiedSeats(bytes(inventory.seat_map)), [6])
+        self.assertEqual(SeatHold.objects.count(), 1)
+
+    def test_expired_hold_cannot_book(self):
+        token = self.hold(seats=[1]).data['data']['token']
+        SeatHold.objects.update(expires_at=now() - timedelta(seconds=1))
+        data = bookingData(self.usr, self.bus, 1)
+        data['hold'] = token
+        self.assertEqual(self.client.post(f"/buses/{self.bus.bus_id}/", data, format="json").status_code, 409)
+
+
+class IdempotencyKeyTest(APITestCase):
+    """checks that a booking retried with the same Idempotency-Key is replayed instead of booked again"""
+
+    def setUp(self):
+        searchCache().clear()
+        self.usr = createUser()
+        self.client.force_authenticate(self.usr)
+        self.bus = createBus(1)
+
+    def book(self, key, seats=2):
+        return self.client.post(
+            f"/buses/{self.bus.bus_id}/", bookingData(self.usr, self.bus, seats), format="json", HTTP_IDEMPOTENCY_KEY=key
+        )
+
+    def test_retry_is_replayed(self):
+        first = self.book("retry-1")
+        second = self.book("retry-1")
+
+        self.assertEqual(first.status_code, 200)
+        self.assertEqual(second.status_code, 200)
+        self.assertEqual(second.data, first.data)
+        self.assertEqual(second['Idempotent-Replayed'], "true")
+        self.assertEqual(Bookings.objects.count(), 1)
+        self.assertEqual(TripInventory.objects.get().available_seats, 38)
+
+    def test_key_with_other_body(self):
+        self.book("retry-1", seats=2)
+        self.assertEqual(self.book("retry-1", seats=1).status_code, 422)
+        self.assertEqual(Bookings.objects.count(), 1)
+
+    def test_other_keys_book_again(self):
+        self.book("retry-1")
+        data = bookingData(self.usr, self.bus, 2, firstSeat=3)
+        response = self.client.post(f"/buses/{self.bus.bus_id}/", data, format="json", HTTP_IDEMPOTENCY_KEY="retry-2")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(Bookings.objects.count(), 2)
+
+    def test_expired_keys_are_swept(self):
+        self.book("retry-1")
+        IdempotencyKey.objects.update(expires_at=now() - timedelta(seconds=1))
+        self.assertEqual(sweepExpiredKeys(), 1)
+        self.assertFalse(IdempotencyKey.objects.exists())
+
+class BookingHistoryTest(APITestCase):
+    """the booking history returns the bookings of the user with their bus and passengers in a constant number of queries"""
+
+    def setUp(self):
+        self.usr = createUser()
+        self.client.force_authenticate(self.usr)
+        self.buses = [createBus(1), createBus(2, destination="Agra")]
+
+    def test_history_newest_first_in_two_queries(self):
+        bookings = [createBooking(self.usr, self.buses[index % 2]) for index in range(12)]
+        createBooking(createUser("other"), self.buses[0])
+
+        with self.assertNumQueries(2):
+            response = self.client.get("/buses/bookings/")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([row['id'] for row in response.data['results']], [booking.id for booking in reversed(bookings)][:10])
+        self.assertEqual(response.data['results'][0]['bus']['busnumber'], 2)
+        self.assertEqual([passenger['seat'] for passenger in response.data['results'][0]['passengers']], [1, 2])
+
+        second = self.client.get(response.data['next'])
+        self.assertEqual([row['id'] for row in second.data['results']], [bookings[1].id, bookings[0].id])
+        self.assertIsNone(second.data['next'])
+
+    def test_booking_detail(self):
+        booking = createBooking(self.usr, self.buses[0], seats=3)
+        with self.assertNumQueries(2):
+            response = self.client.get(f"/buses/bookings/{booking.id}/")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.data['data']['passengers']), 3)
+
+        otherBooking = createBooking(createUser("other"), self.buses[0])
+        self.assertEqual(self.client.get(f"/buses/bookings/{otherBooking.id}/").status_code, 404)
+
+    def test_book_info_uses_latest_booking(self):
+        createBooking(self.usr, self.buses[0])
+        latest = createBooking(self.usr, self.buses[1], seats=1)
+
+        response = self.client.get("/buses/booking_details/")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['data'][0]['no_of_seats'], latest.no_of_seats)
+        self.assertEqual(response.data['data'][1]['busnumber'], 2)
+        self.assertEqual(response.data['data'][1]['departureDate'], "10-10-2030")
+        self.assertEqual(response.data['data'][2], [["Passenger1", "", "", 30, 1]])
+
+# the buses app served by its async views, as it is with ASYNC_VIEWS
+asyncUrls = ModuleType("async_bus_urls")
+asyncUrls.urlpatterns = [path("buses/", include(busUrlPatterns(asyncViews=True)))]
+
+@override_settings(ROOT_URLCONF=asyncUrls)
+class AsyncViewsTest(TestCase):
+    """the async views go through the ASGI handler and must answer like the synchronous ones"""
+
+    def setUp(self):
+        searchCache().clear()
+        userCache().clear()
+        self.usr = createUser()
+        self.headers = {'Authorization': f"Bearer {AccessToken.for_user(self.usr)}"}
+        self.buses = [createBus(number, price=f"{400 + number}.00") for number in range(1, 13)]
+        createBus(20, destination="Agra")
+
+    async def search(self, **params):
+        params = {'source': "Delhi", 'destination': "Jaipur", 'date': "10-10-2030", **params}
+        return await self.async_client.get("/buses/", params, headers=self.headers)
+
+    async def test_search_pages(self):
+        first = await self.search(sorting="-price")
+        self.assertEqual(first.status_code, 200)
+        body = first.json()
+        self.assertEqual([row['busnumber'] for row in body['results']], list(range(12, 2, -1)))
+
+        second = await self.async_client.get(body['next'], headers=self.headers)
+        self.assertEqual([row['busnumber'] for row in second.json()['results']], [2, 1])
+
+    async def test_search_matches_sync_view(self):
+        response = await self.search(facets="true", pagination="page")
+        searchCache().clear()
+        with override_settings(ROOT_URLCONF="Book_and_go_backend.urls"):
+            expected = await sync_to_async(self.client.get)(
+                "/buses/", {'source': "Delhi", 'destination': "Jaipur", 'date': "10-10-2030", 'facets': "true", 'pagination': "page"}, headers=self.headers
+            )
+        self.assertEqual(response.json(), expected.json())
+
+    async def test_search_needs_authentication(self):
+        response = await self.async_client.get("/buses/", {'source': "Delhi", 'destination': "Jaipur"})
+        self.assertEqual(response.status_code, 401)
+
+    async def test_bus_info_and_options(self):
+        response = await self.async_client.get(f"/buses/{self.buses[0].bus_id}/", {'date': "10-10-2030"}, headers=self.headers)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['data']['departureDate'], "10-10-2030")
+
+        missing = await self.async_client.get("/buses/999/", headers=self.headers)
+        self.assertEqual(missing.status_code, 404)
+
+        options = await self.async_client.get("/buses/source_dest_options/", headers=self.headers)
+        self.assertEqual(options.json()['data']['routes'], {'Delhi': ["Agra", "Jaipur"]})
+
+    async def test_booking_and_details(self):
+        bus = self.buses[0]
+        response = await self.async_client.post(
+            f"/buses/{bus.bus_id}/", bookingData(self.usr, bus, 2), content_type="application/json", headers=self.headers
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(await Bookings.objects.acount(), 1)
+
+        details = await self.async_client.get("/buses/booking_details/", headers=self.headers)
+        self.assertEqual(details.status_code, 200)
+        self.assertEqual(len(details.json()['data'][2]), 2)
+
+
+class LoadTestTest(TestCase):
+    """the load test seeds the same consistent dataset for the same seed and every scenario runs against it without errors"""
+
+    def setUp(self):
+        searchCache().clear()
+        userCache().clear()
+
+    def seeded(self):
+        return list(Buses.objects.filter(busnumber__gte=FIRST_BUSNUMBER).order_by('busnumber').values_list('source', 'destination', 'departuretime', 'price'))
+
+    def test_seed_is_reproducible(self):
+        counts = seedTimetable(3, 2, 20, users=3, seed=7)
+        first = self.seeded()
+        self.assertEqual(counts['buses'], 6)
+        self.assertEqual(SeatsDetail.objects.count(), counts['passengers'])
+
+        # the inventory holds exactly the seats of the seeded passengers
+        for inventory in TripInventory.objects.all():
+            seats = SeatsDetail.objects.filter(booking__bus=inventory.bus, booking__travel_date=inventory.travel_date).values_list('seat', flat=True)
+            self.assertEqual(occupiedSeats(inventory.seat_map), sorted(seats))
+            self.assertEqual(inventory.available_seats, inventory.bus.available_seats - len(seats))
+
+        clearSeeded()
+        self.assertEqual(self.seeded(), [])
+        seedTimetable(3, 2, 20, users=3, seed=7)
+        self.assertEqual(self.seeded(), first)
+
+    def test_scenarios(self):
+        seedTimetable(2, 3, 10, users=2)
+        with loadSettings(asyncViews=False):
+            for scenario in SCENARIOS:
+                requests = scenarioRequests(scenario, 5)
+                self.assertEqual(len(requests), 5)
+                for request in requests:
+                    self.assertLess(request.send(self.client).status_code, 300, (scenario, request.path))
+
+        # the next run books seats nobody has yet
+        booked = set(SeatsDetail.objects.filter(booking__travel_date=date(2030, 1, 8)).values_list('booking__bus', 'seat'))
+        self.assertEqual(len(booked), 5)
+        following = {(request.data['bus'], request.data['passengers'][0]['seat']) for request in scenarioRequests('booking', 5)}
+        self.assertFalse(booked & following)
+
+
+class TimetableImportTest(TestCase):
+    """the timetable import upserts the buses on their bus number a chunk at a time, reports the invalid rows and tells the caches about the changes"""
+
+    HEADER = "operator,busnumber,source,destination,departure,arrival,departuretime,arrivaltime,price,duration,available_seats,type\n"
+
+    def setUp(self):
+        self.bus = createBus(1)
+        self.reported = []
+
+    def importer(self, **kwargs):
+        return TimetableImport(chunkSize=2, report=lambda *change: self.reported.append(change[:3]), **kwargs)
+
+    def csv(self, *rows):
+        return csvRows(StringIO(self.HEADER + "".join(row + "\n" for row in rows)))
+
+    def test_upsert(self):
+        rows = self.csv(
+            "Zing,1,Delhi,Jaipur,ISBT,Sindhi Camp,08:00,13:00,550.00,05:00,40,AC",
+            "Zing,2,Delhi,Agra,ISBT,Idgah,09:00,13:00,350.00,04:00,40,NONAC",
+            "Zing,3,Delhi,Agra,ISBT,Idgah,later,13:00,350.00,04:00,40,AC",
+        )
+        with self.captureOnCommitCallbacks(execute=True):
+            counts = self.importer().run(rows)
+        self.assertEqual(counts, {'rows': 3, 'created': 1, 'updated': 1, 'unchanged': 0, 'invalid': 1})
+        self.assertEqual(self.reported, [('updated', 2, 1), ('created', 3, 2), ('invalid', 4, '3')])
+
+        # the existing bus keeps its key
+        self.assertEqual(Buses.objects.get(busnumber=1).bus_id, self.bus.bus_id)
+        self.assertEqual(Buses.objects.get(busnumber=1).price, Decimal("550.00"))
+        self.assertEqual(Buses.objects.get(busnumber=2).destination, "Agra")
+
+    def test_changes_reach_the_caches(self):
+        version = timetableVersion()
+        rows = ndjsonRows(StringIO('{"operator": "Zing", "busnumber": 1, "source": "Delhi", "destination": "Agra", "departure": "ISBT", "arrival": "Idgah", '
+                                   '"departuretime": "08:00", "arrivaltime": "12:00", "price": "500.00", "duration": "04:00", "available_seats": 40, "type": "AC"}\n'))
+        with self.captureOnCommitCallbacks(execute=True) as callbacks:
+            self.importer().run(rows)
+        self.assertNotEqual(timetableVersion(), version)
+        # both the route the bus left and the one it joined are invalidated, along with the timetable
+        self.assertEqual(len(callbacks), 3)
+
+    def test_moved_buses_move_their_totals(self):
+        createBooking(createUser(), self.bus, 2)
+        rows = self.csv(
+            "Zing,1,Delhi,Agra,ISBT,Idgah,08:00,12:00,500.00,04:00,30,AC",
+            "Zing,2,Delhi,Agra,ISBT,Idgah,09:00,13:00,350.00,04:00,40,NONAC",
+        )
+        with self.captureOnCommitCallbacks(execute=True):
+            self.importer().run(rows)
+        imported = list(TripRollup.objects.values_list('bus_id', 'source', 'destination', 'travel_date', 'capacity', 'bookings', 'seats_sold', 'revenue'))
+        self.assertEqual(imported[0][1:5], ("Delhi", "Agra", date(2030, 10, 10), 30))
+        call_command('rebuild_rollups', stdout=StringIO())
+        self.assertEqual(list(TripRollup.objects.values_list('bus_id', 'source', 'destination', 'travel_date', 'capacity', 'bookings', 'seats_sold', 'revenue')), imported)
+
+    def test_dry_run_writes_nothing(self):
+        rows = self.csv(
+            "Zing,1,Delhi,Jaipur,ISBT,Sindhi Camp,08:00,13:00,500.00,06:00,40,AC",
+            "Zing,2,Delhi,Agra,ISBT,Idgah,09:00,13:00,350.00,04:00,40,NONAC",
+        )
+        with self.captureOnCommitCallbacks() as callbacks:
+            counts = self.importer(dryRun=True).run(rows)
+        self.assertEqual(counts['created'], 1)
+        self.assertEqual(self.reported[0], ('updated', 2, 1))
+        self.assertEqual(Buses.objects.count(), 1)
+        self.assertEqual(Buses.objects.get().duration, time(5, 0))
+        self.assertEqual(callbacks, [])
+
+    def test_unchanged_and_malformed_rows(self):
+        rows = ndjsonRows(StringIO("[1, 2]\n\n{oops\n"))
+        counts = self.importer().run(rows)
+        self.assertEqual(counts['invalid'], 2)
+        self.assertEqual([line for _, line, _ in self.reported], [1, 3])
+
+        rows = self.csv("Zing,1,Delhi,Jaipur,ISBT,Sindhi Camp,08:00:00,13:00,500,05:00,40,AC")
+        self.assertEqual(self.importer().run(rows)['unchanged'], 1)
+
+
+@override_settings(REQUEST_TIMING=True, SLOW_REQUEST_MS=60000, SLOW_REQUEST_QUERIES=1000)
+class RequestTimingTest(APITestCase):
+    """with REQUEST_TIMING on every response tells how many queries it ran and where its time went, and the slow requests are logged with their SQL"""
+
+    def setUp(self):
+        userCache().clear()
+        self.usr = createUser()
+        self.bus = createBus(1)
+        self.headers = {'Authorization': f"Bearer {AccessToken.for_user(self.usr)}"}
+        self.client.credentials(HTTP_AUTHORIZATION=self.headers['Authorization'])
+
+    def metrics(self, response):
+        return {metric.split(";")[0]: metric for metric in response['Server-Timing'].split(", ")}
+
+    def test_server_timing(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get("/buses/bookings/")
+        metrics = self.metrics(response)
+        self.assertEqual(set(metrics), {'db', 'serializer', 'view'})
+        self.assertIn(f'desc="{len(queries)} queries"', metrics['db'])
+
+    def test_slow_request_log(self):
+        with override_settings(SLOW_REQUEST_QUERIES=1):
+            with self.assertLogs('utility.middleware', 'WARNING') as logs:
+                self.client.get(f"/buses/{self.bus.bus_id}/", {'date': "10-10-2030"})
+        self.assertIn(f"Slow request GET /buses/{self.bus.bus_id}/?date=10-10-2030 (200)", logs.output[0])
+        self.assertIn(f"FROM {connection.ops.quote_name(Buses._meta.db_table)}", logs.output[0])
+
+    def test_async_views(self):
+        with override_settings(ROOT_URLCONF=asyncUrls):
+            response = async_to_sync(self.async_client.get)(f"/buses/{self.bus.bus_id}/", {'date': "10-10-2030"}, headers=self.headers)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn('desc="0 queries"', self.metrics(response)['db'])
+
+    def test_disabled(self):
+        with override_settings(REQUEST_TIMING=False):
+            response = APIClient().get("/buses/bookings/", headers=self.headers)
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(response.has_header('Server-Timing'))
+
+
+class ConnectionSearchTest(APITestCase):
+    """the connection search finds itineraries with changes of bus in the in memory route graph, which follows the changes of the timetable"""
+
+    def setUp(self):
+        userCache().clear()
+        connectionIndex.cache_clear()
+        # the version row read by an earlier test was rolled back along with it
+        cache.delete("timetable:version")
+        self.usr = createUser()
+        self.client.credentials(HTTP_AUTHORIZATION=f"Bearer {AccessToken.for_user(self.usr)}")
+        # Delhi -> Jaipur -> Udaipur, Delhi -> Agra -> Gwalior -> Udaipur and a direct but slow night bus
+        self.first = createBus(1, "Delhi", "Jaipur", departuretime=time(8, 0), duration=time(5, 0), price="400.00")
+        self.second = createBus(2, "Jaipur", "Udaipur", departuretime=time(13, 20), duration=time(6, 0), price="450.00")
+        createBus(3, "Jaipur", "Udaipur", departuretime=time(14, 0), duration=time(7, 0), price="300.00")
+        createBus(4, "Delhi", "Agra", departuretime=time(6, 0), duration=time(3, 0), price="150.00")
+        createBus(5, "Agra", "Gwalior", departuretime=time(10, 0), duration=time(2, 0), price="100.00")
+        createBus(6, "Gwalior", "Udaipur", departuretime=time(17, 0), duration=time(14, 0), price="200.00")
+        createBus(7, "Delhi", "Udaipur", departuretime=time(22, 0), duration=time(12, 0), price="900.00")
+
+    def search(self, **params):
+        return connectionIndex().search("Delhi", "Udaipur", **params)
+
+    def busnumbers(self, itineraries):
+        return [[edge.busnumber for _, edge in legs] for legs in itineraries]
+
+    def test_ranking(self):
+        # the 13:20 bus leaves too soon after the arrival at 13:00 for a 30 minute layover
+        self.assertEqual(self.busnumbers(self.search()), [[7], [1, 3], [4, 5, 6]])
+        self.assertEqual(self.busnumbers(self.search(minLayover=15)), [[1, 2], [7], [1, 3], [4, 5, 6]])
+        self.assertEqual(self.busnumbers(self.search(sorting='price')), [[4, 5, 6], [1, 3], [7]])
+        self.assertEqual(self.busnumbers(self.search(transfers=1, sorting='price', limit=1)), [[1, 3]])
+        self.assertEqual(self.busnumbers(self.search(transfers=0)), [[7]])
+        # the wait at Gwalior is longer than the longest layover
+        self.assertEqual(self.busnumbers(self.search(maxLayover=240)), [[7], [1, 3]])
+
+    def test_legs_cross_midnight(self):
+        response = self.client.get("/buses/connections/", {'source': "Delhi", 'destination': "Udaipur", 'date': "10-10-2030", 'sorting': "price", 'limit': 1})
+        self.assertEqual(response.status_code, 200)
+        itinerary = response.data['data'][0]
+        self.assertEqual([leg['departure'] for leg in itinerary['legs']], ["10-10-2030 06:00", "10-10-2030 10:00", "10-10-2030 17:00"])
+        self.assertEqual(itinerary['arrival'], "11-10-2030 07:00")
+        self.assertEqual(itinerary['duration'], 25 * 60)
+        self.assertEqual(itinerary['price'], "450.00")
+        self.assertEqual(itinerary['transfers'], 2)
+
+    def test_bad_requests(self):
+        self.assertEqual(self.client.get("/buses/connections/", {'source': "Delhi", 'destination': "Udaipur"}).status_code, 400)
+        self.assertEqual(self.client.get("/buses/connections/", {'source': "Delhi", 'destination': "Udaipur", 'date': "10-10-2030", 'transfers': 3}).status_code, 400)
+        self.assertEqual(self.client.get("/buses/connections/", {'source': "Delhi", 'destination': "Goa", 'date': "10-10-2030"}).status_code, 204)
+
+    def test_bus_change_updates_index(self):
+        self.search()
+        with patch.object(ConnectionIndex, 'build') as build:
+            with self.captureOnCommitCallbacks(execute=True):
+                self.second.departuretime = time(13, 40)
+                self.second.save()
+            with self.captureOnCommitCallbacks(execute=True):
+                self.first.delete()
+            self.assertEqual(self.busnumbers(self.search()), [[7], [4, 5, 6]])
+        build.assert_not_called()
+
+    def test_change_after_another_process_rebuilds(self):
+        self.search()
+        # another process changes a bus, then this process changes another one
+        Buses.objects.filter(busnumber=7).update(price="100.00")
+        TimetableVersion.objects.update(version=F('version') + 1)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.second.departuretime = time(13, 40)
+            self.second.save()
+        self.assertEqual(self.busnumbers(self.search(sorting='price', limit=1)), [[7]])
+
+    def test_change_from_another_process_rebuilds(self):
+        self.search()
+        Buses.objects.filter(busnumber=7).update(price="100.00")
+        # another process bumps the timetable version and the copy this process keeps expires
+        TimetableVersion.objects.update(version=0)
+        cache.delete("timetable:version")
+        self.assertEqual(self.busnumbers(self.search(sorting='price', limit=1)), [[7]])
+
+
+class PlacesTest(APITestCase):
+    """the places autocomplete matches prefixes of the names or of their words without case or accents and ranks the places by their bookings"""
+
+    def setUp(self):
+        userCache().clear()
+        placesIndex.cache_clear()
+        self.usr = createUser()
+        self.client.credentials(HTTP_AUTHORIZATION=f"Bearer {AccessToken.for_user(self.usr)}")
+        createBus(1, "Delhi", "Dehradun")
+        createBus(2, "Delhi", "Mumbai Central")
+        createBus(3, "Dharamshala", "Delhi")
+        popular = createBus(4, "São Paulo", "Dehradun")
+        createBooking(self.usr, popular)
+        createBooking(self.usr, popular)
+
+    def names(self, prefix, **kwargs):
+        return [place['name'] for place in placesIndex().lookup(prefix, **kwargs)]
+
+    def test_matching(self):
+        self.assertEqual(placeKey("  São PAULO "), "sao paulo")
+        self.assertEqual(self.names("sao"), ["São Paulo"])
+        self.assertEqual(self.names("cen"), ["Mumbai Central"])
+        # Dehradun has the bookings, Delhi the most buses
+        self.assertEqual(self.names("D"), ["Dehradun", "Delhi", "Dharamshala"])
+        self.assertEqual(self.names("d", role='source'), ["Delhi", "Dharamshala"])
+        self.assertEqual(self.names("", limit=2), ["Dehradun", "São Paulo"])
+        self.assertEqual(self.names("goa"), [])
+
+    def test_bus_change_rebuilds(self):
+        self.names("go")
+        with self.captureOnCommitCallbacks(execute=True):
+            createBus(5, "Delhi", "Goa")
+        self.assertEqual(self.names("go"), ["Goa"])
+
+    def test_endpoint(self):
+        response = self.client.get("/buses/places/", {'q': "mum"})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['data'], [{'name': "Mumbai Central", 'source': False, 'destination': True}])
+        self.assertIn("max-age", response['Cache-Control'])
+        self.assertEqual(self.client.get("/buses/places/", {'q': "d", 'role': "via"}).status_code, 400)
+
+
+REPLICA = 'replica1'
+
+@override_settings(DATABASE_REPLICAS=[REPLICA])
+class ReplicaRoutingTest(APITransactionTestCase):
+    """the read only views read from a replica, the writes, the reads inside a transaction, the reads of data which just changed and the reads of a user who just wrote stay on the primary.
+    The replica is a second SQLite database holding a copy of the primary taken in setUp, after which the primary changes so that the rows read tell where they came from.
+    It runs outside of a test transaction, which would keep every read on the primary. The runner checks the databases of the tests before any of them starts,
+    so the replica only becomes one of them once it exists
+    """
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.replicaDir = TemporaryDirectory()
+        connections.settings[REPLICA] = connections.configure_settings({
+            DEFAULT_DB_ALIAS: {}, REPLICA: {'ENGINE': 'django.db.backends.sqlite3', 'NAME': f"{cls.replicaDir.name}/replica.sqlite3"},
+        })[REPLICA]
+        # lets the tests connect to it
+        cls.databases = {DEFAULT_DB_ALIAS, REPLICA}
+        with connections[REPLICA].schema_editor() as editor:
+            # a model creates the tables of its many to many fields itself
+            for model in cls.replicatedModels():
+                if not model._meta.auto_created:
+                    editor.create_model(model)
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        connections[REPLICA].close()
+        del connections[REPLICA]
+        del connections.settings[REPLICA]
+        cls.replicaDir.cleanup()
+
+    @staticmethod
+    def replicatedModels():
+        return [model for model in apps.get_models(include_auto_created=True) if model._meta.managed and not model._meta.proxy]
+
+    def setUp(self):
+        userCache().clear()
+        searchCache().clear()
+        self.usr = createUser()
+        self.bus = createBus(1)
+        self.client.credentials(HTTP_AUTHORIZATION=f"Bearer {AccessToken.for_user(self.usr)}")
+        # the route last changed long before the requests
+        searchCache().set("route:Delhi:Jaipur", 1, None)
+        self.replicate()
+        # the primary moves on and the replica lags behind
+        Buses.objects.filter(pk=self.bus.pk).update(operator="Orbit")
+
+    def replicate(self):
+        """copies every row of the primary into the replica, the flush after each test leaves the replica alone since nothing migrates to it"""
+        replica = connections[REPLICA]
+        replica.ops.execute_sql_flush(replica.ops.sql_flush(no_style(), [model._meta.db_table for model in self.replicatedModels()]))
+        with replica.constraint_checks_disabled():
+            for model in self.replicatedModels():
+                model._base_manager.using(REPLICA).bulk_create(model._base_manager.using(DEFAULT_DB_ALIAS).all())
+
+    def operator(self, client=None):
+        response = (client or self.client).get(f"/buses/{self.bus.bus_id}/", {'date': "10-10-2030"})
+        self.assertEqual(response.status_code, 200)
+        return response.data['data']['operator']
+
+    def search(self, travelDate="10-10-2030"):
+        response = self.client.get("/buses/", {'source': "Delhi", 'destination': "Jaipur", 'date': travelDate})
+        return [row['operator'] for row in response.data['results']]
+
+    def test_reads_from_replica(self):
+        self.assertEqual(self.operator(), "Zing")
+        self.assertEqual(self.search(), ["Zing"])
+
+    def test_recent_change_reads_primary(self):
+        invalidateRoute("Delhi", "Jaipur")
+        self.assertEqual(self.search(), ["Orbit"])
+        with override_settings(REPLICA_STICKY_SECONDS=0):
+            self.assertEqual(self.search("11-10-2030"), ["Zing"])
+
+    def test_write_pins_user_to_primary(self):
+        response = self.client.post(f"/buses/{self.bus.bus_id}/", bookingData(self.usr, self.bus), format="json")
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(STICKY_COOKIE, response.cookies)
+        # the reads of the user go to the primary for a while
+        self.assertEqual(self.operator(), "Orbit")
+        # everyone else, whichever worker serves them, still reads from the replica
+        other = APIClient(headers={'Authorization': f"Bearer {AccessToken.for_user(createUser('other'))}"})
+        self.assertEqual(self.operator(other), "Zing")
+        # once the window is over
+        with override_settings(REPLICA_STICKY_SECONDS=0):
+            self.assertEqual(self.operator(), "Zing")
+            # the bookings of a user never come from a replica, where the new booking isn't yet
+            self.assertEqual(len(self.client.get("/buses/bookings/").data['results']), 1)
+
+    def test_router(self):
+        router = ReplicaRouter()
+        self.assertEqual(router.db_for_read(Buses), DEFAULT_DB_ALIAS)
+        state = RoutingState()
+        state.replica = REPLICA
+        token = currentRouting.set(state)
+        try:
+            self.assertEqual(router.db_for_read(Buses), REPLICA)
+            with transaction.atomic():
+                self.assertEqual(router.db_for_read(Buses), DEFAULT_DB_ALIAS)
+            self.assertEqual(router.db_for_write(Buses), DEFAULT_DB_ALIAS)
+            self.assertEqual(router.db_for_read(Buses), DEFAULT_DB_ALIAS)
+        finally:
+            currentRouting.reset(token)
+        self.assertFalse(router.allow_migrate(REPLICA, 'Buses'))
+
+    def test_without_replicas(self):
+        with override_settings(DATABASE_REPLICAS=[]):
+            self.assertEqual(self.operator(APIClient(headers={'Authorization': f"Bearer {AccessToken.for_user(self.usr)}"})), "Orbit")
+
+
+class BookingExportTest(APITestCase):
+    """the bookings and passenger manifest exports stream every matching row a chunk at a time, for the staff only"""
+
+    def setUp(self):
+        userCache().clear()
+        self.staff = createUser("staff")
+        self.staff.is_staff = True
+        self.staff.save()
+        self.headers = {'Authorization': f"Bearer {AccessToken.for_user(self.staff)}"}
+        self.client.credentials(HTTP_AUTHORIZATION=self.headers['Authorization'])
+        self.usr = createUser()
+        self.bus = createBus(1)
+        other = createBus(2, operator="Orbit")
+        self.bookings = [createBooking(self.usr, self.bus, seats) for seats in (2, 3, 1)]
+        createBooking(self.usr, other)
+        later = createBooking(self.usr, self.bus)
+        later.travel_date = date(2030, 10, 12)
+        later.save()
+
+    def content(self, response):
+        return b"".join(response.streaming_content).decode()
+
+    def test_manifest_csv(self):
+        response = self.client.get("/buses/exports/manifest.csv", {'bus': self.bus.bus_id, 'from': "10-10-2030", 'to': "10-10-2030"})
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.streaming)
+        self.assertEqual(response['Content-Disposition'], 'attachment; filename="manifest.csv"')
+        rows = list(reader(StringIO(self.content(response))))
+        self.assertEqual(rows[0][:3], ['travel_date', 'bus_id', 'busnumber'])
+        self.assertEqual([(row[0], row[7], row[8]) for row in rows[1:4]], [("2030-10-10", "1", "Passenger1"), ("2030-10-10", "2", "Passenger2"), ("2030-10-10", "1", "Passenger1")])
+        self.assertEqual(len(rows), 7)
+
+    def test_chunks_and_filters(self):
+        with override_settings(EXPORT_CHUNK_SIZE=2):
+            with CaptureQueriesContext(connection) as queries:
+                content = self.content(self.client.get("/buses/exports/bookings.ndjson", {'operator': "Zing"}))
+        rows = [loads(line) for line in content.splitlines()]
+        self.assertEqual([row['booking'] for row in rows], [booking.id for booking in self.bookings] + [rows[-1]['booking']])
+        self.assertEqual(rows[0]['seats'], 2)
+        self.assertEqual(rows[0]['price'], "500.00")
+        self.assertEqual(rows[-1]['travel_date'], "2030-10-12")
+        # two full chunks and an empty one, the bus and the user are joined and not queried per row
+        self.assertEqual(len([query for query in queries if 'Buses_bookings' in query['sql']]), 3)
+
+    def test_access_and_bad_requests(self):
+        self.assertEqual(self.client.get("/buses/exports/bookings.csv", {'from': "2030-10-10"}).status_code, 400)
+        self.assertEqual(self.client.get("/buses/exports/bookings.xml").status_code, 404)
+        self.assertEqual(self.client.get("/buses/exports/passengers.csv").status_code, 404)
+        traveller = APIClient(headers={'Authorization': f"Bearer {AccessToken.for_user(self.usr)}"})
+        self.assertEqual(traveller.get("/buses/exports/bookings.csv").status_code, 403)
+
+    def test_async_view(self):
+        async def export():
+            response = await self.async_client.get("/buses/exports/bookings.csv", {'bus': self.bus.bus_id}, headers=self.headers)
+            return response, b"".join([chunk async for chunk in response])
+
+        with override_settings(ROOT_URLCONF=asyncUrls, EXPORT_CHUNK_SIZE=2):
+            response, content = async_to_sync(export)()
+        self.assertTrue(response.is_async)
+        self.assertEqual(len(content.decode().splitlines()), 5)
+
+    def test_command(self):
+        out = StringIO()
+        call_command('export_bookings', 'manifest', '--format', 'ndjson', '--operator', "Orbit", '--chunk-size', '1', stdout=out)
+        self.assertEqual([row['seat'] for row in map(loads, out.getvalue().splitlines())], [1, 2])
+        with self.assertRaises(CommandError):
+            call_command('export_bookings', 'bookings', '--to', "12/10/2030", stdout=StringIO())
+
+
+class RollupTest(APITestCase):
+    """the totals of every trip are kept up to date by the bookings, can be rebuilt from them and answer the route analytics"""
+
+    def setUp(self):
+        userCache().clear()
+        searchCache().clear()
+        self.staff = createUser("staff")
+        self.staff.is_staff = True
+        self.staff.save()
+        self.client.credentials(HTTP_AUTHORIZATION=f"Bearer {AccessToken.for_user(self.staff)}")
+        self.usr = createUser()
+        self.bus = createBus(1)
+        self.other = createBus(2, price="300.00", available_seats=20)
+
+    def totals(self):
+        return list(TripRollup.objects.order_by('bus_id', 'travel_date').values_list('bus_id', 'source', 'travel_date', 'capacity', 'bookings', 'seats_sold', 'revenue'))
+
+    def test_bookings_update_totals(self):
+        response = self.client.post(f"/buses/{self.bus.bus_id}/", bookingData(self.usr, self.bus, 2), format="json")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(Bookings.objects.get().fare, Decimal("500.00"))
+        createBooking(self.usr, self.bus, 3)
+        createBooking(self.usr, self.other, 1)
+        self.assertEqual(self.totals(), [
+            (self.bus.bus_id, "Delhi", date(2030, 10, 10), 40, 2, 5, Decimal("2500.00")),
+            (self.other.bus_id, "Delhi", date(2030, 10, 10), 20, 1, 1, Decimal("300.00")),
+        ])
+        # the seats sold keep the fare they were sold at, the trips follow their bus to its new route
+        Buses.objects.filter(pk=self.bus.pk).update(price="100.00")
+        self.bus.refresh_from_db()
+        self.bus.source = "Agra"
+        self.bus.save()
+        self.assertEqual(self.totals()[0], (self.bus.bus_id, "Agra", date(2030, 10, 10), 40, 2, 5, Decimal("2500.00")))
+
+    def test_rebuild(self):
+        createBooking(self.usr, self.bus, 2)
+        createBooking(self.usr, self.other, 4)
+        expected = self.totals()
+        # bulk inserts send no signals and the bookings made before the fares were kept have none
+        Bookings.objects.bulk_create([Bookings(
+            user=self.usr, bus=self.bus, travel_date=date(2030, 10, 11), no_of_seats=1, contact=9999999999,
+            email="traveller@example.com", pincode=110001, city="Delhi", state="Delhi", address="Connaught Place",
+        )])
+        TripRollup.objects.filter(bus=self.other).update(seats_sold=0)
+
+        out = StringIO()
+        call_command('rebuild_rollups', '--chunk-size', '1', stdout=out)
+        self.assertIn("Rebuilt the totals of 3 trips", out.getvalue())
+        self.assertEqual(self.totals(), [expected[0], (self.bus.bus_id, "Delhi", date(2030, 10, 11), 40, 1, 1, Decimal("500.00")), expected[1]])
+
+    def test_analytics(self):
+        createBooking(self.usr, self.bus, 2)
+        createBooking(self.usr, self.other, 4)
+        createBus(3, "Delhi", "Agra")
+        response = self.client.get("/buses/analytics/", {'source': "Delhi", 'destination': "Jaipur", 'from': "01-10-2030", 'to': "31-10-2030"})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['data']['days'], [
+            {'date': "10-10-2030", 'bookings': 2, 'seats_sold': 6, 'capacity': 60, 'occupancy': 0.1, 'revenue': "2200.00"},
+        ])
+        self.assertEqual(response.data['data']['total']['revenue'], "2200.00")
+
+        empty = self.client.get("/buses/analytics/", {'source': "Delhi", 'destination': "Agra", 'from': "01-10-2030", 'to': "31-10-2030"})
+        self.assertEqual(empty.data['data'], {'days': [], 'total': {'bookings': 0, 'seats_sold': 0, 'capacity': 0, 'occupancy': 0, 'revenue': "0.00"}})
+
+    def test_analytics_bad_requests(self):
+        params = {'source': "Delhi", 'destination': "Jaipur", 'from': "01-10-2030", 'to': "31-10-2030"}
+        self.assertEqual(self.client.get("/buses/analytics/", {**params, 'to': ""}).status_code, 400)
+        self.assertEqual(self.client.get("/buses/analytics/", {**params, 'to': "30-09-2030"}).status_code, 400)
+        self.assertEqual(self.client.get("/buses/analytics/", {**params, 'to': "31-10-2031"}).status_code, 400)
+        traveller = APIClient(headers={'Authorization': f"Bearer {AccessToken.for_user(self.usr)}"})
+        self.assertEqual(traveller.get("/buses/analytics/", params).status_code, 403)
+
+    def test_booking_price(self):
+        booking = createBooking(self.usr, self.bus, 2)
+        self.assertEqual(BookingSerializer(booking).data['price'], 1180.0)
+        booking.fare = Decimal("100.00")
+        self.assertEqual(BookingSerializer(booking).data['price'], 236.0)
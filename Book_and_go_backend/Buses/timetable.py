@@ -0,0 +1,105 @@
+from hashlib import sha1
+from json import dumps
+from time import time_ns
+
+from Buses.models import Buses, TimetableVersion
+
+from utility.routers import primaryAfterChange
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS, transaction
+
+# primary key of the single TimetableVersion row
+TIMETABLE_VERSION_ROW = 1
+
+def timetableVersion():
+    """returns the current version of the timetable, it changes whenever a bus is added, edited or removed.
+    The version is kept in the database so that a change made by any process (another worker, the admin, the import command) reaches every process,
+    each of which reads it again once its cached copy is older than TIMETABLE_VERSION_TTL seconds
+
+    Returns:
+        int: version of the timetable
+    """
+    version = cache.get("timetable:version")
+    if version is None:
+        # read on the primary, a lagging replica would hand back the version from before the last change
+        row, _ = TimetableVersion.objects.using(DEFAULT_DB_ALIAS).get_or_create(pk=TIMETABLE_VERSION_ROW, defaults={'version': time_ns()})
+        version = row.version
+        cache.set("timetable:version", version, settings.TIMETABLE_VERSION_TTL)
+    return version
+
+async def aTimetableVersion():
+    """same as timetableVersion but reads the version with the async ORM"""
+    version = cache.get("timetable:version")
+    if version is None:
+        row, _ = await TimetableVersion.objects.using(DEFAULT_DB_ALIAS).aget_or_create(pk=TIMETABLE_VERSION_ROW, defaults={'version': time_ns()})
+        version = row.version
+        cache.set("timetable:version", version, settings.TIMETABLE_VERSION_TTL)
+    return version
+
+def bumpTimetableVersion():
+    """marks everything built from the timetable as outdated, in every process. The row is locked while it is bumped so that the version it replaces is the one
+    just before this change, a copy of the timetable built from that version misses no change made by another process and can be patched instead of rebuilt
+
+    Returns:
+        tuple: the version before the change (None if there was none) and the new version
+    """
+    version = time_ns()
+    with transaction.atomic(using=DEFAULT_DB_ALIAS):
+        row, created = TimetableVersion.objects.using(DEFAULT_DB_ALIAS).select_for_update().get_or_create(pk=TIMETABLE_VERSION_ROW, defaults={'version': version})
+        previous = None if created else row.version
+        if not created:
+            row.version = version
+            row.save(update_fields=['version'])
+    cache.set("timetable:version", version, settings.TIMETABLE_VERSION_TTL)
+    return previous, version
+
+def catalogFromPairs(pairs):
+    """builds the catalog of routes out of the distinct (source, destination) pairs ordered by source and destination
+
+    Args:
+        pairs (list): distinct (source, destination) pairs
+
+    Returns:
+        dict: list of sources, list of destinations and for every source the destinations reachable from it
+    """
+    routes = {}
+    for source, destination in pairs:
+        routes.setdefault(source, []).append(destination)
+
+    destinations = sorted({destination for reachable in routes.values() for destination in reachable})
+    return {'source': list(routes), 'destination': destinations, 'routes': routes}
+
+def routePairs():
+    """returns the query giving every distinct (source, destination) pair with a single DISTINCT scan"""
+    return Buses.objects.order_by('source', 'destination').values_list('source', 'destination').distinct()
+
+def versionedCatalog(version, data):
+    """wraps the catalog with the timetable version it was built from and its strong ETag, and keeps it in the cache until the version changes"""
+    etag = '"%s"' % sha1(dumps(data, sort_keys=True).encode()).hexdigest()
+    catalog = {'version': version, 'etag': etag, 'data': data}
+    cache.set("timetable:catalog", catalog, None)
+    return catalog
+
+def routeCatalog():
+    """returns the route catalog for the current timetable version, it is only rebuilt after the timetable changes
+
+    Returns:
+        dict: version of the timetable, strong ETag of the catalog and the catalog itself
+    """
+    version = timetableVersion()
+    catalog = cache.get("timetable:catalog")
+    if catalog is None or catalog['version'] != version:
+        primaryAfterChange(version)
+        catalog = versionedCatalog(version, catalogFromPairs(routePairs()))
+    return catalog
+
+async def aRouteCatalog():
+    """same as routeCatalog but reads the version and rebuilds the catalog with the async ORM"""
+    version = await aTimetableVersion()
+    catalog = cache.get("timetable:catalog")
+    if catalog is None or catalog['version'] != version:
+        primaryAfterChange(version)
+        catalog = versionedCatalog(version, catalogFromPairs([pair async for pair in routePairs()]))
+    return catalog
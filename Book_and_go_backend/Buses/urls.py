@@ -1,8 +1,24 @@
+from django.conf import settings
 from django.urls import path
-from Buses import views
-urlpatterns = [
-    path("", views.BusesData.as_view(), name = "all buses"),
-    path("source_dest_options/", views.SourceDestOptions.as_view(), name = "user options"),
-    path("<int:id>/", views.BusInfo.as_view(), name = "bus info"),
-    path("booking_details/", views.BookInfo.as_view(), name = "book info")
-]
+from Buses import views, async_views
+
+def busUrlPatterns(asyncViews = False):
+    """returns the url patterns of the buses app, with asyncViews the search and booking views are served by their async variants (meant for ASGI deployments)"""
+    readViews = async_views if asyncViews else views
+    return [
+        path("", readViews.BusesData.as_view(), name = "all buses"),
+        path("source_dest_options/", readViews.SourceDestOptions.as_view(), name = "user options"),
+        path("facets/", views.BusFacets.as_view(), name = "bus facets"),
+        path("connections/", views.ConnectionSearch.as_view(), name = "connection search"),
+        path("places/", views.Places.as_view(), name = "places"),
+        path("<int:id>/", readViews.BusInfo.as_view(), name = "bus info"),
+        path("<int:id>/seatmap/", views.SeatMap.as_view(), name = "seat map"),
+        path("<int:id>/hold/", views.SeatHoldView.as_view(), name = "seat hold"),
+        path("booking_details/", readViews.BookInfo.as_view(), name = "book info"),
+        path("bookings/", views.BookingHistory.as_view(), name = "booking history"),
+        path("bookings/<int:id>/", views.BookingDetail.as_view(), name = "booking detail"),
+        path("analytics/", views.RouteAnalytics.as_view(), name = "route analytics"),
+        path("exports/<slug:kind>.<slug:output>", readViews.BookingExport.as_view(), name = "booking export"),
+    ]
+
+urlpatterns = busUrlPatterns(settings.ASYNC_VIEWS)
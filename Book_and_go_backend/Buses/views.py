@@ -1,47 +1,101 @@
-from Buses.serializers import BusSerializer, BookingSerializer, SeatsSerializer
-from Buses.models import Buses, Bookings, SeatsDetail
+from Buses.serializers import BusSerializer, BusRowSerializer, BookingSerializer, SeatsSerializer, SeatHoldSerializer, BookingHistorySerializer
+from Buses.models import Buses, Bookings
+from Buses.cache import searchCache, searchCacheKey, countSearch, invalidateRoute
+from Buses.inventory import parseTravelDate, reserveSeats, seatsOnDate, seatMap, SeatsUnavailable
+from Buses.timetable import routeCatalog
+from Buses.facets import searchFacets
+from Buses.holds import holdSeats, activeHold, consumeHold
+from Buses.idempotency import idempotent
+from Buses.history import userBookings, HISTORY_ORDERING
+from Buses.connections import connectionIndex, itinerariesData
+from Buses.places import placesIndex
+from Buses.exports import EXPORTS, EXPORT_FORMATS, ExportLines, exportFilters, exportQuery, exportLines
+from Buses.rollups import routeTotals, MAX_PERIOD_DAYS
+from user_acc.authentication import CachedJWTAuthentication
 
 from datetime import datetime
 
-from utility.functions import timeBasedData, priceBasedData, durationBasedData
+from utility.functions import filteredData, searchOrdering
+from utility.pagination import KeysetPagination
+from utility.middleware import timed
+from utility.routers import ReplicaReadsMixin
 
 from rest_framework.response import Response
 from rest_framework.generics import ListAPIView, RetrieveAPIView
 from rest_framework.views import APIView
 from rest_framework import status
-from rest_framework_simplejwt.authentication import JWTAuthentication
-from rest_framework.permissions import IsAuthenticated
+from rest_framework.permissions import IsAuthenticated, IsAdminUser
 from rest_framework.pagination import PageNumberPagination
 from rest_framework import exceptions
 
 from django.forms.models import model_to_dict
+from django.http import StreamingHttpResponse
+from django.utils.cache import patch_cache_control
+from django.utils.http import parse_etags
 from django.db import transaction
+from django.conf import settings
 
-class SourceDestOptions(APIView):
+class SourceDestOptions(ReplicaReadsMixin, APIView):
     serializer_class = BusSerializer
-    authentication_classes = [JWTAuthentication]
+    authentication_classes = [CachedJWTAuthentication]
     permission_classes = [IsAuthenticated]
     
     def get(self, request):
-        """This function takes in the request object and returns the list of sources and destination as per the records in DATABASE, useful for providing the options for dropdown menu 
+        """This function takes in the request object and returns the list of sources and destination as per the records in DATABASE along with the destinations reachable from every source, useful for providing the options for dropdown menu.
+        The catalog is only rebuilt when the timetable changes and carries an ETag, so a client sending it back in If-None-Match gets a 304 without any body
 
         Args:
             request (): request object coming from the client's browser
 
         Returns:
-            response: list of sources and destination
+            response: list of sources and destination and the routes between them
         """
-        source = Buses.objects.distinct().values_list('source', flat=True)
-        destination = Buses.objects.distinct().values_list('destination', flat=True)
-        return Response({"status":"Success", 'data' : {'source':source, 'destination': destination}}, status=status.HTTP_200_OK)
+        catalog = routeCatalog()
+        if catalog['etag'] in parse_etags(request.headers.get('If-None-Match', '')):
+            response = Response(status=status.HTTP_304_NOT_MODIFIED)
+        else:
+            response = Response({"status":"Success", 'data' : catalog['data']}, status=status.HTTP_200_OK)
+        
+        response['ETag'] = catalog['etag']
+        patch_cache_control(response, private=True, no_cache=True)
+        return response
     
-class BusesData(APIView):
+class Places(ReplicaReadsMixin, APIView):
+    authentication_classes = [CachedJWTAuthentication]
+    permission_classes = [IsAuthenticated]
+    
+    def get(self, request):
+        """This function suggests the places matching what the user is typing, so the client doesn't have to load and filter the whole list of places.
+        A place matches when its name or a word of it starts with q, without regard to case or accents, and the most booked places come first (see Buses.places)
+
+        Args:
+            request (rest_framework.request object): q is the typed text, role ('source' or 'destination') keeps the places buses leave from or go to and limit (at most 50) the number of places
+
+        Returns:
+            response: matching places with whether buses leave from them (source) and go to them (destination)
+        """
+        role = request.query_params.get('role')
+        try:
+            limit = int(request.query_params.get('limit', 10))
+        except ValueError:
+            limit = 0
+        if role not in (None, 'source', 'destination') or not 1 <= limit <= 50:
+            return Response({'status':"Failure", "message":"role must be source or destination and limit between 1 and 50"}, status=status.HTTP_400_BAD_REQUEST)
+        
+        places = placesIndex().lookup(request.query_params.get('q', ''), role=role, limit=limit)
+        response = Response({'status':"Success", 'data':places}, status=status.HTTP_200_OK)
+        patch_cache_control(response, private=True, max_age=settings.BUS_SEARCH_MAX_AGE)
+        return response
+    
+class BusesData(ReplicaReadsMixin, APIView):
     serializer_class = BusSerializer
-    authentication_classes = [JWTAuthentication]
+    authentication_classes = [CachedJWTAuthentication]
     permission_classes = [IsAuthenticated]
     
     def get(self, request):
-        """This function takes in the request object and applies the sorting or filtering functionality as per the query parameters sent by the user and in the end returns the entries which will be sorted or filtered as per the conditions
+        """This function takes in the request object and applies the sorting or filtering functionality as per the query parameters sent by the user and in the end returns the entries which will be sorted or filtered as per the conditions.
+        With facets=true the price, duration and departure hour facets of the matching buses are added to the response.
+        Nothing is kept in the session, the travel date (date) goes along with every request that needs it, so the search is read only and can be cached by the client
 
         Args:
             request (_type_): request object coming from the browser
@@ -54,140 +108,425 @@ class BusesData(APIView):
             destination = request.query_params.get('destination')
             date = request.query_params.get('date')
         
-            request.session['date'] = date
-        
             if source and destination:
-                busdata = Buses.objects.filter(source = source, destination = destination)
-            
-                deptTimeRange = request.query_params.get('depttimerange')
-                arrivalTimeRange = request.query_params.get('arrivaltimerange')
-                sortVal = request.query_params.get('sorting')
-                userMinPrice = request.query_params.get('minprice')
-                userMaxPrice = request.query_params.get('maxprice')
-                userMinDuration = request.query_params.get('minduration')
-                userMaxDuration = request.query_params.get('maxduration')
-            
-                if sortVal:
-                    sortList = sortVal.split(",")
-                    busdata = busdata.order_by(*sortList)
-            
-                if deptTimeRange or arrivalTimeRange:
-                    busdata = timeBasedData(deptTimeRange, arrivalTimeRange, busdata)
-            
-                if userMinPrice or userMaxPrice:
-                    priceList = busdata.values_list('price',flat=True)
-                    minPrice = min(priceList)
-                    maxPrice = max(priceList)
+                cacheKey, response = self.cachedSearch(request)
+                if response is not None:
+                    return response
                 
-                    busdata = priceBasedData(minPrice, maxPrice, userMinPrice, userMaxPrice, busdata)
-            
-                if userMinDuration or userMaxDuration:
-                    busdata = durationBasedData(userMinDuration, userMaxDuration, busdata)
+                busdata = self.searchQuery(request)
+                ordering = searchOrdering(request.query_params.get('sorting'))
                 
-                if busdata:        
+                # the page number mode is kept for older clients, it has to count the rows and skip the previous pages on every request
+                if request.query_params.get('pagination') == 'page':
                     paginator = PageNumberPagination()
-                    pageqs = paginator.paginate_queryset(busdata, request)
-                    serializer = BusSerializer(pageqs, many = True, context = {'isdate':False})
-        
-                    return paginator.get_paginated_response(serializer.data)
+                    pageqs = paginator.paginate_queryset(busdata.order_by(*ordering).values(), request) if busdata.exists() else None
+                else:
+                    paginator = KeysetPagination()
+                    pageqs = paginator.paginate_queryset(busdata.values(), request, ordering)
+                
+                # the page number mode has no rows (None) for an empty search, a keyset cursor past the last row still gets its empty page and previous link
+                if pageqs or (pageqs is not None and request.query_params.get('cursor')):
+                    seatsLeft = seatsOnDate([row['bus_id'] for row in pageqs], parseTravelDate(date))
+                    facets = searchFacets(busdata) if request.query_params.get('facets') == 'true' else None
+                    response = self.searchResponse(paginator, pageqs, seatsLeft, facets)
                 else:
-                    return Response({'status':"Failure", "message":"No Buses in desired duration"}, status = status.HTTP_204_NO_CONTENT)
+                    response = Response({'status':"Failure", "message":"No Buses in desired duration"}, status = status.HTTP_204_NO_CONTENT)
+                
+                return self.cacheSearch(cacheKey, response)
         
             else:
                 return Response({'status':"Failure", "message":"source and destination can't be empty"}, status=status.HTTP_400_BAD_REQUEST)
             
+        except exceptions.APIException:
+            raise
         except Exception as e:
             return Response({'status':"Failure", 'error':str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+    
+    def cachedSearch(self, request):
+        """looks the search up in the search cache
+
+        Returns:
+            tuple: cache key of the search and the cached response, None if the search isn't cached
+        """
+        cacheKey = searchCacheKey(request)
+        cached = searchCache().get(cacheKey)
+        countSearch(cached is not None)
+        if cached is None:
+            return cacheKey, None
+        response = Response(cached['data'], status=cached['status'])
+        response['X-Cache'] = 'HIT'
+        patch_cache_control(response, private=True, max_age=settings.BUS_SEARCH_MAX_AGE)
+        return cacheKey, response
+    
+    def searchQuery(self, request):
+        """returns the (lazy) queryset of the buses on the searched route satisfying the filters"""
+        busdata = Buses.objects.filter(source = request.query_params.get('source'), destination = request.query_params.get('destination'))
+        return filteredData(request.query_params, busdata)
+    
+    def searchResponse(self, paginator, pageqs, seatsLeft, facets):
+        """builds the paginated response out of the rows of the page, the seats left on the travel date and the facets (None when they weren't asked for)"""
+        for row in pageqs:
+            row['available_seats'] = seatsLeft.get(row['bus_id'], row['available_seats'])
+        with timed('serializer'):
+            data = BusRowSerializer(pageqs, many = True, context = {'isdate':False}).data
+        
+        response = paginator.get_paginated_response(data)
+        if facets is not None:
+            response.data['facets'] = facets
+        return response
+    
+    def cacheSearch(self, cacheKey, response):
+        """keeps the response of the search in the search cache and returns it"""
+        searchCache().set(cacheKey, {'data':response.data, 'status':response.status_code})
+        response['X-Cache'] = 'MISS'
+        patch_cache_control(response, private=True, max_age=settings.BUS_SEARCH_MAX_AGE)
+        return response
         
-class BusInfo(APIView):
+class BusFacets(ReplicaReadsMixin, APIView):
+    authentication_classes = [CachedJWTAuthentication]
     permission_classes = [IsAuthenticated]
-    authentication_classes = [JWTAuthentication]
+    
+    def get(self, request):
+        """This function returns the price, duration and departure hour ranges and histograms of the buses matching the same query parameters as the search, so the UI can draw the filter sliders without fetching the buses
+
+        Args:
+            request (rest_framework.request object): request object coming from the browser
+
+        Returns:
+            response: facets of the buses satisfying the source, destination and the filters
+        """
+        source = request.query_params.get('source')
+        destination = request.query_params.get('destination')
+        
+        if not (source and destination):
+            return Response({'status':"Failure", "message":"source and destination can't be empty"}, status=status.HTTP_400_BAD_REQUEST)
+        
+        try:
+            cacheKey = searchCacheKey(request, scope='facets')
+            facets = searchCache().get(cacheKey)
+            countSearch(facets is not None)
+            if facets is None:
+                busdata = filteredData(request.query_params, Buses.objects.filter(source = source, destination = destination))
+                facets = searchFacets(busdata)
+                searchCache().set(cacheKey, facets)
+        except Exception as e:
+            return Response({'status':"Failure", 'error':str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+        
+        return Response({'status':"Success", 'data':facets}, status=status.HTTP_200_OK)
+
+class ConnectionSearch(ReplicaReadsMixin, APIView):
+    authentication_classes = [CachedJWTAuthentication]
+    permission_classes = [IsAuthenticated]
+    
+    def get(self, request):
+        """This function finds the itineraries from the source to the destination with up to two changes of bus for the city pairs that have no direct bus (direct buses are part of the results too),
+        the route graph is kept in memory (see Buses.connections) so no query walks the timetable, only the seats left on the legs are read
+
+        Args:
+            request (rest_framework.request object): source, destination and date (DD-MM-YYYY) of the journey, optionally transfers (0 to 2, default 2), min_layover in minutes,
+                sorting ('duration' or 'price') and limit (at most 50)
+
+        Returns:
+            response: itineraries ranked by total duration or total price, each with its legs
+        """
+        source = request.query_params.get('source')
+        destination = request.query_params.get('destination')
+        travelDate = parseTravelDate(request.query_params.get('date'))
+        
+        if not (source and destination and travelDate):
+            return Response({'status':"Failure", "message":"source, destination and date can't be empty"}, status=status.HTTP_400_BAD_REQUEST)
+        
+        try:
+            transfers = int(request.query_params.get('transfers', 2))
+            minLayover = int(request.query_params.get('min_layover', settings.CONNECTION_MIN_LAYOVER))
+            limit = int(request.query_params.get('limit', 20))
+        except ValueError:
+            return Response({'status':"Failure", "message":"transfers, min_layover and limit must be numbers"}, status=status.HTTP_400_BAD_REQUEST)
+        sorting = request.query_params.get('sorting', 'duration')
+        if not 0 <= transfers <= 2 or not 0 <= minLayover <= settings.CONNECTION_MAX_LAYOVER or not 1 <= limit <= 50 or sorting not in ('duration', 'price'):
+            return Response({'status':"Failure", "message":"Invalid transfers, min_layover, limit or sorting"}, status=status.HTTP_400_BAD_REQUEST)
+        
+        itineraries = connectionIndex().search(
+            source, destination, transfers=transfers, minLayover=minLayover, maxLayover=settings.CONNECTION_MAX_LAYOVER, sorting=sorting, limit=limit,
+        )
+        if not itineraries:
+            return Response({'status':"Failure", "message":"No connections in desired duration"}, status=status.HTTP_204_NO_CONTENT)
+        
+        with timed('serializer'):
+            data = itinerariesData(itineraries, travelDate)
+        return Response({'status':"Success", 'data':data}, status=status.HTTP_200_OK)
+        
+class BusInfo(ReplicaReadsMixin, APIView):
+    permission_classes = [IsAuthenticated]
+    authentication_classes = [CachedJWTAuthentication]
     
     def get(self, request, **kwargs):
         """This function takes request object and kwargs as the input and with the id parameter fetches the record of the desired Bus 
 
         Args:
-            request (rest_framework.request object):
+            request (rest_framework.request object): the travel date is read from the date query parameter, without it the departure and arrival dates are left out
 
         Returns:
             Response: Returns Bus Data for the specific bus id 
         """
         try: 
-            busData = Buses.objects.get(bus_id = kwargs['id'])
-            serializer = BusSerializer(busData, context = {'isdate':True, 'date':request.session.get('date')})
+            date = request.query_params.get('date')
+            travelDate = parseTravelDate(date)
+            busData = Buses.objects.filter(bus_id = kwargs['id']).values().get()
+            seatsLeft = seatsOnDate([busData['bus_id']], travelDate)
+            busData['available_seats'] = seatsLeft.get(busData['bus_id'], busData['available_seats'])
+            with timed('serializer'):
+                data = BusRowSerializer(busData, context = {'isdate':travelDate is not None, 'date':date}).data
             
         except Buses.DoesNotExist:
             return Response({'status':"Failure", 'message':"Bus no longer exists"}, status=status.HTTP_404_NOT_FOUND)
         
         else:
-            return Response({"status":"Success!", 'data':serializer.data}, status=status.HTTP_200_OK)
+            return Response({"status":"Success!", 'data':data}, status=status.HTTP_200_OK)
     
     def post(self, request, **kwargs):
-        """This function fetches the data sent by the user, validates that data and if the data is valid then it saves the entry in the DB, and available seats are reduced after the record is saved 
+        """This function fetches the data sent by the user, validates that data and if the data is valid then it saves the entry in the DB. 
+        The passengers' seats are taken from the inventory of the trip on the travel date with a conditional update before the booking is saved, so the booking fails instead of overselling the trip or giving the same seat twice.
+        When the request carries an Idempotency-Key header, a retry with the same key gets back the response of the first request instead of booking again
 
         Args:
-            request (rest_framework.request object): _description_
+            request (rest_framework.request object): booking details along with the date of travel (date), or the token of a seat hold (hold) which carries its own date
 
         Returns:
             rest_framework.response object: A JSON with the current status and corresponding message or error if any 
         """
+        return idempotent(request, self.book)
+    
+    def book(self, request):
+        """validates and saves the booking, see post"""
         try:    
+            hold = None
+            if request.data.get('hold'):
+                hold = activeHold(request.user, request.data.get('hold'))
+                if hold is None:
+                    return Response({'status':'Failure', 'message':'Seat hold has expired, please select the seats again'}, status=status.HTTP_409_CONFLICT)
+                travelDate = hold.travel_date
+            else:
+                travelDate = parseTravelDate(request.data.get('date'))
+            
+            if travelDate is None:
+                return Response({'status':'Failure', 'message':'Travel date is missing'}, status=status.HTTP_400_BAD_REQUEST)
+            
             with transaction.atomic():
                 data = request.data
-                serializer = BookingSerializer(data = data)
-                if serializer.is_valid():
-                    serializer.save()
-                    busId = data.get('bus')
-                    busInstance = Buses.objects.get(bus_id = busId)
-                    no_of_seats = data.get('no_of_seats')
+                serializer = BookingSerializer(data = data, context = {'travel_date':travelDate, 'hold':hold})
+                with timed('serializer'):
+                    valid = serializer.is_valid()
+                if valid:
+                    busInstance = serializer.validated_data['bus']
+                    seats = [passenger['seat'] for passenger in serializer.validated_data['passengers']]
+                    
+                    if hold is not None:
+                        if not consumeHold(hold):
+                            return Response({'status':'Failure', 'message':'Seat hold has expired, please select the seats again'}, status=status.HTTP_409_CONFLICT)
+                    else:
+                        try:
+                            reserveSeats(busInstance, travelDate, seats)
+                        except SeatsUnavailable as e:
+                            return Response({'status':'Failure', 'message':str(e)}, status=status.HTTP_409_CONFLICT)
                     
-                    busInstance.available_seats = busInstance.available_seats - no_of_seats
-                    busInstance.save()
+                    # whatever user the body names, the booking is made for the authenticated user
+                    serializer.save(travel_date = travelDate, user = request.user)
+                    transaction.on_commit(lambda: invalidateRoute(busInstance.source, busInstance.destination))
                     
                     return Response({'status':'Success', 'message':'Seat Booked Successfully'}, status = status.HTTP_200_OK)
                 else:
                     print(serializer.errors)
                     return Response({'status':'Failure', 'message':'Seat not booked please check the input credentials'}, status=status.HTTP_400_BAD_REQUEST)
+        except exceptions.APIException:
+            raise
         except Exception as e: 
             return Response({'status':'Failure', 'errors':str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
-class BookInfo(APIView):
+class SeatHoldView(APIView):
     permission_classes = [IsAuthenticated]
-    authentication_classes = [JWTAuthentication]
+    authentication_classes = [CachedJWTAuthentication]
     
-    def get(self, request):
-        """This function displays the booking details like billing details, passenger details, contact details using the user id of the authenticated user 
+    def post(self, request, **kwargs):
+        """This function holds seats on the bus for the travel date for a few minutes (SEAT_HOLD_TTL) so that they can't be lost while the user fills the booking form. 
+        The token returned has to be sent as hold along with the booking, expired holds are given back by the sweep_expired command
 
         Args:
-            request (rest_framework.request object)
+            request (rest_framework.request object): seats or no_of_seats to hold and the date of travel
 
         Returns:
-           rest_framework.response object: It sends json as a response containing the current status as well as the required data 
+            Response: token of the hold, the held seats and the time at which the hold expires
         """
-        try:   
-            user = request.user
-            user_id = user.id
+        travelDate = parseTravelDate(request.data.get('date'))
+        if travelDate is None:
+            return Response({'status':'Failure', 'message':'Travel date is missing'}, status=status.HTTP_400_BAD_REQUEST)
         
-            booking_entry = Bookings.objects.filter(user = user_id).last()
-            booking_dict = model_to_dict(booking_entry, fields=['no_of_seats', 'contact', 'email', 'pincode', 'city', 'state', 'address'])
+        try:
+            bus = Buses.objects.get(bus_id = kwargs['id'])
+        except Buses.DoesNotExist:
+            return Response({'status':"Failure", 'message':"Bus no longer exists"}, status=status.HTTP_404_NOT_FOUND)
         
-            busId = booking_entry.bus_id
+        serializer = SeatHoldSerializer(data = request.data)
+        if not serializer.is_valid():
+            return Response({'status':'Failure', 'errors':serializer.errors}, status=status.HTTP_400_BAD_REQUEST)
         
-            bus_entry = Buses.objects.get(bus_id = busId)
-            bus_dict = BusSerializer(bus_entry, context = {'isdate':True, 'date':request.session.get('date')}).data
+        try:
+            hold = holdSeats(request.user, bus, travelDate, seats = serializer.validated_data.get('seats'), count = serializer.validated_data.get('no_of_seats'))
+        except SeatsUnavailable as e:
+            return Response({'status':'Failure', 'message':str(e)}, status=status.HTTP_409_CONFLICT)
         
-            bookingId = booking_entry.id
-            passengerDetails = SeatsDetail.objects.filter(booking = bookingId).values_list('first_name', 'middle_name', 'last_name', 'age', 'seat')
+        return Response({'status':'Success', 'data':SeatHoldSerializer(hold).data}, status=status.HTTP_201_CREATED)
+
+class SeatMap(APIView):
+    permission_classes = [IsAuthenticated]
+    authentication_classes = [CachedJWTAuthentication]
+    
+    def get(self, request, **kwargs):
+        """This function returns which seats of the bus are taken on the travel date, it only reads the seat map of the trip and never goes through the passengers
+
+        Args:
+            request (rest_framework.request object): the travel date is read from the date query parameter
+
+        Returns:
+            Response: capacity of the bus, seats left and the list of taken seats
+        """
+        travelDate = parseTravelDate(request.query_params.get('date'))
+        if travelDate is None:
+            return Response({'status':"Failure", 'message':"Travel date is missing"}, status=status.HTTP_400_BAD_REQUEST)
         
-            passengerList = []
-            for entry in passengerDetails:
-                passengerList.append(list(entry))
+        try:
+            bus = Buses.objects.get(bus_id = kwargs['id'])
+        except Buses.DoesNotExist:
+            return Response({'status':"Failure", 'message':"Bus no longer exists"}, status=status.HTTP_404_NOT_FOUND)
+        
+        return Response({'status':"Success", 'data':seatMap(bus, travelDate)}, status=status.HTTP_200_OK)
+
+class BookInfo(APIView):
+    permission_classes = [IsAuthenticated]
+    authentication_classes = [CachedJWTAuthentication]
     
-            booking_data = [booking_dict, bus_dict, passengerList]
+    def get(self, request):
+        """This function displays the booking details like billing details, passenger details, contact details using the user id of the authenticated user 
+
+        Args:
+            request (rest_framework.request object)
+
+        Returns:
+           rest_framework.response object: It sends json as a response containing the current status as well as the required data 
+        """
+        try:   
+            booking_entry = userBookings(request.user).last()
+            booking_data = self.bookingData(booking_entry)
         
         except Exception as e:
             return Response({'status':"Failure", 'message':str(e)}, status=status.HTTP_404_NOT_FOUND)
         
         else:
             return Response({'status':"Success", 'data':booking_data}, status=status.HTTP_200_OK)
-        
\ No newline at end of file
+    
+    def bookingData(self, booking_entry):
+        """lays out a booking loaded by userBookings as billing details, bus details and the list of passengers, the dates of the bus are those of the booked trip"""
+        with timed('serializer'):
+            booking_dict = model_to_dict(booking_entry, fields=['no_of_seats', 'contact', 'email', 'pincode', 'city', 'state', 'address'])
+            # bookings made before the travel date was stored have no date to show
+            date = booking_entry.travel_date.strftime("%d-%m-%Y") if booking_entry.travel_date else None
+            bus_dict = BusSerializer(booking_entry.bus, context = {'isdate':date is not None, 'date':date}).data
+            passengerList = [
+                [passenger.first_name, passenger.middle_name, passenger.last_name, passenger.age, passenger.seat]
+                for passenger in booking_entry.seatDetail.all()
+            ]
+        return [booking_dict, bus_dict, passengerList]
+
+class BookingHistory(APIView):
+    permission_classes = [IsAuthenticated]
+    authentication_classes = [CachedJWTAuthentication]
+    
+    def get(self, request):
+        """This function returns the bookings of the authenticated user newest first along with their bus and passengers, a page of bookings always costs two queries however long the history is
+
+        Args:
+            request (rest_framework.request object): the page is selected with the cursor query parameter
+
+        Returns:
+            rest_framework.response object: bookings of the page with the links to the next and previous pages
+        """
+        paginator = KeysetPagination()
+        bookings = paginator.paginate_queryset(userBookings(request.user), request, HISTORY_ORDERING)
+        with timed('serializer'):
+            data = BookingHistorySerializer(bookings, many = True).data
+        return paginator.get_paginated_response(data)
+
+class BookingDetail(APIView):
+    permission_classes = [IsAuthenticated]
+    authentication_classes = [CachedJWTAuthentication]
+    
+    def get(self, request, **kwargs):
+        """This function returns a single booking of the authenticated user with its bus and passengers
+
+        Args:
+            request (rest_framework.request object)
+
+        Returns:
+            rest_framework.response object: the booking, 404 if the user has no booking with this id
+        """
+        try:
+            booking = userBookings(request.user).get(id = kwargs['id'])
+        except Bookings.DoesNotExist:
+            return Response({'status':"Failure", 'message':"Booking not found"}, status=status.HTTP_404_NOT_FOUND)
+        
+        with timed('serializer'):
+            data = BookingHistorySerializer(booking).data
+        return Response({'status':"Success", 'data':data}, status=status.HTTP_200_OK)
+
+class BookingExport(APIView):
+    permission_classes = [IsAdminUser]
+    authentication_classes = [CachedJWTAuthentication]
+    
+    def get(self, request, **kwargs):
+        """This function streams the bookings (a row per booking) or the passenger manifest (a row per passenger) as CSV or NDJSON for the staff, the rows are read and sent a chunk at a time so the memory used is the same whatever the number of rows
+
+        Args:
+            request (rest_framework.request object): filtered with the operator, bus (id of the bus), from and to (travel dates in DD-MM-YYYY format) query parameters
+
+        Returns:
+            StreamingHttpResponse: the export as an attachment, 404 for an unknown export or format
+        """
+        kind, outputFormat = kwargs['kind'], kwargs['output']
+        if kind not in EXPORTS or outputFormat not in EXPORT_FORMATS:
+            return Response({'status':"Failure", 'message':"Unknown export"}, status=status.HTTP_404_NOT_FOUND)
+        
+        rows = exportQuery(kind, **exportFilters(request.query_params))
+        response = StreamingHttpResponse(self.streamedLines(rows, ExportLines(kind, outputFormat)), content_type=EXPORT_FORMATS[outputFormat])
+        response['Content-Disposition'] = f'attachment; filename="{kind}.{outputFormat}"'
+        patch_cache_control(response, private=True, no_store=True)
+        return response
+    
+    def streamedLines(self, rows, lines):
+        return exportLines(rows, lines, settings.EXPORT_CHUNK_SIZE)
+
+class RouteAnalytics(ReplicaReadsMixin, APIView):
+    permission_classes = [IsAdminUser]
+    authentication_classes = [CachedJWTAuthentication]
+    
+    def get(self, request):
+        """This function returns the bookings, seats sold, occupancy and revenue of a route for every day of a period along with their totals, for the staff dashboards.
+        They are read from the trip rollups kept up to date by the bookings, so the cost depends on the number of buses and days and not on the number of bookings
+
+        Args:
+            request (rest_framework.request object): source, destination, from and to (travel dates in DD-MM-YYYY format, both included, at most MAX_PERIOD_DAYS apart)
+
+        Returns:
+            rest_framework.response object: the days with bookings and the totals of the period
+        """
+        source = request.query_params.get('source')
+        destination = request.query_params.get('destination')
+        filters = exportFilters(request.query_params)
+        if not source or not destination or 'from' not in filters or 'to' not in filters:
+            return Response({'status':"Failure", 'message':"source, destination, from and to are required"}, status=status.HTTP_400_BAD_REQUEST)
+        if not 0 <= (filters['to'] - filters['from']).days < MAX_PERIOD_DAYS:
+            return Response({'status':"Failure", 'message':f"The period must end after it starts and last at most {MAX_PERIOD_DAYS} days"}, status=status.HTTP_400_BAD_REQUEST)
+        
+        data = routeTotals(source, destination, filters['from'], filters['to'])
+        response = Response({'status':"Success", 'data':data}, status=status.HTTP_200_OK)
+        patch_cache_control(response, private=True, no_cache=True)
+        return response
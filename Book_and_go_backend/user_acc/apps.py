@@ -4,3 +4,6 @@ from django.apps import AppConfig
 class UserAccConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'user_acc'
+
+    def ready(self):
+        from user_acc import signals  # noqa: F401
@@ -0,0 +1,55 @@
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import AuthenticationFailed, InvalidToken
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.utils import get_md5_hash_password
+
+from django.core.cache import caches
+
+USER_CACHE_ALIAS = 'users'
+
+def userCache():
+    """returns the cache backend holding the authenticated users (local memory by default, bounded and with a short TTL)"""
+    return caches[USER_CACHE_ALIAS]
+
+def userCacheKey(userId):
+    return f"user:{userId}"
+
+def forgetUser(userId):
+    """drops a user from the user cache, the next request of the user loads it from the database again
+
+    Args:
+        userId (int): id of the user
+    """
+    userCache().delete(userCacheKey(userId))
+
+class CachedJWTAuthentication(JWTAuthentication):
+    """JWTAuthentication which keeps the users it loads in the user cache, so that an authenticated request doesn't have to fetch its user from the database every time.
+    The cached user is dropped whenever the user is saved or deleted (see user_acc.signals), with the local memory backend the other processes keep theirs until the TTL (USER_CACHE_TTL) runs out.
+
+    Args:
+        JWTAuthentication (class): authentication class of rest_framework_simplejwt
+    """
+
+    def get_user(self, validated_token):
+        try:
+            userId = validated_token[api_settings.USER_ID_CLAIM]
+        except KeyError:
+            raise InvalidToken("Token contained no recognizable user identification")
+
+        key = userCacheKey(userId)
+        usr = userCache().get(key)
+        if usr is None:
+            try:
+                usr = self.user_model.objects.get(**{api_settings.USER_ID_FIELD: userId})
+            except self.user_model.DoesNotExist:
+                raise AuthenticationFailed("User not found", code="user_not_found")
+            userCache().set(key, usr)
+
+        # the same checks as JWTAuthentication, on the cached user
+        if api_settings.CHECK_USER_IS_ACTIVE and not usr.is_active:
+            raise AuthenticationFailed("User is inactive", code="user_inactive")
+
+        if api_settings.CHECK_REVOKE_TOKEN and validated_token.get(api_settings.REVOKE_TOKEN_CLAIM) != get_md5_hash_password(usr.password):
+            raise AuthenticationFailed("The user's password has been changed.", code="password_changed")
+
+        return usr
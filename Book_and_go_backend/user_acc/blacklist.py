@@ -0,0 +1,174 @@
+from datetime import timedelta
+from functools import lru_cache
+from hashlib import blake2b
+from math import ceil, log
+from threading import Lock
+from time import monotonic, time_ns
+
+from rest_framework_simplejwt.exceptions import TokenError
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.token_blacklist.models import BlacklistedToken, OutstandingToken
+from rest_framework_simplejwt.tokens import RefreshToken
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.utils.timezone import now
+
+BLACKLIST_VERSION_KEY = "blacklist:version"
+# the bloom filter is never sized for fewer tokens than this, and gives a false positive for about one token in a thousand
+BLOOM_MIN_CAPACITY = 10000
+BLOOM_ERROR_RATE = 0.001
+# number of recently blacklisted tokens confirmed from memory, a hit on an older one is confirmed by the database
+RECENT_SIZE = 50000
+# rows blacklisted this long before the last sync are read again, so a transaction committing late isn't missed
+SYNC_OVERLAP = timedelta(seconds=60)
+
+class BloomFilter:
+    """set membership in a fixed bit array, it can say that an item was added when it wasn't (about errorRate of the time) but never the opposite
+
+    Args:
+        capacity (int): number of items the filter is sized for
+        errorRate (float): false positive rate once capacity items are added
+    """
+
+    def __init__(self, capacity, errorRate=BLOOM_ERROR_RATE):
+        self.capacity = capacity
+        self.size = max(ceil(-capacity * log(errorRate) / log(2) ** 2), 64)
+        self.hashes = max(round(self.size / capacity * log(2)), 1)
+        self.bits = bytearray((self.size + 7) // 8)
+        self.count = 0
+
+    def positions(self, item):
+        # double hashing, the k positions are derived from the two halves of one digest
+        digest = blake2b(item.encode(), digest_size=16).digest()
+        first, second = int.from_bytes(digest[:8], 'big'), int.from_bytes(digest[8:], 'big') | 1
+        return [(first + index * second) % self.size for index in range(self.hashes)]
+
+    def add(self, item):
+        for position in self.positions(item):
+            self.bits[position >> 3] |= 1 << (position & 7)
+        self.count += 1
+
+    def __contains__(self, item):
+        return all(self.bits[position >> 3] & (1 << (position & 7)) for position in self.positions(item))
+
+class BlacklistIndex:
+    """in memory index of the blacklisted refresh tokens of this process. A token missing from the bloom filter is not blacklisted and no query is made,
+    a token found in it is confirmed from the set of recently blacklisted tokens or else from the database.
+    The index reads the tokens blacklisted since its last sync every BLACKLIST_SYNC_INTERVAL seconds, or as soon as the blacklist version in the cache changes
+    (which a logout bumps, so with a shared cache every process picks it up on its next check)
+    """
+
+    def __init__(self):
+        self.lock = Lock()
+        self.bloom = None
+        self.recent = {}
+        self.version = None
+        self.syncedAt = None
+        self.checkedAt = 0
+
+    def warm(self):
+        """builds the index out of every blacklisted token which hasn't expired yet"""
+        jtis = list(BlacklistedToken.objects.filter(token__expires_at__gt=now()).values_list('token__jti', flat=True))
+        self.bloom = BloomFilter(max(2 * len(jtis), BLOOM_MIN_CAPACITY))
+        self.recent = {}
+        for jti in jtis:
+            self.add(jti)
+
+    def add(self, jti):
+        # a jti the filter already reports is either in it or a false positive, which doesn't need adding again
+        if jti not in self.bloom:
+            self.bloom.add(jti)
+        self.recent[jti] = None
+        if len(self.recent) > RECENT_SIZE:
+            del self.recent[next(iter(self.recent))]
+
+    def sync(self):
+        """brings the index up to date with the blacklist table when it is due, the first sync warms the whole index"""
+        version = cache.get(BLACKLIST_VERSION_KEY)
+        if self.bloom is not None and version == self.version and monotonic() - self.checkedAt < settings.BLACKLIST_SYNC_INTERVAL:
+            return
+
+        with self.lock:
+            started = now()
+            if self.bloom is None or self.bloom.count >= self.bloom.capacity:
+                # rebuilding also drops the tokens which have expired since the last warm up
+                self.warm()
+            else:
+                newer = BlacklistedToken.objects.filter(blacklisted_at__gte=self.syncedAt - SYNC_OVERLAP).values_list('token__jti', flat=True)
+                for jti in newer:
+                    self.add(jti)
+            self.version = version
+            self.syncedAt = started
+            self.checkedAt = monotonic()
+
+    def isBlacklisted(self, jti):
+        """tells if the token with the given jti is blacklisted, only a possible hit which isn't a recent logout needs a query
+
+        Args:
+            jti (str): jti claim of the token
+
+        Returns:
+            bool: True if the token is blacklisted
+        """
+        self.sync()
+        if jti not in self.bloom:
+            return False
+        if jti in self.recent:
+            return True
+        return BlacklistedToken.objects.filter(token__jti=jti).exists()
+
+    def blacklisted(self, jti):
+        """records a token blacklisted by this process and tells the other processes to sync"""
+        version = time_ns()
+        with self.lock:
+            if self.bloom is not None:
+                self.add(jti)
+                # this process already has the token, only the others need to sync
+                self.version = version
+        cache.set(BLACKLIST_VERSION_KEY, version, None)
+
+@lru_cache(maxsize=None)
+def blacklistIndex():
+    """returns the blacklist index of this process"""
+    return BlacklistIndex()
+
+class IndexedRefreshToken(RefreshToken):
+    """RefreshToken checking the blacklist through the blacklist index of the process instead of querying the blacklist table for every token
+
+    Args:
+        RefreshToken (class): refresh token class of rest_framework_simplejwt
+    """
+
+    def check_blacklist(self):
+        if blacklistIndex().isBlacklisted(self.payload[api_settings.JTI_CLAIM]):
+            raise TokenError("Token is blacklisted")
+
+    def blacklist(self):
+        blacklisted = super().blacklist()
+        jti = self.payload[api_settings.JTI_CLAIM]
+        transaction.on_commit(lambda: blacklistIndex().blacklisted(jti))
+        return blacklisted
+
+def compactTokens(batchSize=1000):
+    """deletes the expired outstanding tokens along with their blacklist entries, an expired token fails verification whether it is blacklisted or not so neither is needed anymore.
+    The tokens are deleted in batches so that the tables are never locked for long
+
+    Args:
+        batchSize (int): number of tokens deleted per transaction
+
+    Returns:
+        int: number of outstanding tokens deleted
+    """
+    deleted = 0
+    while True:
+        with transaction.atomic():
+            expired = list(OutstandingToken.objects.filter(expires_at__lte=now()).order_by().values_list('pk', flat=True)[:batchSize])
+            if not expired:
+                return deleted
+            BlacklistedToken.objects.filter(token_id__in=expired).delete()
+            OutstandingToken.objects.filter(pk__in=expired).delete()
+        deleted += len(expired)
+        if len(expired) < batchSize:
+            return deleted
@@ -0,0 +1,148 @@
+from asyncio import wrap_future
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from functools import lru_cache
+from threading import Lock
+
+from django import setup
+from django.conf import settings
+from django.contrib.auth.hashers import check_password, make_password, get_hasher, identify_hasher
+from django.core.cache import cache
+
+class HashingBusy(Exception):
+    """raised when the hashing queue is full, the request should be retried a bit later"""
+    pass
+
+class HashingExecutor:
+    """bounded pool running the password hashing (PBKDF2 by default) away from the request workers, so that a burst of logins can only take the workers of the pool
+    and not the CPU of every worker serving the searches. At most workers + queueSize hashes are in flight, any more are refused with HashingBusy instead of piling up
+
+    Args:
+        kind (str): 'thread' or 'process', a process pool doesn't share the GIL with the request workers
+        workers (int): number of hashes computed at once
+        queueSize (int): number of hashes allowed to wait for a worker
+    """
+
+    def __init__(self, kind, workers, queueSize):
+        if kind == 'process':
+            self.pool = ProcessPoolExecutor(max_workers=workers, initializer=setup)
+        else:
+            self.pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='hashing')
+        self.kind = kind
+        self.workers = workers
+        self.slots = workers + queueSize
+        self.lock = Lock()
+        self.pending = 0
+        self.completed = 0
+        self.rejected = 0
+
+    def submit(self, fn, *args):
+        """submits a hashing function to the pool
+
+        Raises:
+            HashingBusy: if the queue is full
+
+        Returns:
+            concurrent.futures.Future: future of the result
+        """
+        with self.lock:
+            if self.pending >= self.slots:
+                self.rejected += 1
+                raise HashingBusy("Too many passwords are being checked, please try again")
+            self.pending += 1
+        try:
+            future = self.pool.submit(fn, *args)
+        except Exception:
+            self.finished(None)
+            raise
+        future.add_done_callback(self.finished)
+        return future
+
+    def finished(self, future):
+        with self.lock:
+            self.pending -= 1
+            self.completed += future is not None
+
+    async def run(self, fn, *args):
+        """runs the hashing function on the pool and waits for it without blocking the event loop"""
+        return await wrap_future(self.submit(fn, *args))
+
+    def call(self, fn, *args):
+        """runs the hashing function on the pool from synchronous code, the calling thread waits but the CPU used stays bounded by the pool"""
+        return self.submit(fn, *args).result()
+
+    def stats(self):
+        """returns the queue metrics of the pool
+
+        Returns:
+            dict: kind and size of the pool, hashes running and waiting, hashes completed and refused since the pool was created
+        """
+        with self.lock:
+            return {
+                'kind': self.kind,
+                'workers': self.workers,
+                'running': min(self.pending, self.workers),
+                'queued': max(self.pending - self.workers, 0),
+                'completed': self.completed,
+                'rejected': self.rejected,
+            }
+
+@lru_cache(maxsize=None)
+def hashingExecutor():
+    """returns the hashing executor of this process, configured with PASSWORD_HASHING_EXECUTOR, PASSWORD_HASHING_WORKERS and PASSWORD_HASHING_QUEUE"""
+    return HashingExecutor(settings.PASSWORD_HASHING_EXECUTOR, settings.PASSWORD_HASHING_WORKERS, settings.PASSWORD_HASHING_QUEUE)
+
+async def amakePassword(password):
+    """hashes a password on the hashing executor
+
+    Raises:
+        HashingBusy: if the hashing queue is full
+    """
+    return await hashingExecutor().run(make_password, password)
+
+async def acheckPassword(usr, password):
+    """checks the password of a user on the hashing executor, like user.check_password the hash is upgraded when the hasher or its iterations changed
+
+    Args:
+        usr (user): user to check, None when no user has the username
+        password (str): raw password
+
+    Raises:
+        HashingBusy: if the hashing queue is full
+
+    Returns:
+        bool: True if the password is right
+    """
+    executor = hashingExecutor()
+    if usr is None:
+        # hash anyway, so that the response time doesn't tell which usernames exist
+        await executor.run(make_password, password)
+        return False
+
+    if not await executor.run(check_password, password, usr.password):
+        return False
+
+    preferred = get_hasher('default')
+    if preferred.algorithm != identify_hasher(usr.password).algorithm or preferred.must_update(usr.password):
+        usr.password = await executor.run(make_password, password)
+        await usr.asave(update_fields=['password'])
+    return True
+
+def attemptKey(username):
+    return f"login:failures:{username.lower()}"
+
+def loginLocked(username):
+    """tells if the username has used up its failed logins (PASSWORD_ATTEMPT_LIMIT in PASSWORD_ATTEMPT_WINDOW seconds), no password is hashed for it until the window is over"""
+    return cache.get(attemptKey(username), 0) >= settings.PASSWORD_ATTEMPT_LIMIT
+
+def loginFailed(username):
+    """counts a failed login of the username, the window starts with the first failure"""
+    key = attemptKey(username)
+    cache.add(key, 0, settings.PASSWORD_ATTEMPT_WINDOW)
+    try:
+        cache.incr(key)
+    except ValueError:
+        cache.set(key, 1, settings.PASSWORD_ATTEMPT_WINDOW)
+
+def loginSucceeded(username):
+    """clears the failed logins of the username"""
+    cache.delete(attemptKey(username))
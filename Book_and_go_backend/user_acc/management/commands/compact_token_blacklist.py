@@ -0,0 +1,13 @@
+from user_acc.blacklist import compactTokens
+
+from django.core.management.base import BaseCommand
+
+class Command(BaseCommand):
+    help = "Deletes the expired outstanding and blacklisted refresh tokens in batches, meant to be run periodically (eg. hourly) from cron"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000, help="tokens deleted per transaction")
+
+    def handle(self, *args, **options):
+        deleted = compactTokens(batchSize=options['batch_size'])
+        self.stdout.write(f"{deleted} expired tokens deleted")
@@ -2,8 +2,12 @@ from datetime import date
 from re import search
 
 from .models import user
+from .blacklist import IndexedRefreshToken, blacklistIndex
 
 from rest_framework.serializers import ModelSerializer
+from rest_framework_simplejwt.serializers import TokenRefreshSerializer, TokenVerifySerializer
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.tokens import UntypedToken
 
 from django.core.exceptions import ValidationError
 
@@ -20,6 +24,8 @@ class UserSerializer(ModelSerializer):
     class Meta:
         model = user
         fields = "__all__"
+        # the signup is open to anyone, the privileges of an account are only given by an admin
+        read_only_fields = ['is_superuser', 'is_staff', 'is_active', 'groups', 'user_permissions', 'last_login', 'date_joined']
         extra_kwargs = {'password' : {'write_only': True}}
     
     def create(self, validated_data):
@@ -32,12 +38,17 @@ class UserSerializer(ModelSerializer):
             user object: _returns the current instance of the user model after its creation
         """
         password = validated_data.pop('password')
+        # the signup view hashes the password on the hashing executor and passes the hash along
+        passwordHash = validated_data.pop('password_hash', None)
         usr = user(**validated_data)
-        usr.set_password(password)  
+        if passwordHash:
+            usr.password = passwordHash
+        else:
+            usr.set_password(password)  
         usr.save()
         return usr
     
-    def validate_DOB(value):
+    def validate_DOB(self, value):
         """validates the DOB as entered by the user 
 
         Args:
@@ -75,7 +86,7 @@ class UserSerializer(ModelSerializer):
         else:
             raise ValidationError("Age must be 18+")
     
-    def validate_password(value):
+    def validate_password(self, value):
         """validates the password field
 
         Args:
@@ -93,4 +104,26 @@ class UserSerializer(ModelSerializer):
         if numbers and specials:
             return value
         else:
-            raise ValidationError("password must contain numbers and special characters")
\ No newline at end of file
+            raise ValidationError("password must contain numbers and special characters")
+
+class IndexedTokenRefreshSerializer(TokenRefreshSerializer):
+    """refresh serializer of the token/refresh endpoint (see SIMPLE_JWT in settings), the refresh token is checked against the blacklist index of the process
+    so a token which was never blacklisted is refreshed without querying the blacklist table
+
+    Args:
+        TokenRefreshSerializer (class): refresh serializer of rest_framework_simplejwt
+    """
+    token_class = IndexedRefreshToken
+
+class IndexedTokenVerifySerializer(TokenVerifySerializer):
+    """verify serializer of the token/verify endpoint (see SIMPLE_JWT in settings), a token is refused once it is blacklisted, which is checked through the blacklist index of the process
+
+    Args:
+        TokenVerifySerializer (class): verify serializer of rest_framework_simplejwt
+    """
+
+    def validate(self, attrs):
+        token = UntypedToken(attrs['token'])
+        if blacklistIndex().isBlacklisted(token[api_settings.JTI_CLAIM]):
+            raise ValidationError("Token is blacklisted")
+        return {}
@@ -0,0 +1,17 @@
+from user_acc.models import user
+from user_acc.authentication import forgetUser
+
+from django.db import transaction
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+
+# saving only these fields doesn't change anything the authentication looks at
+LOGIN_FIELDS = {'last_login'}
+
+@receiver([post_save, post_delete], sender=user)
+def userChanged(sender, instance, update_fields=None, **kwargs):
+    """drops the cached user once the change is committed (password changed or reset, user deactivated or deleted), so that a concurrent request can't cache the old row again"""
+    if update_fields is not None and set(update_fields) <= LOGIN_FIELDS:
+        return
+    userId = instance.pk
+    transaction.on_commit(lambda: forgetUser(userId))
@@ -1,3 +1,251 @@
+from datetime import date, timedelta
+from threading import Event
+from unittest.mock import patch
+from uuid import uuid4
+
+from user_acc.models import user
+from user_acc.authentication import userCache, userCacheKey
+from user_acc.blacklist import BloomFilter, IndexedRefreshToken, blacklistIndex, compactTokens, BLACKLIST_VERSION_KEY
+from user_acc.hashing import HashingExecutor, HashingBusy, hashingExecutor, attemptKey
+
+from rest_framework.test import APITestCase
+from rest_framework_simplejwt.exceptions import TokenError
+from rest_framework_simplejwt.token_blacklist.models import BlacklistedToken, OutstandingToken
+from rest_framework_simplejwt.tokens import AccessToken
+
+from django.conf import settings
+from django.contrib.auth.models import Group, Permission
+from django.core.cache import cache
+from django.db import connection
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.utils.timezone import now
+
+def createUser(username="traveller"):
+    """creates a user that the API tests can authenticate as"""
+    return user.objects.create_user(username=username, password="pass@123", DOB=date(2000, 1, 1))
+
+
+class CachedAuthenticationTest(APITestCase):
+    """the user of a token is loaded once and then served from the user cache until it changes"""
+
+    def setUp(self):
+        userCache().clear()
+        self.usr = createUser()
+        self.client.credentials(HTTP_AUTHORIZATION=f"Bearer {AccessToken.for_user(self.usr)}")
+
+    def userQueries(self, queries):
+        return [query for query in queries if f"FROM {connection.ops.quote_name(user._meta.db_table)}" in query['sql']]
+
+    def history(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get("/buses/bookings/")
+        self.assertEqual(response.status_code, 200)
+        return self.userQueries(queries)
+
+    def test_user_loaded_once(self):
+        self.assertEqual(len(self.history()), 1)
+        self.assertEqual(len(self.history()), 0)
+
+    def test_password_change_drops_cached_user(self):
+        self.history()
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post("/user/changepassword/", {'oldpassword': "pass@123", 'newpassword': "new@12345"})
+        self.assertEqual(response.status_code, 200)
+        self.assertIsNone(userCache().get(userCacheKey(self.usr.id)))
+
+        # the request changing the password can't leave the old password behind in the cache
+        self.assertEqual(len(self.history()), 1)
+        self.assertTrue(userCache().get(userCacheKey(self.usr.id)).check_password("new@12345"))
+
+    def test_deactivated_user_is_rejected(self):
+        self.history()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.usr.is_active = False
+            self.usr.save()
+        self.assertEqual(self.client.get("/buses/bookings/").status_code, 401)
+
+    def test_login_keeps_cached_user(self):
+        self.history()
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post("/user/login/", {'username': "traveller", 'password': "pass@123"})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(self.history()), 0)
+
+
+class BlacklistIndexTest(APITestCase):
+    """refresh tokens are checked against the in memory blacklist index and only a possible hit reaches the database"""
+
+    def setUp(self):
+        cache.delete(BLACKLIST_VERSION_KEY)
+        blacklistIndex.cache_clear()
+        self.usr = createUser()
+
+    def login(self):
+        response = self.client.post("/user/login/", {'username': "traveller", 'password': "pass@123"})
+        self.client.credentials(HTTP_AUTHORIZATION=f"Bearer {response.data['access']}")
+        return response.cookies['refresh_token'].value
+
+    def test_bloom_filter(self):
+        bloom = BloomFilter(1000)
+        items = [str(uuid4()) for _ in range(1000)]
+        for item in items:
+            bloom.add(item)
+        self.assertTrue(all(item in bloom for item in items))
+        falsePositives = sum(str(uuid4()) in bloom for _ in range(10000))
+        self.assertLess(falsePositives, 50)
+
+    def test_clean_tokens_skip_the_database(self):
+        refresh = str(IndexedRefreshToken.for_user(self.usr))
+        IndexedRefreshToken(refresh)
+        with self.assertNumQueries(0):
+            IndexedRefreshToken(refresh)
+
+    def blacklistQueries(self, queries):
+        return [query for query in queries if connection.ops.quote_name(BlacklistedToken._meta.db_table) in query['sql']]
+
+    def test_refresh_skips_the_database_for_clean_tokens(self):
+        refresh = self.login()
+        # the first check of the process warms the index
+        blacklistIndex().sync()
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post("/user/token/refresh/", {'refresh': refresh})
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('access', response.data)
+        self.assertEqual(self.blacklistQueries(queries), [])
+
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(self.client.post("/user/token/verify/", {'token': refresh}).status_code, 200)
+        self.assertEqual(self.blacklistQueries(queries), [])
+
+    def test_refresh_refuses_blacklisted_token(self):
+        refresh = self.login()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post("/user/logout/")
+        self.assertEqual(self.client.post("/user/token/refresh/", {'refresh': refresh}).status_code, 401)
+        self.assertEqual(self.client.post("/user/token/verify/", {'token': refresh}).status_code, 400)
+
+    def test_logout_blacklists_token(self):
+        refresh = self.login()
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post("/user/logout/")
+        self.assertEqual(response.status_code, 200)
+
+        with self.assertNumQueries(0):
+            with self.assertRaises(TokenError):
+                IndexedRefreshToken(refresh)
+
+        self.client.cookies['refresh_token'] = refresh
+        self.assertEqual(self.client.post("/user/logout/").status_code, 400)
+
+    def test_blacklisted_by_other_process(self):
+        refresh = IndexedRefreshToken.for_user(self.usr)
+        IndexedRefreshToken(str(refresh))
+
+        # another process blacklists the token and bumps the version in the shared cache
+        BlacklistedToken.objects.create(token=OutstandingToken.objects.get(jti=refresh['jti']))
+        cache.set(BLACKLIST_VERSION_KEY, 1, None)
+        with self.assertRaises(TokenError):
+            IndexedRefreshToken(str(refresh))
+
+    def test_older_blacklisted_tokens_are_confirmed_by_database(self):
+        refresh = IndexedRefreshToken.for_user(self.usr)
+        refresh.blacklist()
+        index = blacklistIndex()
+        index.sync()
+        index.recent.clear()
+
+        with self.assertNumQueries(1):
+            self.assertTrue(index.isBlacklisted(refresh['jti']))
+
+
+class CompactTokensTest(TestCase):
+    """the expired outstanding tokens are deleted in batches along with their blacklist entries"""
+
+    def test_only_expired_tokens_are_deleted(self):
+        usr = createUser()
+        for index in range(5):
+            token = OutstandingToken.objects.create(user=usr, jti=f"expired-{index}", token="", expires_at=now() - timedelta(hours=1))
+            BlacklistedToken.objects.create(token=token)
+        OutstandingToken.objects.create(user=usr, jti="valid", token="", expires_at=now() + timedelta(hours=1))
+
+        self.assertEqual(compactTokens(batchSize=2), 5)
+        self.assertEqual(list(OutstandingToken.objects.values_list('jti', flat=True)), ["valid"])
+        self.assertFalse(BlacklistedToken.objects.exists())
+
+
+class HashingExecutorTest(APITestCase):
+    """the passwords are hashed on a bounded pool and the failed logins of a username are limited"""
+
+    def setUp(self):
+        cache.delete(attemptKey("traveller"))
+        self.usr = createUser()
+
+    def login(self, password):
+        return self.client.post("/user/login/", {'username': "traveller", 'password': password})
+
+    def test_pool_is_bounded(self):
+        executor = HashingExecutor('thread', workers=1, queueSize=1)
+        release = Event()
+        running = executor.submit(release.wait)
+        waiting = executor.submit(release.wait)
+        self.assertEqual(executor.stats()['running'], 1)
+        self.assertEqual(executor.stats()['queued'], 1)
+
+        with self.assertRaises(HashingBusy):
+            executor.submit(release.wait)
+        release.set()
+        running.result()
+        waiting.result()
+        self.assertEqual(executor.stats(), {'kind': 'thread', 'workers': 1, 'running': 0, 'queued': 0, 'completed': 2, 'rejected': 1})
+
+    def test_signup_hashes_on_executor(self):
+        completed = hashingExecutor().stats()['completed']
+        response = self.client.post("/user/signup/", {'username': "newcomer", 'password': "pass@1234", 'DOB': "2000-01-01", 'email': "newcomer@example.com"})
+        self.assertEqual(response.status_code, 201)
+        self.assertNotIn('password', response.data)
+        self.assertTrue(user.objects.get(username="newcomer").check_password("pass@1234"))
+        self.assertEqual(hashingExecutor().stats()['completed'], completed + 1)
+
+    def test_signup_ignores_privileges(self):
+        group = Group.objects.create(name="admins")
+        permission = Permission.objects.first()
+        response = self.client.post("/user/signup/", {
+            'username': "intruder", 'password': "pass@1234", 'DOB': "2000-01-01", 'email': "intruder@example.com",
+            'is_superuser': True, 'is_staff': True, 'is_active': False, 'groups': [group.pk], 'user_permissions': [permission.pk],
+        }, format="json")
+        self.assertEqual(response.status_code, 201)
+        usr = user.objects.get(username="intruder")
+        self.assertFalse(usr.is_superuser)
+        self.assertFalse(usr.is_staff)
+        self.assertTrue(usr.is_active)
+        self.assertFalse(usr.groups.exists())
+        self.assertFalse(usr.user_permissions.exists())
+
+    def test_login(self):
+        response = self.login("pass@123")
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('access', response.data)
+        self.assertIsNotNone(user.objects.get(pk=self.usr.pk).last_login)
+
+    def test_failed_logins_are_limited(self):
+        for _ in range(settings.PASSWORD_ATTEMPT_LIMIT):
+            self.assertEqual(self.login("wrong@123").status_code, 404)
+
+        completed = hashingExecutor().stats()['completed']
+        response = self.login("pass@123")
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(response['Retry-After'], str(settings.PASSWORD_ATTEMPT_WINDOW))
+        # refused before anything is hashed
+        self.assertEqual(hashingExecutor().stats()['completed'], completed)
+
+    def test_success_clears_failures(self):
+        self.login("wrong@123")
+        self.login("pass@123")
+        self.assertIsNone(cache.get(attemptKey("traveller")))
 
-# Create your tests here.
+    def test_busy_pool(self):
+        with patch.object(HashingExecutor, 'submit', side_effect=HashingBusy):
+            response = self.login("pass@123")
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response['Retry-After'], "1")
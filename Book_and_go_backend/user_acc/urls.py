@@ -1,10 +1,14 @@
 from django.urls import path
 from . import views 
+from rest_framework_simplejwt.views import TokenRefreshView, TokenVerifyView
 urlpatterns = [
     path("signup/", views.UserSignupView.as_view(), name="user signup"),
     path("login/", views.UserLoginView.as_view(), name = "user login"),
     path('logout/', views.UserLogoutView.as_view(), name="user logout"),
+    path('token/refresh/', TokenRefreshView.as_view(), name="token refresh"),
+    path('token/verify/', TokenVerifyView.as_view(), name="token verify"),
     path('changepassword/', views.UserChangePassword.as_view(), name = "change password"),
     path('forgotpassword/', views.UserForgotPassword.as_view(), name= "forgot password"),
     path('resetpassword/<str:uidb64>/<str:token>/', views.UserResetPassword.as_view(), name = "reset password"),
+    path('hashing_stats/', views.HashingStats.as_view(), name = "hashing stats"),
 ]
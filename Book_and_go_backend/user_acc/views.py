@@ -1,27 +1,42 @@
 from .models import user
 from .serializers import UserSerializer
+from .authentication import CachedJWTAuthentication
+from .blacklist import IndexedRefreshToken
+from .hashing import hashingExecutor, acheckPassword, amakePassword, loginLocked, loginFailed, loginSucceeded, HashingBusy
+
+from asgiref.sync import sync_to_async
+
+from utility.asyncviews import AsyncAPIView
 
 from rest_framework.generics import ListCreateAPIView, RetrieveUpdateDestroyAPIView
 from rest_framework.response import Response
 from rest_framework.views import APIView
-from rest_framework_simplejwt.tokens import RefreshToken
 from rest_framework_simplejwt.exceptions import TokenError
 from rest_framework import status
-from rest_framework.permissions import IsAuthenticated
-from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework.permissions import IsAuthenticated, IsAdminUser
 
-from django.contrib.auth import authenticate
+from django.conf import settings
+from django.contrib.auth.hashers import make_password
 from django.utils.timezone import now
 from django.contrib.auth.tokens import PasswordResetTokenGenerator
 from django.urls import reverse
 
 from base64 import urlsafe_b64decode, urlsafe_b64encode
 
-class UserSignupView(ListCreateAPIView):
+def hashingBusy():
+    """response sent when the hashing queue is full"""
+    response = Response({'message': "Server is busy, please try again"}, status=status.HTTP_503_SERVICE_UNAVAILABLE)
+    response['Retry-After'] = '1'
+    return response
+
+class UserSignupView(AsyncAPIView, ListCreateAPIView):
     serializer_class = UserSerializer
     
-    def post(self, request):
-        """handles the signup request from the user 
+    async def get(self, request, *args, **kwargs):
+        return await sync_to_async(super().get)(request, *args, **kwargs)
+    
+    async def post(self, request):
+        """handles the signup request from the user, the password is hashed on the hashing executor while the worker goes on with other requests
 
         Args:
             request (rest_framework.request object):
@@ -29,12 +44,25 @@ class UserSignupView(ListCreateAPIView):
         Returns:
             object: returns the current instance of the model after creating it in DB 
         """
-        return self.create(request)
+        serializer = self.get_serializer(data = request.data)
+        await sync_to_async(serializer.is_valid)(raise_exception = True)
+        try:
+            passwordHash = await amakePassword(serializer.validated_data['password'])
+        except HashingBusy:
+            return hashingBusy()
+        
+        data = await sync_to_async(self.save)(serializer, passwordHash)
+        return Response(data, status=status.HTTP_201_CREATED, headers=self.get_success_headers(data))
+    
+    def save(self, serializer, passwordHash):
+        serializer.save(password_hash = passwordHash)
+        return serializer.data
 
-class UserLoginView(APIView):
-    def post(self, request):
+class UserLoginView(AsyncAPIView):
+    async def post(self, request):
         """used for authenticating the user after checking the username and password entered by the user against the record present for the user in DB 
         And if the credentials are right it sets the refresh token in the cookies whereas access token is sent in JSON format. 
+        The password is checked on the hashing executor, and a username which failed too many times in a row is refused without checking anything until its window is over
         
         Args:
             request (rest_framework.request object):
@@ -44,22 +72,36 @@ class UserLoginView(APIView):
         """
         username = request.data.get('username')
         password = request.data.get('password')
-
-        user = authenticate(request, username = username, password = password)
-        if user:
-            user.last_login = now()
-            user.save(update_fields=['last_login'])
+        if not username or password is None:
+            return Response({'message':"user doesn't exist :("}, status=status.HTTP_404_NOT_FOUND)
+        
+        if loginLocked(username):
+            response = Response({'message': "Too many failed attempts, please try again later"}, status=status.HTTP_429_TOO_MANY_REQUESTS)
+            response['Retry-After'] = str(settings.PASSWORD_ATTEMPT_WINDOW)
+            return response
+        
+        usr = await user.objects.filter(username = username).afirst()
+        try:
+            valid = await acheckPassword(usr, password)
+        except HashingBusy:
+            return hashingBusy()
+        
+        if valid and usr.is_active:
+            loginSucceeded(username)
+            usr.last_login = now()
+            await usr.asave(update_fields=['last_login'])
             
-            refresh = RefreshToken.for_user(user)
+            refresh = await sync_to_async(IndexedRefreshToken.for_user)(usr)
             response = Response({'access': str(refresh.access_token), 'message': 'Login Successfull :)'}, status = status.HTTP_200_OK)
             response.set_cookie(key="refresh_token", value= str(refresh), samesite="Lax", httponly=True, secure=True)
             return response
         else:
+            loginFailed(username)
             return Response({'message':"user doesn't exist :("}, status=status.HTTP_404_NOT_FOUND)
 
 class UserLogoutView(APIView):
     permission_classes = [IsAuthenticated]
-    authentication_classes = [JWTAuthentication]
+    authentication_classes = [CachedJWTAuthentication]
     
     def post(self, request):
         """handles the logout functionality for the user. If the refresh token is not yet expired it gets blacklisted and gets deleted from the cookie 
@@ -74,7 +116,7 @@ class UserLogoutView(APIView):
         
         if refreshToken:
             try:
-                refreshToken = RefreshToken(refreshToken)
+                refreshToken = IndexedRefreshToken(refreshToken)
                 refreshToken.blacklist()
             except TokenError:
                 return Response({'message': "Invalid or Expired Token"}, status=status.HTTP_400_BAD_REQUEST)
@@ -85,12 +127,12 @@ class UserLogoutView(APIView):
         else:
             return Response({'message': 'Invalid or Missing Refresh Token'}, status=status.HTTP_400_BAD_REQUEST)
 
-class UserChangePassword(APIView):
+class UserChangePassword(AsyncAPIView):
     permission_classes = [IsAuthenticated]
-    authentication_classes = [JWTAuthentication]
+    authentication_classes = [CachedJWTAuthentication]
     
-    def post(self, request):
-        """Handles the change password functionality for the user by receiving the old password then checking it and then saving the new password 
+    async def post(self, request):
+        """Handles the change password functionality for the user by receiving the old password then checking it and then saving the new password, both hashes run on the hashing executor
 
         Args:
             request (rest_framework.request object):
@@ -102,13 +144,15 @@ class UserChangePassword(APIView):
         newPassword = request.data.get('newpassword')
         
         usr = request.user
-        print(usr)
-        if usr.check_password(oldPassword):
-            usr.set_password(newPassword)
-            usr.save(update_fields=['password'])
-            return Response({'message':['Password Changed!'], 'status':['Success']}, status=status.HTTP_200_OK)
-        else:
-            return Response({'message': ['invalid password given'], 'status': ['failure']}, status=status.HTTP_404_NOT_FOUND)
+        try:
+            if await acheckPassword(usr, oldPassword):
+                usr.password = await amakePassword(newPassword)
+                await usr.asave(update_fields=['password'])
+                return Response({'message':['Password Changed!'], 'status':['Success']}, status=status.HTTP_200_OK)
+            else:
+                return Response({'message': ['invalid password given'], 'status': ['failure']}, status=status.HTTP_404_NOT_FOUND)
+        except HashingBusy:
+            return hashingBusy()
 
 class UserForgotPassword(APIView):
     def post(self, request):
@@ -157,11 +201,27 @@ class UserResetPassword(APIView):
                 newpassword = request.data.get('newpassword')
                 if not newpassword:
                     return Response({'message':["new password can't be empty"], 'status':['Failure']}, status=status.HTTP_400_BAD_REQUEST)
-                usr.set_password(newpassword)
+                usr.password = hashingExecutor().call(make_password, newpassword)
                 usr.save(update_fields = ['password'])
                 return Response({'message':['Password reset successful'], 'status':['success']}, status=status.HTTP_200_OK)
             else:
                 return Response({'status':"Failure", 'message': 'Token Invalid'}, status=status.HTTP_400_BAD_REQUEST)
+        except HashingBusy:
+            return hashingBusy()
         except Exception as e:
             return Response({'status':"Failure", "message":"User not found", "errors":str(e)}, status=  status.HTTP_404_NOT_FOUND)
-            
\ No newline at end of file
+
+class HashingStats(APIView):
+    permission_classes = [IsAdminUser]
+    authentication_classes = [CachedJWTAuthentication]
+    
+    def get(self, request):
+        """returns the queue metrics of the hashing executor of the process answering, for the admins
+
+        Args:
+            request (rest_framework.request object):
+
+        Returns:
+            response: hashes running and waiting, hashes completed and refused
+        """
+        return Response({'status':"Success", 'data':hashingExecutor().stats()}, status=status.HTTP_200_OK)
@@ -0,0 +1,41 @@
+from asgiref.sync import sync_to_async
+from inspect import isawaitable
+
+from rest_framework.views import APIView
+
+class AsyncAPIView(APIView):
+    """APIView whose handlers are coroutines, under ASGI the worker is given back to the event loop while a handler waits on the database instead of being blocked for the whole round trip.
+    Authentication, permissions and throttling stay synchronous (they can hit the database to load the user) and are run in a thread, everything else goes through the normal rest_framework flow.
+
+    Args:
+        APIView (class): base view class of rest_framework
+    """
+
+    async def dispatch(self, request, *args, **kwargs):
+        self.args = args
+        self.kwargs = kwargs
+        request = self.initialize_request(request, *args, **kwargs)
+        self.request = request
+        self.headers = self.default_response_headers
+
+        try:
+            await sync_to_async(self.initial)(request, *args, **kwargs)
+
+            if request.method.lower() in self.http_method_names:
+                handler = getattr(self, request.method.lower(), self.http_method_not_allowed)
+            else:
+                handler = self.http_method_not_allowed
+
+            response = handler(request, *args, **kwargs)
+            if isawaitable(response):
+                response = await response
+
+        except Exception as exc:
+            response = self.handle_exception(exc)
+
+        self.response = self.finalize_response(request, response, *args, **kwargs)
+        return self.response
+
+    async def options(self, request, *args, **kwargs):
+        # django refuses views mixing sync and async handlers, so the OPTIONS handler of APIView needs an async version as well
+        return super().options(request, *args, **kwargs)
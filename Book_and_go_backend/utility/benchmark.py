@@ -0,0 +1,121 @@
+from asyncio import gather, run
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from json import dumps
+from math import ceil
+from time import perf_counter
+
+from django.db import connections
+from django.test import Client, AsyncClient
+
+def percentile(values, fraction):
+    """returns the nearest rank percentile of the values
+
+    Args:
+        values (list): sorted values
+        fraction (float): percentile as a fraction, eg. 0.99 for the p99
+
+    Returns:
+        float: the percentile, None when there are no values
+    """
+    if not values:
+        return None
+    return values[max(ceil(fraction * len(values)) - 1, 0)]
+
+def latencySummary(latencies, elapsed, errors = 0):
+    """summarizes the latencies of a benchmark run
+
+    Args:
+        latencies (list): seconds taken by each request
+        elapsed (float): wall clock seconds taken by the whole run
+        errors (int): number of requests which failed
+
+    Returns:
+        dict: number of requests and errors, requests per second and the p50, p95 and p99 latencies in milliseconds
+    """
+    latencies = sorted(latencies)
+    summary = {
+        'requests': len(latencies),
+        'errors': errors,
+        'rps': round(len(latencies) / elapsed, 1) if elapsed else None,
+    }
+    for name, fraction in [('p50', 0.50), ('p95', 0.95), ('p99', 0.99)]:
+        value = percentile(latencies, fraction)
+        summary[name] = round(value * 1000, 2) if value is not None else None
+    return summary
+
+class LoadRequest(namedtuple('LoadRequest', ['method', 'path', 'data', 'headers'])):
+    """a request sent by a benchmark, data is sent as a JSON body"""
+    __slots__ = ()
+
+    def send(self, client):
+        """sends the request with a django test client, for an AsyncClient the result has to be awaited"""
+        if self.method == 'GET':
+            return client.get(self.path, headers = self.headers)
+        return client.generic(self.method, self.path, dumps(self.data), content_type = "application/json", headers = self.headers)
+
+def splitShares(requests, concurrency):
+    """splits the requests between the workers, each worker sends its share one after the other"""
+    return [share for share in (requests[index::concurrency] for index in range(concurrency)) if share]
+
+def runWsgi(shares):
+    """sends the shares of requests through the WSGI handler from a pool of threads, like a threaded WSGI server would
+
+    Args:
+        shares (list): list of LoadRequest for each worker
+
+    Returns:
+        dict: summary of the run, see latencySummary
+    """
+    def worker(share):
+        client = Client()
+        latencies, errors = [], 0
+        try:
+            for request in share:
+                start = perf_counter()
+                response = request.send(client)
+                latencies.append(perf_counter() - start)
+                errors += response.status_code >= 400
+        finally:
+            connections.close_all()
+        return latencies, errors
+
+    start = perf_counter()
+    with ThreadPoolExecutor(max_workers = len(shares)) as pool:
+        results = list(pool.map(worker, shares))
+    return workerSummary(results, perf_counter() - start)
+
+async def runAsgi(shares):
+    """sends the shares of requests through the ASGI handler from concurrent tasks on a single event loop, like an ASGI server would
+
+    Args:
+        shares (list): list of LoadRequest for each worker
+
+    Returns:
+        dict: summary of the run, see latencySummary
+    """
+    async def worker(share):
+        client = AsyncClient()
+        latencies, errors = [], 0
+        for request in share:
+            start = perf_counter()
+            response = await request.send(client)
+            latencies.append(perf_counter() - start)
+            errors += response.status_code >= 400
+        return latencies, errors
+
+    start = perf_counter()
+    results = await gather(*[worker(share) for share in shares])
+    return workerSummary(results, perf_counter() - start)
+
+def runRequests(mode, shares):
+    """sends the shares of requests in the given mode, 'wsgi' or 'asgi'"""
+    if mode == 'wsgi':
+        return runWsgi(shares)
+    if mode == 'asgi':
+        return run(runAsgi(shares))
+    raise ValueError(f"Unknown mode {mode}")
+
+def workerSummary(results, elapsed):
+    latencies = [latency for workerLatencies, _ in results for latency in workerLatencies]
+    return latencySummary(latencies, elapsed, errors = sum(errors for _, errors in results))
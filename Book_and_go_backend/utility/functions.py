@@ -1,5 +1,20 @@
 from datetime import datetime
 
+def searchOrdering(sortVal, tieBreaker='bus_id'):
+    """This function builds the ordering of the search results from the sorting value sent by the user, the primary key is always added at the end so that the order is total and can be paginated with a cursor
+
+    Args:
+        sortVal (str): comma separated columns to sort on. for eg "price,-departuretime"
+        tieBreaker (str): unique column used to break the ties
+
+    Returns:
+        list: columns to pass to order_by
+    """
+    sortList = [field.strip() for field in (sortVal or "").split(",") if field.strip()]
+    if tieBreaker not in [field.lstrip('-') for field in sortList]:
+        sortList.append(tieBreaker)
+    return sortList
+
 def timeBasedData(deptTimeRange, arrivalTimeRange, data):
     """This function filters the query set according to the time data entered by the user
 
@@ -48,12 +63,10 @@ def timeBasedData(deptTimeRange, arrivalTimeRange, data):
         
     return updData
 
-def priceBasedData(minPrice, maxPrice, userMinPrice, userMaxPrice, data):
+def priceBasedData(userMinPrice, userMaxPrice, data):
     """This function gives the list of those entries that have the price field values meeting user's input values
 
     Args:
-        minPrice (int): minimum price value in whole list 
-        maxPrice (int): maximum price value in the list 
         userMinPrice (int): minimum price entered by the user
         userMaxPrice (int): maximum price entered by the user
         data (queryset): queryset containing the entries satisfying source and destination values
@@ -61,19 +74,6 @@ def priceBasedData(minPrice, maxPrice, userMinPrice, userMaxPrice, data):
     Returns:
         queryset: list of those entries that have the price field values meeting user's input values
     """
-    # diff = maxPrice - minPrice
-    # change = (diff*20)/100
-    
-    # priceOptionList = [minPrice]
-    # sum = round(minPrice + change)
-    
-    # while sum <= maxPrice:
-    #     priceOptionList.append(sum)
-    #     sum = round(sum + change)
-        
-    # if maxPrice not in priceOptionList:
-    #     priceOptionList.append(maxPrice)
-    
     if userMinPrice and userMaxPrice:
         updData = data.filter(
             price__gte = userMinPrice,
@@ -124,4 +124,32 @@ def durationBasedData(minDuration, maxDuration, data):
             duration__lte = maxDuration
         )
         
-    return updData
\ No newline at end of file
+    return updData
+
+def filteredData(params, data):
+    """This function applies the time, price and duration filters requested by the user on the queryset
+
+    Args:
+        params (QueryDict): query parameters of the request
+        data (queryset): queryset containing the entries satisfying source and destination values
+
+    Returns:
+        queryset: updated queryset with the filters applied
+    """
+    deptTimeRange = params.get('depttimerange')
+    arrivalTimeRange = params.get('arrivaltimerange')
+    userMinPrice = params.get('minprice')
+    userMaxPrice = params.get('maxprice')
+    userMinDuration = params.get('minduration')
+    userMaxDuration = params.get('maxduration')
+    
+    if deptTimeRange or arrivalTimeRange:
+        data = timeBasedData(deptTimeRange, arrivalTimeRange, data)
+    
+    if userMinPrice or userMaxPrice:
+        data = priceBasedData(userMinPrice, userMaxPrice, data)
+    
+    if userMinDuration or userMaxDuration:
+        data = durationBasedData(userMinDuration, userMaxDuration, data)
+    
+    return data
@@ -0,0 +1,134 @@
+from contextlib import contextmanager
+from contextvars import ContextVar
+from logging import getLogger
+from time import perf_counter
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.core.signals import request_started
+from django.db import connections
+from django.db.backends.signals import connection_created
+
+logger = getLogger(__name__)
+
+# timings of the request being served in this context, None outside of a timed request
+currentTimings = ContextVar('currentTimings', default=None)
+# statements kept for the slow request log, the queries after these are only counted
+CAPTURED_QUERIES = 100
+
+class RequestTimings:
+    """what a request spent its time on, filled by RequestTimingMiddleware, the query recorder and timed()"""
+
+    def __init__(self):
+        self.queries = 0
+        self.durations = {'db': 0.0, 'serializer': 0.0}
+        self.statements = []
+
+    def query(self, sql, duration):
+        self.queries += 1
+        self.durations['db'] += duration
+        if len(self.statements) < CAPTURED_QUERIES:
+            self.statements.append((sql, duration))
+
+    def add(self, name, duration):
+        self.durations[name] = self.durations.get(name, 0.0) + duration
+
+    def serverTiming(self):
+        """returns the timings as a Server-Timing header value, durations are in milliseconds"""
+        metrics = [f'db;dur={self.durations["db"] * 1000:.2f};desc="{self.queries} queries"']
+        metrics += [f"{name};dur={duration * 1000:.2f}" for name, duration in self.durations.items() if name != 'db']
+        return ", ".join(metrics)
+
+@contextmanager
+def timed(name):
+    """adds the time spent in the block to the given metric of the current request, does nothing when the request isn't timed
+
+    Args:
+        name (str): metric of the Server-Timing header, eg. 'serializer'
+    """
+    timings = currentTimings.get()
+    if timings is None:
+        yield
+        return
+    start = perf_counter()
+    try:
+        yield
+    finally:
+        timings.add(name, perf_counter() - start)
+
+def recordQuery(execute, sql, params, many, context):
+    """database execute wrapper adding every query made during a timed request to its timings, the parameters are never kept since they can hold passwords"""
+    timings = currentTimings.get()
+    if timings is None:
+        return execute(sql, params, many, context)
+    start = perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        timings.query(sql, perf_counter() - start)
+
+def installRecorder(connection, **kwargs):
+    if recordQuery not in connection.execute_wrappers:
+        connection.execute_wrappers.append(recordQuery)
+
+def installRecorders(**kwargs):
+    # connections are per thread (and per task under ASGI), request_started is sent from the thread the request's queries run in
+    for connection in connections.all(initialized_only=True):
+        installRecorder(connection)
+
+class RequestTimingMiddleware:
+    """records the number of queries, the time spent in the database, in the serializers (see timed) and in the view of every request,
+    sends them back in a Server-Timing header and logs the request along with its SQL when it takes more than SLOW_REQUEST_MS or runs more than SLOW_REQUEST_QUERIES queries.
+    It is listed last in MIDDLEWARE so that the view time covers the view alone. Unless REQUEST_TIMING is set it removes itself from the middleware chain, so it costs nothing when disabled
+
+    Args:
+        get_response (callable): next middleware or the view
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if not settings.REQUEST_TIMING:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+        connection_created.connect(installRecorder, dispatch_uid='request_timing_connection')
+        request_started.connect(installRecorders, dispatch_uid='request_timing_request')
+        installRecorders()
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        timings = RequestTimings()
+        token = currentTimings.set(timings)
+        start = perf_counter()
+        try:
+            response = self.get_response(request)
+        finally:
+            currentTimings.reset(token)
+        return self.finish(request, response, timings, perf_counter() - start)
+
+    async def __acall__(self, request):
+        timings = RequestTimings()
+        token = currentTimings.set(timings)
+        start = perf_counter()
+        try:
+            response = await self.get_response(request)
+        finally:
+            currentTimings.reset(token)
+        return self.finish(request, response, timings, perf_counter() - start)
+
+    def finish(self, request, response, timings, elapsed):
+        """adds the Server-Timing header and logs the request if it was slow"""
+        timings.add('view', elapsed)
+        response['Server-Timing'] = timings.serverTiming()
+        if elapsed * 1000 >= settings.SLOW_REQUEST_MS or timings.queries >= settings.SLOW_REQUEST_QUERIES:
+            statements = "\n".join(f"  {duration * 1000:.2f} ms  {sql}" for sql, duration in timings.statements)
+            logger.warning(
+                "Slow request %s %s (%s): %.2f ms, %s queries in %.2f ms\n%s",
+                request.method, request.get_full_path(), response.status_code, elapsed * 1000, timings.queries, timings.durations['db'] * 1000, statements,
+            )
+        return response
@@ -0,0 +1,136 @@
+from django.core import signing
+from django.db.models import Q
+
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.exceptions import NotFound
+from rest_framework.settings import api_settings
+from rest_framework.utils.urls import replace_query_param, remove_query_param
+
+class KeysetPagination(BasePagination):
+    """Cursor based pagination which seeks to the first row after the last one sent instead of counting and skipping rows, so every page costs the same no matter how deep it is.
+    The cursor holds the values of the ordering columns for the boundary row and is signed so that the client can only hand back the cursors it was given.
+
+    Args:
+        BasePagination (class): base pagination class of rest_framework
+    """
+    page_size = api_settings.PAGE_SIZE
+    cursor_query_param = 'cursor'
+    invalid_cursor_message = 'Invalid cursor'
+
+    def paginate_queryset(self, queryset, request, ordering, view=None):
+        """returns a single page of the queryset ordered by the given columns, the last column must be unique (eg. the primary key) so that the order is total
+
+        Args:
+            queryset (queryset): queryset to paginate
+            request (rest_framework.request object): current request, the cursor is read from its query parameters
+            ordering (list): ordering columns as accepted by order_by, eg. ['price', '-departuretime', 'bus_id']
+
+        Returns:
+            list: rows of the requested page
+        """
+        page = self.page_queryset(queryset, request, ordering)
+        return self.page_rows(list(page))
+
+    async def apaginate_queryset(self, queryset, request, ordering, view=None):
+        """same as paginate_queryset but fetches the page with the async ORM"""
+        page = self.page_queryset(queryset, request, ordering)
+        return self.page_rows([row async for row in page])
+
+    def page_queryset(self, queryset, request, ordering):
+        """builds the query of the requested page, one row more than the page size is fetched to know if there is a page after it"""
+        self.request = request
+        self.ordering = list(ordering)
+
+        self.cursor = self.decode_cursor(request)
+        self.reverse = False
+        if self.cursor:
+            position, self.reverse = self.cursor
+            queryset = queryset.filter(self.seek(position, self.reverse))
+
+        order = [self.invert(field) for field in self.ordering] if self.reverse else self.ordering
+        return queryset.order_by(*order)[:self.page_size + 1]
+
+    def page_rows(self, rows):
+        """trims the fetched rows to the page and works out the boundaries of the next and previous pages"""
+        hasMore = len(rows) > self.page_size
+        rows = rows[:self.page_size]
+
+        if self.reverse:
+            rows.reverse()
+            hasNext, hasPrevious = self.cursor is not None, hasMore
+        else:
+            hasNext, hasPrevious = hasMore, self.cursor is not None
+
+        self.nextPosition = self.position(rows[-1]) if hasNext and rows else None
+        self.previousPosition = self.position(rows[0]) if hasPrevious and rows else None
+        return rows
+
+    def get_paginated_response(self, data):
+        return Response({
+            'next': self.get_next_link(),
+            'previous': self.get_previous_link(),
+            'results': data,
+        })
+
+    def get_next_link(self):
+        if self.nextPosition is None:
+            return None
+        return self.link(self.nextPosition, False)
+
+    def get_previous_link(self):
+        if self.previousPosition is None:
+            return None
+        return self.link(self.previousPosition, True)
+
+    def link(self, position, reverse):
+        """builds the url of the page next to (or before when reverse is True) the given boundary row"""
+        url = self.request.build_absolute_uri()
+        url = remove_query_param(url, 'page')
+        cursor = signing.dumps({'p': position, 'r': reverse, 'o': self.ordering}, salt='keyset-cursor', compress=True)
+        return replace_query_param(url, self.cursor_query_param, cursor)
+
+    def decode_cursor(self, request):
+        """reads the cursor from the request
+
+        Returns:
+            tuple: position of the boundary row and whether to page backwards, None if no cursor is given
+
+        Raises:
+            NotFound: if the cursor has been tampered with or was issued for another ordering
+        """
+        encoded = request.query_params.get(self.cursor_query_param)
+        if not encoded:
+            return None
+        try:
+            cursor = signing.loads(encoded, salt='keyset-cursor')
+        except signing.BadSignature:
+            raise NotFound(self.invalid_cursor_message)
+        if cursor.get('o') != self.ordering or len(cursor.get('p', [])) != len(self.ordering):
+            raise NotFound(self.invalid_cursor_message)
+        return cursor['p'], bool(cursor.get('r'))
+
+    def position(self, row):
+        """returns the values of the ordering columns for a row, the rows can be either model objects or dictionaries from values()"""
+        position = []
+        for field in self.ordering:
+            name = field.lstrip('-')
+            value = row[name] if isinstance(row, dict) else getattr(row, name)
+            position.append(value if isinstance(value, (int, str)) else str(value))
+        return position
+
+    def seek(self, position, reverse):
+        """builds the condition selecting the rows that come after the boundary row in the (possibly reversed) ordering, ie. (a, b, c) > (x, y, z) expanded column by column"""
+        condition = Q()
+        equal = Q()
+        for field, value in zip(self.ordering, position):
+            name = field.lstrip('-')
+            descending = field.startswith('-') != reverse
+            lookup = f"{name}__lt" if descending else f"{name}__gt"
+            condition |= equal & Q(**{lookup: value})
+            equal &= Q(**{name: value})
+        return condition
+
+    @staticmethod
+    def invert(field):
+        return field[1:] if field.startswith('-') else f"-{field}"
@@ -0,0 +1,131 @@
+from contextvars import ContextVar
+from random import choice
+from time import time_ns
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+
+from rest_framework.permissions import SAFE_METHODS
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import DEFAULT_DB_ALIAS, connections
+
+class RoutingState:
+    """where the reads of the request being served go, replica is the alias picked for the request once its view allowed reading from the replicas and wrote tells that the request has written to the primary"""
+
+    def __init__(self):
+        self.replica = None
+        self.wrote = False
+
+# routing of the request being served in this context, None outside of a request (management commands, shell) whose reads all stay on the primary
+currentRouting = ContextVar('currentRouting', default=None)
+
+# signed cookie telling which user has just written, the caches are local to each worker process and the next read of the user may be served by any worker
+STICKY_COOKIE = 'primary_sticky'
+STICKY_SALT = 'replica-sticky'
+
+def pinnedToPrimary(request):
+    """tells if the user of the request has written within the last REPLICA_STICKY_SECONDS, their reads stay on the primary until the replicas have caught up with the write.
+    The signature of the cookie carries the time of the write, so a cookie kept for longer than the window no longer pins the reads
+
+    Args:
+        request (request): request being served, the user must be authenticated already
+    """
+    usr = getattr(request, 'user', None)
+    if usr is None or not usr.is_authenticated:
+        return False
+    return request.get_signed_cookie(STICKY_COOKIE, default=None, salt=STICKY_SALT, max_age=settings.REPLICA_STICKY_SECONDS) == str(usr.pk)
+
+def primaryAfterChange(version):
+    """keeps the rest of the request's reads on the primary when the data about to be read changed less than REPLICA_STICKY_SECONDS ago, so that rows of a lagging replica
+    are never cached under the new version of the data
+
+    Args:
+        version (int): version of the data read, the time_ns() at which it last changed (see Buses.cache.routeVersion and Buses.timetable.timetableVersion)
+    """
+    state = currentRouting.get()
+    if state is not None and state.replica is not None and time_ns() - version < settings.REPLICA_STICKY_SECONDS * 1_000_000_000:
+        state.replica = None
+
+class ReplicaRouter:
+    """database router sending the reads of the views which allow it (see ReplicaReadsMixin) to one of the DATABASE_REPLICAS, everything else uses the primary:
+    writes, reads made inside a transaction, reads after the request has written and the reads of a user who has written in the last REPLICA_STICKY_SECONDS
+    """
+
+    def db_for_read(self, model, **hints):
+        state = currentRouting.get()
+        if state is None or state.replica is None or state.wrote or connections[DEFAULT_DB_ALIAS].in_atomic_block:
+            return DEFAULT_DB_ALIAS
+        return state.replica
+
+    def db_for_write(self, model, **hints):
+        state = currentRouting.get()
+        if state is not None:
+            state.wrote = True
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # the replicas hold the same data as the primary
+        return True
+
+    def allow_migrate(self, db, app_label, **hints):
+        return db == DEFAULT_DB_ALIAS
+
+class ReplicaReadsMixin:
+    """lets the reads of a view go to a replica for the GET, HEAD and OPTIONS requests of users who haven't written recently, to be used for views whose data may lag behind by a moment.
+    The user is authenticated on the primary before the switch
+    """
+
+    def initial(self, request, *args, **kwargs):
+        super().initial(request, *args, **kwargs)
+        state = currentRouting.get()
+        if state is not None and settings.DATABASE_REPLICAS and request.method in SAFE_METHODS and not pinnedToPrimary(request):
+            state.replica = choice(settings.DATABASE_REPLICAS)
+
+class ReplicaRoutingMiddleware:
+    """gives every request its own routing state and once a request has written, keeps the reads of its user on the primary for REPLICA_STICKY_SECONDS
+    with a signed cookie (see pinnedToPrimary), which works whichever worker process serves the next request. A client which doesn't keep cookies
+    may read from a lagging replica right after its write. It removes itself from the middleware chain when no replica is configured
+
+    Args:
+        get_response (callable): next middleware or the view
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if not settings.DATABASE_REPLICAS:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        state = RoutingState()
+        token = currentRouting.set(state)
+        try:
+            response = self.get_response(request)
+        finally:
+            currentRouting.reset(token)
+        return self.finish(request, response, state)
+
+    async def __acall__(self, request):
+        state = RoutingState()
+        token = currentRouting.set(state)
+        try:
+            response = await self.get_response(request)
+        finally:
+            currentRouting.reset(token)
+        return self.finish(request, response, state)
+
+    def finish(self, request, response, state):
+        # rest_framework sets the user it authenticated on the django request as well
+        usr = getattr(request, 'user', None)
+        if state.wrote and usr is not None and usr.is_authenticated:
+            response.set_signed_cookie(
+                STICKY_COOKIE, str(usr.pk), salt=STICKY_SALT, max_age=settings.REPLICA_STICKY_SECONDS,
+                secure=request.is_secure(), httponly=True, samesite='Lax',
+            )
+        return response